@@ -0,0 +1,93 @@
+import argparse
+import time
+from gdx import gdx, gdx_sim
+
+
+class LegacyBufferGdx(gdx.gdx):
+    """
+    gdx with the previous read() buffer handling (list of lists with pop(0)), kept for comparison
+    """
+
+    def select_sensors(self, sensors=None):
+        super().select_sensors(sensors)
+        self.buffer = []
+
+    def read(self):
+        retvalues = []
+        values = []
+        if not self.devices:
+            return
+        if self.buffer:
+            for i in range(len(self.buffer)):
+                retvalues.append(self.buffer[i].pop(0))
+            if not self.buffer[0]:
+                self.buffer = []
+        else:
+            self.buffer = []
+            i = 0
+            while i < len(self.devices):
+                if self.devices[i].read():
+                    for sensor in self.enabled_sensors[i]:
+                        values[:] = sensor.values
+                        retvalues.append(values.pop(0))
+                        if values:
+                            self.buffer.append(values)
+                        sensor.clear()
+                        values = []
+                i += 1
+        if not retvalues:
+            return None
+        return retvalues
+
+
+def bench(burst, num_samples, num_sensors, rate, legacy=False):
+    # a simulated GDX-EKG that delivers its packets as fast as they are read
+    ekg = gdx_sim.default_devices()[0]
+    spec = gdx_sim.SimDeviceSpec(ekg.name, "usb", ekg.sensors, burst=burst)
+    backend = gdx_sim.SimGoDirect(devices=[spec], realtime=False)
+
+    bench_gdx = LegacyBufferGdx(backend) if legacy else gdx.gdx(backend)
+    bench_gdx.open(connection="usb", device_to_open=spec.name)
+    bench_gdx.select_sensors(list(range(1, num_sensors + 1)))
+    bench_gdx.start(1000 / rate, confirm=False)
+
+    start = time.perf_counter()
+    for _ in range(num_samples):
+        bench_gdx.read()
+    elapsed = time.perf_counter() - start
+    bench_gdx.stop()
+    bench_gdx.close()
+
+    return num_samples / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--seconds",
+        type=int,
+        help="Length of the simulated recording in seconds",
+        default=600,
+    )
+    parser.add_argument(
+        "--rate",
+        type=int,
+        help="Sampling rate of the simulated device in Hz",
+        default=1000,
+    )
+    parser.add_argument(
+        "--sensors",
+        type=int,
+        choices=[1, 2, 3],
+        help="Number of enabled sensors of the simulated GDX-EKG",
+        default=2,
+    )
+    args = parser.parse_args()
+
+    num_samples = args.seconds * args.rate
+    print(f"gdx.read() throughput, {num_samples} samples at {args.rate} Hz, {args.sensors} sensors")
+    print(f"{'burst':>8} {'deque (reads/s)':>18} {'pop(0) (reads/s)':>18}")
+    for burst in [1, 10, 100, 1000, 10000, 100000]:
+        new = bench(burst, num_samples, args.sensors, args.rate)
+        old = bench(burst, num_samples, args.sensors, args.rate, legacy=True)
+        print(f"{burst:>8} {new:>18,.0f} {old:>18,.0f}")
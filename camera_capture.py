@@ -0,0 +1,55 @@
+import numpy as np
+import cv2
+from preflight import print_qualification, qualify
+from scheduling import ScheduledCapture
+
+
+class CameraCapture(ScheduledCapture):
+    """
+    What the OpenCV cameras (RGBCapture, PT2Capture) share: the driver timestamp of a grabbed
+    frame, the pre-flight check and releasing the camera. Expects the cap, timebase and
+    stop_event attributes, SOURCE (name of the source) and TARGET_FPS of the capture class.
+    """
+
+    SOURCE = None
+    TARGET_FPS = None
+
+    def _driver_timestamp_ns(self):
+        """
+        Timestamp of the grabbed frame from the capture backend (CAP_PROP_POS_MSEC) in nanoseconds,
+        on the clock of the driver. -1 when the backend does not expose one (it reports 0 or less)
+        """
+        pos_msec = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        if not pos_msec or pos_msec <= 0:
+            return -1
+        return int(round(pos_msec * 1e6))
+
+    def preflight(self, seconds=3):
+        """
+        Read frames for a few seconds without storing them and qualify the delivered rate, the
+        inter-frame jitter and the first-frame latency against TARGET_FPS, see preflight.qualify()
+        Args:
+            seconds (float): Duration of the pre-flight capture, default: 3
+        Returns:
+            List with the qualification result of the camera
+        """
+        arrivals = []
+        started_ns = self.timebase.now_ns()
+        end_ns = started_ns + int(seconds * 1e9)
+        while not self.stop_event.is_set():
+            # only the arrival time is needed, the frames are not decoded
+            ret = self.cap.grab()
+            timestamp_ns = self.timebase.now_ns()
+            if ret == False or timestamp_ns > end_ns:
+                break
+            arrivals.append(timestamp_ns)
+
+        result = qualify(self.SOURCE, np.array(arrivals, dtype=np.int64), started_ns, self.TARGET_FPS)
+        print_qualification(result)
+        return [result]
+
+    def close(self):
+        """
+        Release the camera without recording, e.g. when the session is stopped before the start
+        """
+        self.cap.release()
@@ -0,0 +1,88 @@
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# size of the saved figures in pixels
+WIDTH_PX = 1600
+HEIGHT_PX = 500
+DPI = 100
+
+
+def minmax_decimate(x, y, columns=WIDTH_PX):
+    """
+    Reduce a signal to the minimum and maximum of every pixel column, in time order. The line
+    drawn from them looks the same as the line of all samples (peaks and dropouts are kept).
+    Args:
+        x (np.ndarray): Time axis
+        y (np.ndarray): Values
+        columns (int): Number of pixel columns, default: WIDTH_PX
+    Returns:
+        x and y with at most 2 * columns points, unchanged when the signal is short enough
+    """
+    n = len(y)
+    if n <= 2 * columns:
+        return x, y
+
+    # equal buckets, the last one is padded with the last value
+    size = -(-n // columns)
+    buckets = -(-n // size)
+    padded = np.concatenate([y, np.full(buckets * size - n, y[-1], dtype=y.dtype)]).reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    low = np.minimum(offsets + padded.argmin(axis=1), n - 1)
+    high = np.minimum(offsets + padded.argmax(axis=1), n - 1)
+
+    index = np.empty(2 * buckets, dtype=np.int64)
+    index[0::2] = np.minimum(low, high)
+    index[1::2] = np.maximum(low, high)
+    return x[index], y[index]
+
+
+class SignalFigure:
+    """
+    Headless (Agg) figure of one signal. The figure is created once and cleared for every plot,
+    so rendering the figures of many sessions does not create and tear down a figure each time.
+    Nothing is shown, the figure is only saved.
+    Args:
+        width (int): Width in pixels, also the number of columns of the decimation, default: WIDTH_PX
+        height (int): Height in pixels, default: HEIGHT_PX
+        dpi (int): Resolution of the saved figure, default: DPI
+    """
+
+    def __init__(self, width=WIDTH_PX, height=HEIGHT_PX, dpi=DPI):
+        self.columns = width
+        self.figure = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+
+    def render(self, saveloc, x, y, title, label=None, markers=None):
+        """
+        Plot a signal (decimated to the width of the figure) and save it
+        Args:
+            saveloc (str): Path of the image
+            x (np.ndarray): Time axis in seconds
+            y (np.ndarray): Values
+            title (str): Title of the figure
+            label (str): Label of the line, default: None
+            markers (tuple): x and y of points to mark, e.g. detected peaks, default: None
+        """
+        self.ax.cla()
+        plot_x, plot_y = minmax_decimate(np.asarray(x), np.asarray(y), self.columns)
+        self.ax.plot(plot_x, plot_y, linewidth=0.8, label=label)
+        if markers is not None:
+            self.ax.plot(markers[0], markers[1], "x")
+        self.ax.set_title(title)
+        self.ax.set_xlabel("time (s)")
+        self.figure.savefig(saveloc)
+
+
+_figure = None
+
+
+def signal_figure():
+    """
+    The SignalFigure of this process, created on first use and reused afterwards
+    """
+    global _figure
+    if _figure is None:
+        _figure = SignalFigure()
+    return _figure
@@ -0,0 +1,571 @@
+import json
+import os
+import threading
+import zlib
+import numpy as np
+
+
+def write_json_atomic(path, obj):
+    """
+    Write a JSON file through a temporary file, so readers never see a half written file
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_header(save_dir):
+    header_path = os.path.join(save_dir, "header.json")
+    if not os.path.exists(header_path):
+        return None
+    with open(header_path, "r") as f:
+        return json.load(f)
+
+
+class ThermalFrameStore:
+    """
+    Binary store for thermal frames. Frames are appended into preallocated,
+    memory-mappable uint16 .npy chunks, each with matching int64 host and driver
+    timestamp chunks. A small JSON header describes the layout and is rewritten every
+    time a chunk is opened or completed. The open chunk has no count in the header, the
+    reader takes it from the timestamps written so far, so a crashed session stays
+    readable up to its last frame.
+    append() is thread-safe, so the store can be fed by a FrameWriter.
+    Args:
+        save_dir (str): Directory of the thermal images of one subject
+        frame_shape (tuple): Shape of one frame (height, width), default: (120, 160)
+        chunk_size (int): Number of frames per chunk file, default: 256
+    """
+
+    HEADER_NAME = "header.json"
+    FORMAT = "thermal-chunked-v1"
+
+    def __init__(self, save_dir, frame_shape=(120, 160), chunk_size=256):
+        self.save_dir = save_dir
+        self.frame_shape = tuple(frame_shape)
+        self.chunk_size = chunk_size
+        self.num_frames = 0
+        self.chunks = []
+
+        self._frames = None
+        self._timestamps = None
+        self._driver_timestamps = None
+        self._fill = 0
+        self._lock = threading.Lock()
+
+        if not os.path.exists(self.save_dir):
+            os.makedirs(self.save_dir)
+
+        self._write_header()
+
+    def _open_chunk(self):
+        chunk_no = len(self.chunks)
+        frames_name = f"chunk_{chunk_no:04d}.npy"
+        timestamps_name = f"timestamps_{chunk_no:04d}.npy"
+        driver_timestamps_name = f"driver_timestamps_{chunk_no:04d}.npy"
+
+        self._frames = np.lib.format.open_memmap(
+            os.path.join(self.save_dir, frames_name),
+            mode="w+",
+            dtype=np.uint16,
+            shape=(self.chunk_size,) + self.frame_shape,
+        )
+        self._timestamps = np.lib.format.open_memmap(
+            os.path.join(self.save_dir, timestamps_name),
+            mode="w+",
+            dtype=np.int64,
+            shape=(self.chunk_size,),
+        )
+        self._driver_timestamps = np.lib.format.open_memmap(
+            os.path.join(self.save_dir, driver_timestamps_name),
+            mode="w+",
+            dtype=np.int64,
+            shape=(self.chunk_size,),
+        )
+        self._fill = 0
+        self.chunks.append(
+            {
+                "frames": frames_name,
+                "timestamps": timestamps_name,
+                "driver_timestamps": driver_timestamps_name,
+                "count": None,
+            }
+        )
+        self._write_header()
+
+    def _close_chunk(self):
+        self._frames.flush()
+        self._timestamps.flush()
+        self._driver_timestamps.flush()
+        self.chunks[-1]["count"] = self._fill
+        self._frames = None
+        self._timestamps = None
+        self._driver_timestamps = None
+        self._write_header()
+
+    def _write_header(self):
+        header = {
+            "format": self.FORMAT,
+            "dtype": "uint16",
+            "frame_shape": list(self.frame_shape),
+            "chunk_size": self.chunk_size,
+            "num_frames": self.num_frames,
+            "timestamp_unit": "ns",
+            "chunks": self.chunks,
+        }
+        write_json_atomic(os.path.join(self.save_dir, self.HEADER_NAME), header)
+
+    def append(self, frame, timestamp_ns, driver_timestamp_ns=-1):
+        """
+        Append one frame
+        Args:
+            frame (np.ndarray): Y16 frame with shape frame_shape
+            timestamp_ns (int): Host timestamp at grab() in nanoseconds since epoch
+            driver_timestamp_ns (int): Timestamp of the capture backend in nanoseconds on its own clock, -1 if unknown
+        """
+        with self._lock:
+            if self._frames is None:
+                self._open_chunk()
+
+            self._frames[self._fill] = frame
+            self._timestamps[self._fill] = timestamp_ns
+            self._driver_timestamps[self._fill] = driver_timestamp_ns
+            self._fill += 1
+            self.num_frames += 1
+
+            if self._fill == self.chunk_size:
+                self._close_chunk()
+
+    def close(self):
+        """
+        Flush the last (partial) chunk and write the final header
+        """
+        with self._lock:
+            if self._frames is not None:
+                self._close_chunk()
+            else:
+                self._write_header()
+
+
+class ThermalStoreReader:
+    """
+    Read a session written by ThermalFrameStore. Chunks are memory-mapped, so
+    reading a single frame does not load the whole session.
+    Args:
+        save_dir (str): Directory of the thermal images of one subject
+    """
+
+    def __init__(self, save_dir):
+        self.header = _read_header(save_dir)
+        self.save_dir = save_dir
+        self.chunk_size = self.header["chunk_size"]
+        for chunk in self.header["chunks"]:
+            if chunk["count"] is None:
+                # the session crashed while this chunk was open, host timestamps are never 0
+                timestamps = np.load(os.path.join(save_dir, chunk["timestamps"]), mmap_mode="r")
+                chunk["count"] = int(np.count_nonzero(timestamps))
+        self.chunks = [c for c in self.header["chunks"] if c["count"] > 0]
+        self.num_frames = sum(c["count"] for c in self.chunks)
+        self._frames = [None] * len(self.chunks)
+
+    def __len__(self):
+        return self.num_frames
+
+    def __getitem__(self, frame_no):
+        if frame_no < 0:
+            frame_no += self.num_frames
+        if frame_no < 0 or frame_no >= self.num_frames:
+            raise IndexError("frame number out of range")
+
+        chunk_no, offset = divmod(frame_no, self.chunk_size)
+        if self._frames[chunk_no] is None:
+            self._frames[chunk_no] = np.load(
+                os.path.join(self.save_dir, self.chunks[chunk_no]["frames"]),
+                mmap_mode="r",
+            )
+        return self._frames[chunk_no][offset]
+
+    @property
+    def timestamps(self):
+        """
+        int64 nanosecond timestamps of every stored frame
+        """
+        if not self.chunks:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(
+            [
+                np.load(os.path.join(self.save_dir, c["timestamps"]))[: c["count"]]
+                for c in self.chunks
+            ]
+        )
+
+    @property
+    def driver_timestamps(self):
+        """
+        int64 nanosecond timestamps of the capture backend (-1 where unknown), None for sessions
+        recorded without them
+        """
+        if not all("driver_timestamps" in c for c in self.chunks):
+            return None
+        if not self.chunks:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(
+            [
+                np.load(os.path.join(self.save_dir, c["driver_timestamps"]))[: c["count"]]
+                for c in self.chunks
+            ]
+        )
+
+
+class MJPEGSegmentStore:
+    """
+    Store JPEG frames in rotating segment files instead of one file per frame.
+    Each segment is a plain concatenation of JPEG payloads with a sidecar index
+    of fixed-size records (frame number, byte offset, byte size, host and driver
+    timestamp), so any frame can be located in O(1) without scanning the segment.
+    The JSON header is rewritten every time a segment is opened or completed. The open
+    segment has no count in the header, the reader takes it from the size of its index,
+    which is flushed (after the frames) every flush_every frames, so a crashed session
+    stays readable up to its last flushed frame.
+    append() is thread-safe, so the store can be fed by a FrameWriter.
+    Args:
+        save_dir (str): Directory of the RGB images of one subject
+        frames_per_segment (int): Number of frames before rotating to a new segment, default: 900
+        flush_every (int): Number of frames after which the open segment is flushed to disk, default: 32
+    """
+
+    HEADER_NAME = "header.json"
+    FORMAT = "mjpeg-segments-v2"
+    # v1 sessions have no driver timestamp, the readers take the fields from the header
+    FORMATS = ("mjpeg-segments-v1", "mjpeg-segments-v2")
+    INDEX_DTYPE = np.dtype(
+        [
+            ("frame_no", "<i8"),
+            ("offset", "<i8"),
+            ("size", "<i8"),
+            ("timestamp", "<i8"),
+            ("driver_timestamp", "<i8"),
+        ]
+    )
+
+    def __init__(self, save_dir, frames_per_segment=900, flush_every=32):
+        self.save_dir = save_dir
+        self.frames_per_segment = frames_per_segment
+        self.flush_every = flush_every
+        self.num_frames = 0
+        self.segments = []
+
+        self._data = None
+        self._index = None
+        self._fill = 0
+        self._offset = 0
+        self._lock = threading.Lock()
+
+        if not os.path.exists(self.save_dir):
+            os.makedirs(self.save_dir)
+
+        self._write_header()
+
+    def _open_segment(self):
+        segment_no = len(self.segments)
+        data_name = f"segment_{segment_no:04d}.mjpeg"
+        index_name = f"segment_{segment_no:04d}.idx"
+
+        self._data = open(os.path.join(self.save_dir, data_name), "wb")
+        self._index = open(os.path.join(self.save_dir, index_name), "wb")
+        self._fill = 0
+        self._offset = 0
+        self.segments.append({"data": data_name, "index": index_name, "count": None})
+        self._write_header()
+
+    def _close_segment(self):
+        self._data.close()
+        self._index.close()
+        self.segments[-1]["count"] = self._fill
+        self._data = None
+        self._index = None
+        self._write_header()
+
+    def _write_header(self):
+        header = {
+            "format": self.FORMAT,
+            "frames_per_segment": self.frames_per_segment,
+            "num_frames": self.num_frames,
+            "timestamp_unit": "ns",
+            "index_fields": list(self.INDEX_DTYPE.names),
+            "segments": self.segments,
+        }
+        write_json_atomic(os.path.join(self.save_dir, self.HEADER_NAME), header)
+
+    def append(self, frame_no, payload, timestamp_ns, driver_timestamp_ns=-1):
+        """
+        Append one JPEG frame
+        Args:
+            frame_no (int): Frame number assigned by the capture loop
+            payload (bytes): Complete JPEG bytes of the frame
+            timestamp_ns (int): Host timestamp at grab() in nanoseconds since epoch
+            driver_timestamp_ns (int): Timestamp of the capture backend in nanoseconds on its own clock, -1 if unknown
+        """
+        with self._lock:
+            if self._data is None:
+                self._open_segment()
+
+            self._data.write(payload)
+            record = np.array(
+                [(frame_no, self._offset, len(payload), timestamp_ns, driver_timestamp_ns)],
+                dtype=self.INDEX_DTYPE,
+            )
+            self._index.write(record.tobytes())
+
+            self._offset += len(payload)
+            self._fill += 1
+            self.num_frames += 1
+
+            if self._fill == self.frames_per_segment:
+                self._close_segment()
+            elif self._fill % self.flush_every == 0:
+                # the frames first, an index record never points past the end of the data
+                self._data.flush()
+                self._index.flush()
+
+    def close(self):
+        """
+        Close the last (partial) segment and write the final header
+        """
+        with self._lock:
+            if self._data is not None:
+                self._close_segment()
+            else:
+                self._write_header()
+
+
+class MJPEGSegmentReader:
+    """
+    Read a session written by MJPEGSegmentStore. Frames are addressed by their position in
+    frame number order, or by their frame number with frame(), lookups are O(1) through the
+    segment indices (loaded once, a few bytes per frame).
+    Args:
+        save_dir (str): Directory of the RGB images of one subject
+    """
+
+    def __init__(self, save_dir):
+        self.header = _read_header(save_dir)
+        self.save_dir = save_dir
+        self.frames_per_segment = self.header["frames_per_segment"]
+        self.segments = self.header["segments"]
+        self.index_dtype = np.dtype([(name, "<i8") for name in self.header["index_fields"]])
+        self._indices = [None] * len(self.segments)
+        self._records = None
+        self._record_segments = None
+        self._positions = None
+
+        # the open segment of a crashed session has no count, its index is read up to the last
+        # complete record
+        self.num_frames = 0
+        for segment_no in range(len(self.segments)):
+            self.num_frames += len(self._segment_index(segment_no))
+
+    def _segment_index(self, segment_no):
+        if self._indices[segment_no] is None:
+            index_path = os.path.join(self.save_dir, self.segments[segment_no]["index"])
+            count = self.segments[segment_no]["count"]
+            if count is None:
+                count = os.path.getsize(index_path) // self.index_dtype.itemsize
+            self._indices[segment_no] = np.fromfile(index_path, dtype=self.index_dtype, count=count)
+        return self._indices[segment_no]
+
+    def _load_records(self):
+        # sessions written by several unordered writer threads are put in frame order here
+        if self._records is None:
+            indices = [self._segment_index(i) for i in range(len(self.segments))]
+            if not indices:
+                self._records = np.empty(0, dtype=self.index_dtype)
+                self._record_segments = np.empty(0, dtype=np.int64)
+            else:
+                records = np.concatenate(indices)
+                segments = np.concatenate(
+                    [np.full(len(index), i, dtype=np.int64) for i, index in enumerate(indices)]
+                )
+                order = np.argsort(records["frame_no"], kind="stable")
+                self._records = records[order]
+                self._record_segments = segments[order]
+        return self._records
+
+    def __len__(self):
+        return self.num_frames
+
+    def _read(self, position):
+        records = self._load_records()
+        record = records[position]
+        segment_no = self._record_segments[position]
+        with open(
+            os.path.join(self.save_dir, self.segments[segment_no]["data"]), "rb"
+        ) as f:
+            f.seek(int(record["offset"]))
+            return f.read(int(record["size"]))
+
+    def __getitem__(self, position):
+        """
+        Returns the JPEG payload bytes of the frame at this position (in frame number order)
+        """
+        if position < 0:
+            position += self.num_frames
+        if position < 0 or position >= self.num_frames:
+            raise IndexError("frame position out of range")
+        return self._read(position)
+
+    def frame(self, frame_no):
+        """
+        Returns the JPEG payload bytes of the frame with this frame number, frame numbers have
+        gaps when the writer dropped frames
+        """
+        if self._positions is None:
+            frame_nos = self._load_records()["frame_no"]
+            size = int(frame_nos.max()) + 1 if len(frame_nos) else 0
+            self._positions = np.full(size, -1, dtype=np.int64)
+            self._positions[frame_nos] = np.arange(len(frame_nos))
+        if frame_no < 0 or frame_no >= len(self._positions) or self._positions[frame_no] < 0:
+            raise KeyError(f"frame {frame_no} is not stored")
+        return self._read(int(self._positions[frame_no]))
+
+    @property
+    def index(self):
+        """
+        Index records (frame_no, offset, size, timestamp, driver_timestamp) of every stored frame,
+        in frame number order
+        """
+        return self._load_records()
+
+    @property
+    def timestamps(self):
+        """
+        int64 nanosecond timestamps of every stored frame, in frame number order
+        """
+        return self.index["timestamp"]
+
+    @property
+    def driver_timestamps(self):
+        """
+        int64 nanosecond timestamps of the capture backend (-1 where unknown), None for sessions
+        recorded without them
+        """
+        if "driver_timestamp" not in self.index_dtype.names:
+            return None
+        return self.index["driver_timestamp"]
+
+
+class FrameManifest:
+    """
+    Manifest of the frames of one modality of one session, streamed while recording. Every
+    stored frame gets a fixed-size record (frame number, host and driver timestamp, byte size,
+    CRC32 of the stored bytes) in manifest.idx, described by manifest.json, so readers get the
+    count, start, end and gaps of a session without listing or parsing the frame files.
+    append() is thread-safe, so it can be called from the FrameWriter threads.
+    Args:
+        save_dir (str): Directory of one modality of one subject, e.g. dataset/alice/rgb
+        flush_every (int): Number of records after which the manifest is flushed to disk, default: 32
+    """
+
+    INDEX_NAME = "manifest.idx"
+    HEADER_NAME = "manifest.json"
+    FORMAT = "frame-manifest-v1"
+    RECORD_DTYPE = np.dtype(
+        [
+            ("frame_no", "<i8"),
+            ("timestamp", "<i8"),
+            ("driver_timestamp", "<i8"),
+            ("size", "<i8"),
+            ("crc32", "<u4"),
+        ]
+    )
+
+    def __init__(self, save_dir, flush_every=32):
+        self.save_dir = save_dir
+        self.flush_every = flush_every
+        self.num_frames = 0
+        self._lock = threading.Lock()
+
+        if not os.path.exists(self.save_dir):
+            os.makedirs(self.save_dir)
+
+        self._file = open(os.path.join(self.save_dir, self.INDEX_NAME), "wb")
+        self._write_header(complete=False)
+
+    def _write_header(self, complete):
+        write_json_atomic(
+            os.path.join(self.save_dir, self.HEADER_NAME),
+            {
+                "format": self.FORMAT,
+                "timestamp_unit": "ns",
+                "fields": list(self.RECORD_DTYPE.names),
+                "dtypes": [self.RECORD_DTYPE[name].str for name in self.RECORD_DTYPE.names],
+                "num_frames": self.num_frames,
+                "complete": complete,
+            },
+        )
+
+    def append(self, frame_no, timestamp_ns, data, driver_timestamp_ns=-1):
+        """
+        Add the record of one stored frame
+        Args:
+            frame_no (int): Frame number assigned by the capture loop
+            timestamp_ns (int): Host timestamp in nanoseconds since epoch
+            data (bytes): The bytes stored for the frame
+            driver_timestamp_ns (int): Timestamp of the capture backend in nanoseconds, -1 if unknown
+        """
+        record = np.array(
+            [(frame_no, timestamp_ns, driver_timestamp_ns, len(data), zlib.crc32(data))],
+            dtype=self.RECORD_DTYPE,
+        )
+        with self._lock:
+            self._file.write(record.tobytes())
+            self.num_frames += 1
+            if self.num_frames % self.flush_every == 0:
+                self._file.flush()
+
+    def close(self):
+        """
+        Flush the last records and mark the manifest complete
+        """
+        with self._lock:
+            self._file.close()
+            self._write_header(complete=True)
+
+
+def load_manifest(save_dir):
+    """
+    Read the manifest of a session in one shot
+    Returns:
+        Records (frame_no, timestamp, driver_timestamp, size, crc32) sorted by frame number, None
+        for sessions recorded without a manifest
+    """
+    header_path = os.path.join(save_dir, FrameManifest.HEADER_NAME)
+    if not os.path.exists(header_path):
+        return None
+    with open(header_path, "r") as f:
+        header = json.load(f)
+
+    dtype = np.dtype(list(zip(header["fields"], header["dtypes"])))
+    index_path = os.path.join(save_dir, FrameManifest.INDEX_NAME)
+    # a crashed session may end with a partial record
+    count = os.path.getsize(index_path) // dtype.itemsize
+    records = np.fromfile(index_path, dtype=dtype, count=count)
+    # the writer threads can finish frames out of order
+    return records[np.argsort(records["frame_no"], kind="stable")]
+
+
+def is_thermal_store(save_dir):
+    """
+    Check whether a thermal directory was written by ThermalFrameStore
+    """
+    header = _read_header(save_dir)
+    return header is not None and header["format"] == ThermalFrameStore.FORMAT
+
+
+def is_segment_store(save_dir):
+    """
+    Check whether an RGB directory was written by MJPEGSegmentStore
+    """
+    header = _read_header(save_dir)
+    return header is not None and header["format"] in MJPEGSegmentStore.FORMATS
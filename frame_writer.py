@@ -0,0 +1,179 @@
+import queue
+import threading
+
+
+class FrameWriter:
+    """
+    Persist captured frames on background threads, so a slow disk does not stall the capture loop.
+    With several threads the frames finish in any order, the work that must follow the capture
+    order (appending to an indexed store) goes into commit_fn, which is called in queue order.
+    Args:
+        write_fn (callable): Called as write_fn(*item) on a writer thread for every queued item
+        commit_fn (callable): Called as commit_fn(*result) with the result of write_fn, in the order
+            the items were queued (skipping dropped and failed ones), default: None (no commit step)
+        max_queue (int): Maximum number of frames waiting to be written, default: 64
+        num_workers (int): Number of writer threads, default: 1
+        policy (str): What to do when the queue is full, "block", "drop_oldest" or "drop_newest", default: "block"
+        name (str): Name used in the end of session report
+    """
+
+    POLICIES = ("block", "drop_oldest", "drop_newest")
+
+    def __init__(
+        self,
+        write_fn,
+        commit_fn=None,
+        max_queue=64,
+        num_workers=1,
+        policy="block",
+        name="WRITER",
+    ):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+
+        self.write_fn = write_fn
+        self.commit_fn = commit_fn
+        self.max_queue = max_queue
+        self.policy = policy
+        self.name = name
+
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.error = None
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        # sequence number of the next queued item, of the next item to commit, and the results
+        # that finished ahead of it (None for an item that is not committed)
+        self._seq = 0
+        self._next_commit = 0
+        self._ready = {}
+        self._commit_lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def put(self, *item):
+        """
+        Queue one frame for writing. Only blocks when the policy is "block". Raises the error of
+        a failed write, so the capture stops instead of losing the rest of the session
+        """
+        if self.error is not None:
+            raise self.error
+
+        entry = (self._seq, item)
+        if self.policy == "block":
+            self._queue.put(entry)
+        elif self.policy == "drop_newest":
+            try:
+                self._queue.put_nowait(entry)
+            except queue.Full:
+                self.dropped += 1
+                return
+        else:
+            while True:
+                try:
+                    self._queue.put_nowait(entry)
+                    break
+                except queue.Full:
+                    try:
+                        seq, _ = self._queue.get_nowait()
+                        self._queue.task_done()
+                        self.dropped += 1
+                        self._commit(seq, None)
+                    except queue.Empty:
+                        pass
+
+        self._seq += 1
+        self.queued += 1
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                self._queue.task_done()
+                break
+            seq, item = entry
+            result = None
+            try:
+                result = self.write_fn(*item)
+                if self.commit_fn is None:
+                    with self._lock:
+                        self.written += 1
+            except Exception as e:
+                self._fail(e)
+            if self.commit_fn is not None:
+                self._commit(seq, result)
+            self._queue.task_done()
+
+    def _commit(self, seq, result):
+        """
+        Commit the results that are next in queue order, whichever thread finished them
+        """
+        if self.commit_fn is None:
+            return
+        with self._commit_lock:
+            self._ready[seq] = result
+            while self._next_commit in self._ready:
+                result = self._ready.pop(self._next_commit)
+                self._next_commit += 1
+                if result is None:
+                    continue
+                try:
+                    self.commit_fn(*result)
+                    self.written += 1
+                except Exception as e:
+                    self._fail(e)
+
+    def _fail(self, e):
+        with self._lock:
+            self.failed += 1
+            if self.error is None:
+                self.error = e
+
+    @property
+    def depth(self):
+        """
+        Number of frames currently waiting to be written
+        """
+        return self._queue.qsize()
+
+    def stats(self):
+        """
+        Returns a dict with the writer counters
+        """
+        return {
+            "queued": self.queued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "max_depth": self.max_depth,
+            "max_queue": self.max_queue,
+        }
+
+    def close(self):
+        """
+        Wait until every queued frame is written and stop the writer threads
+        """
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def report(self):
+        print(
+            f"[{self.name}] -> written: {self.written}, dropped: {self.dropped}, failed: {self.failed}, "
+            f"max queue depth: {self.max_depth}/{self.max_queue} ({self.policy})"
+        )
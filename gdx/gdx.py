@@ -1,40 +1,97 @@
 # To use Go Direct sensors with Python 3 you must install the godirect module
 # with the command: pip3 install godirect
+# godirect is imported in gdx.__init__(), so the simulated backend (gdx_sim.py) runs without it.
 
-from godirect import GoDirect
-
+import asyncio
+import concurrent.futures
+import json
 import logging
+import os
+import threading
 import time
+from collections import deque
+
+import numpy as np
 
 # gdx_vpython.py contains functions for a canvas with data collection buttons
 from gdx import gdx_vpython
 
 vp = gdx_vpython.ver_vpython()
 
+# the device cache file is shared by all gdx objects of a process
+device_cache_lock = threading.Lock()
+
 
 logging.basicConfig()
+logger = logging.getLogger("gdx")
+# logging.getLogger('gdx').setLevel(logging.INFO)
 # logging.getLogger('godirect').setLevel(logging.DEBUG)
 # logging.getLogger('bleak').setLevel(logging.DEBUG)
 # logging.getLogger('pygatt').setLevel(logging.DEBUG)
 
 
+class SampleClock:
+    """Timestamps the samples of one device from their index, t0 + offset + index * period, so
+    the timestamps are as regular as the device's sampling. t0 is the host time at start(). The
+    offset (start-up delay of the device plus the shortest transfer delay) is the smallest delay
+    between a sample's nominal time and its arrival over the last `window` seconds, so delivery
+    jitter and backed-up blocks do not move the timestamps. The offset follows the drift of the
+    device clock by at most `max_step` of a period per block.
+    Lost packets cannot be seen in the samples, they show up as a lasting increase of the
+    smallest delay, which is counted in `lost` (device clock drift of one whole period counts too).
+
+    Args:
+        t0_ns (int): host time of start() in nanoseconds
+        period_ns (int): sampling period in nanoseconds
+        window (float): seconds over which the smallest delay is taken, default: 2
+        max_step (float): largest change of the offset per block, in periods, default: 0.25
+    """
+
+    def __init__(self, t0_ns, period_ns, window=2.0, max_step=0.25):
+        self.t0_ns = t0_ns
+        self.period_ns = period_ns
+        self.received = 0
+        self.offset_ns = None
+        self.lost = 0
+        self._window_ns = int(window * 1e9)
+        self._max_step_ns = int(period_ns * max_step)
+        # (arrival, delay) with increasing delays, the first one is the smallest in the window
+        self._delays = deque()
+        self._least_delay_ns = None
+
+    def stamp(self, n, host_ns):
+        """Returns the int64 timestamps of the next n samples, the newest one arrived at host_ns."""
+
+        index = self.received + np.arange(n, dtype=np.int64)
+        if n:
+            delay = host_ns - (self.t0_ns + (self.received + n - 1) * self.period_ns)
+            while self._delays and self._delays[-1][1] >= delay:
+                self._delays.pop()
+            self._delays.append((host_ns, delay))
+            while self._delays[0][0] < host_ns - self._window_ns:
+                self._delays.popleft()
+            target = self._delays[0][1]
+
+            if self.offset_ns is None:
+                self.offset_ns = target
+            else:
+                self.offset_ns += min(max(target - self.offset_ns, -self._max_step_ns), self._max_step_ns)
+
+            if self._least_delay_ns is None or target < self._least_delay_ns:
+                self._least_delay_ns = target
+            self.lost = max(self.lost, round((target - self._least_delay_ns) / self.period_ns))
+            self.received += n
+        return self.t0_ns + (self.offset_ns or 0) + index * self.period_ns
+
+
 class gdx:
 
     # 1.0.0 is the first time a version was created. This was when the VPython functions were added
     VERSION = "1.0.0"
 
-    # Variables passed between the gdx functions.
-
-    # devices - a 1D list of the connected Go Direct device objects.
-    devices = []
-    # device_sensors - a 2D list of the sensor numbers selected by the user [[1,2],[1]]
-    device_sensors = []
-    # enabled_sensors - a 2D list of the sensor objects that have been enabled for data collection.
-    enabled_sensors = []
-    # buffer - a 2D list to store the excess data from a sensor when multi-points are collected from a read due to fast collection.
-    buffer = []
-    # ble_open - this is a flag to keep track of when godirect is asked to open ble, to make sure it's not asked twice.
-    ble_open = False
+    # Variables passed between the gdx functions. The device state (devices, sensors, buffer) is
+    # kept per instance in __init__(), so several gdx objects can drive different devices at once.
+
     # is this a vpython program
     vpython = False
     # is there a vpython buttons?
@@ -52,9 +109,56 @@ class gdx:
     # vp start button flag. Use this to determine if gdx.start() or gdx.stop() need to be called
     vp_start_button_flag = False
 
-    def __init__(self):
+    def __init__(self, backend=None, device_cache=None):
+        """Args:
+            backend: 'godirect' for the real devices or 'sim' for the simulated devices of gdx_sim.py.
+            A GoDirect-like object (e.g. a configured gdx_sim.SimGoDirect) can be passed as well.
+            Leave it blank to use the GDX_BACKEND environment variable, default: 'godirect'
+
+            device_cache: path of the file that remembers the USB path or BLE address of every
+            device opened by name, so the next open() can connect without a scan. Set to False to
+            always scan. Leave it blank to use the GDX_DEVICE_CACHE environment variable,
+            default: ~/.gdx_device_cache.json
+        """
 
-        self.godirect = GoDirect(use_ble=False, use_usb=False)
+        # devices - a 1D list of the connected Go Direct device objects.
+        self.devices = []
+        # device_sensors - a 2D list of the sensor numbers selected by the user [[1,2],[1]]
+        self.device_sensors = []
+        # enabled_sensors - a 2D list of the sensor objects that have been enabled for data collection.
+        self.enabled_sensors = []
+        # buffer - a list with one deque per enabled sensor to store the excess data when multi-points are collected
+        # from a read due to fast collection. Values are taken out with popleft(), which is O(1).
+        self.buffer = []
+        # ble_open - this is a flag to keep track of when godirect is asked to open ble, to make sure it's not asked twice.
+        self.ble_open = False
+        # time_to_ready - seconds it took to open the devices in the last open_devices() call
+        self.time_to_ready = None
+        # clock - returns the host time in nanoseconds since epoch used by read_block(), e.g. Timebase.now_ns
+        self.clock = time.time_ns
+        # sample_clocks - one SampleClock per device, created in start(), timestamps the read_block() samples
+        self.sample_clocks = []
+
+        if backend is None:
+            backend = os.environ.get("GDX_BACKEND", "godirect")
+        if backend == "godirect":
+            from godirect import GoDirect
+
+            self.godirect = GoDirect(use_ble=False, use_usb=False)
+        elif backend == "sim":
+            from gdx import gdx_sim
+
+            self.godirect = gdx_sim.SimGoDirect(use_ble=False, use_usb=False)
+        elif isinstance(backend, str):
+            raise ValueError(f"Unknown gdx backend: {backend}. Use 'godirect' or 'sim'.")
+        else:
+            self.godirect = backend
+
+        if device_cache is None:
+            device_cache = os.environ.get(
+                "GDX_DEVICE_CACHE", os.path.join(os.path.expanduser("~"), ".gdx_device_cache.json")
+            )
+        self.device_cache = device_cache
 
     def get_version(self):
         """get the version of the gdx module"""
@@ -63,7 +167,7 @@ class gdx:
         return version
 
     # this open() function combines the original open_ble() and open_usb()
-    def open(self, connection="usb", device_to_open=None):
+    def open(self, connection="usb", device_to_open=None, timeout=30):
         """Open a Go Direct device via Bluetooth or USB for data collection.
 
         Args:
@@ -76,16 +180,18 @@ class gdx:
             "GDX-FOR 071000U9, GDX-HD 151000C1". In addition, if connection='ble', the argument
             can be set to "proximity_pairing" to open the device with the highest
             rssi (closest proximity).
+
+            timeout (float): seconds to wait for each device to open, default: 30
         """
 
         if connection == "ble" or connection == "BLE":
-            self.open_ble(device_to_open)
+            self.open_ble(device_to_open, timeout)
         elif connection == "usb" or connection == "USB":
-            self.open_usb(device_to_open)
+            self.open_usb(device_to_open, timeout)
         else:
             print("Unknown value for connection in gdx.open(). Use 'usb' or 'ble'.")
 
-    def open_usb(self, device_to_open=None):
+    def open_usb(self, device_to_open=None, timeout=30):
         """Discovers all Go Direct devices with a USB connection and opens those devices
         for data collection.
         """
@@ -93,18 +199,23 @@ class gdx:
         # Call the godirect module to open a USB connection
         self.godirect.__init__(use_ble=False, use_usb=True)
 
+        # Try the USB path from the last time this device was opened, before opening every USB device
+        if device_to_open != None and self.open_cached_devices("usb", device_to_open, timeout):
+            return
+
         found_devices, number_found_devices = self.find_devices()
 
         if number_found_devices >= 1:
             # need to have the usb device open in order to get its name
-            open_usb_devices = self.open_all_usb_devices_to_get_name(found_devices)
+            open_usb_devices = self.open_all_usb_devices_to_get_name(found_devices, timeout)
             if open_usb_devices >= 1:
                 if device_to_open != None:
                     self.select_dev_using_sn(found_devices, device_to_open)
+                    self.save_device_cache("usb")
                 else:
                     # if just one device is connected, then automatically connect that device (no prompt)
                     if open_usb_devices == 1:
-                        gdx.devices = found_devices
+                        self.devices = found_devices
                     else:
                         self.user_chooses_device(found_devices)
             else:
@@ -123,7 +234,7 @@ class gdx:
             str6 = " - Open GA (Graphical Analysis) to verify a good connection \n"
             print(str1 + str2 + str3 + str4 + str5 + str6)
 
-    def open_ble(self, device_to_open=None):
+    def open_ble(self, device_to_open=None, timeout=30):
         """Open a Go Direct device via bluetooth for data collection.
 
         Args:
@@ -134,7 +245,7 @@ class gdx:
             can be set to "proximity_pairing" to open the device with the highest rssi (closest proximity).
         """
 
-        if gdx.ble_open == True:
+        if self.ble_open == True:
             # print("open_ble() - ble already open")
             return
 
@@ -144,6 +255,13 @@ class gdx:
         # use_ble_bg equal to True (uncomment the command)
         self.godirect.__init__(use_ble=True, use_ble_bg=False, use_usb=False)
         # self.godirect.__init__(use_ble=True, use_ble_bg=True, use_usb=False)
+
+        # Try the address from the last time this device was opened, before scanning
+        if device_to_open not in (None, "proximity_pairing") and self.open_cached_devices(
+            "ble", device_to_open, timeout
+        ):
+            return
+
         found_devices, number_found_devices = self.find_devices()
 
         # Was there 1 or more Go Direct ble devices found?
@@ -157,14 +275,16 @@ class gdx:
             else:
                 # if it is just 1 device, then connect without the popup
                 if number_found_devices == 1:
-                    gdx.devices = found_devices
+                    self.devices = found_devices
                 else:
                     self.user_chooses_device(found_devices)
 
-            open_success = self.open_selected_device()
+            open_success = self.open_selected_device(timeout)
             if open_success == False:
                 print("Error while trying to open device. ")
                 print("Troubleshoot by opening Graphical Analysis to test")
+            elif device_to_open != None:
+                self.save_device_cache("ble")
 
         else:
             str1 = "No Go Direct device found \n\n"
@@ -174,10 +294,125 @@ class gdx:
             str5 = "Open GA (Graphical Analysis) to verify a good connection \n"
             print(str1 + str2 + str3 + str4 + str5)
 
+    def load_device_cache(self):
+        """Returns the device cache, a dict of device name -> {'connection', 'id', 'backend'}."""
+
+        if not self.device_cache or not os.path.exists(self.device_cache):
+            return {}
+        try:
+            with open(self.device_cache, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logger.warning("device cache %s is unreadable, ignoring it", self.device_cache)
+            return {}
+
+    def save_device_cache(self, connection):
+        """Remember the USB path or BLE address of the opened devices for the next open()."""
+
+        if not self.device_cache or not self.devices:
+            return
+
+        with device_cache_lock:
+            cache = self.load_device_cache()
+            for device in self.devices:
+                device_id = device.id
+                entry = {"connection": connection, "backend": type(self.godirect).__name__}
+                # hidapi paths are bytes
+                if isinstance(device_id, bytes):
+                    entry["id"] = device_id.decode("latin-1")
+                    entry["id_bytes"] = True
+                else:
+                    entry["id"] = device_id
+                cache[str(device.name)] = entry
+
+            tmp_path = f"{self.device_cache}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(cache, f, indent=2)
+                os.replace(tmp_path, self.device_cache)
+            except OSError as e:
+                logger.warning("could not write the device cache %s: %s", self.device_cache, e)
+
+    def device_from_id(self, connection, device_id, name):
+        """Create a device object for a known USB path or BLE address, without a scan."""
+
+        # a backend other than godirect (e.g. gdx_sim) creates its own devices
+        if hasattr(self.godirect, "device_from_id"):
+            return self.godirect.device_from_id(connection, device_id, name)
+
+        if connection == "usb":
+            from godirect.device_usb import GoDirectDeviceUSB
+
+            device = GoDirectDeviceUSB(self.godirect._usb_backend)
+            device.type = "USB"
+        else:
+            from godirect.device_bleak import GoDirectDeviceBleak
+
+            device = GoDirectDeviceBleak(self.godirect._ble_backend)
+            device.type = "BLE"
+        device.id = device_id
+        device.set_name_from_advertisement(name)
+        return device
+
+    def open_cached_devices(self, connection, device_to_open, timeout=30):
+        """Open the devices named in device_to_open with the USB path or BLE address stored in the
+        device cache. This skips the scan (and for USB, opening every device to learn its name).
+        Returns False on a cache miss, or when a cached device did not open or turned out to be
+        another device, and the caller falls back to a full scan.
+        """
+
+        if not self.device_cache:
+            return False
+
+        start_time = time.perf_counter()
+        device_to_open_list = device_to_open.split(", ")
+        cache = self.load_device_cache()
+        backend_name = type(self.godirect).__name__
+
+        devices = []
+        for name in device_to_open_list:
+            entry = cache.get(name)
+            if entry is None or entry["connection"] != connection or entry["backend"] != backend_name:
+                logger.info("device cache miss for %s, scanning", name)
+                return False
+            device_id = entry["id"].encode("latin-1") if entry.get("id_bytes") else entry["id"]
+            try:
+                devices.append(self.device_from_id(connection, device_id, name))
+            except Exception as e:
+                logger.info("device cache entry of %s is not usable (%s), scanning", name, e)
+                return False
+
+        open_results = self.open_devices(devices, timeout)
+        # a USB path can belong to another device after re-plugging, so check the name it reports
+        if all(open_results) and [str(d.name) for d in devices] == device_to_open_list:
+            self.devices = devices
+            if connection == "ble":
+                self.ble_open = True
+            logger.info(
+                "device cache hit for %s, opened in %.2f s",
+                device_to_open,
+                time.perf_counter() - start_time,
+            )
+            return True
+
+        for device, opened in zip(devices, open_results):
+            if opened:
+                try:
+                    device.close()
+                except Exception:
+                    pass
+        logger.info(
+            "device cache entry of %s is stale (%.2f s lost), scanning",
+            device_to_open,
+            time.perf_counter() - start_time,
+        )
+        return False
+
     def find_devices(self):
         """determine how many Go Direct devices are found (usb or ble). Returns a list
         of GoDirectDevice objects and the number of devices.
         """
+        start_time = time.perf_counter()
         try:
             found_devices = self.godirect.list_devices()
             number_found_devices = len(found_devices)
@@ -186,29 +421,20 @@ class gdx:
             # print("No Go Direct devices found")
             found_devices = 0
             number_found_devices = 0
-            gdx.devices = []
+            self.devices = []
         if number_found_devices == 0:
-            gdx.devices = []
+            self.devices = []
+        logger.info("scan found %i device(s) in %.2f s", number_found_devices, time.perf_counter() - start_time)
         return found_devices, number_found_devices
 
-    def open_all_usb_devices_to_get_name(self, found_devices):
+    def open_all_usb_devices_to_get_name(self, found_devices, timeout=30):
         """Unfortunately, cannot get the name (like, 'GDX-FOR 071000U9') from
-        a USB device until it is open. So, open all available USB devices.
+        a USB device until it is open. So, open all available USB devices, all at the same time.
         """
 
         # print("attempting to open", len(found_devices), "device(s)...")
-        i = 0
-        open_usb_devices = 0
-        while i < len(found_devices):
-            try:
-                open_device_success = found_devices[i].open()
-                if open_device_success:
-                    open_usb_devices += 1
-                # print("open device ",i, " = ", open_device_success, sep="")
-                i += 1
-            except:
-                open_usb_devices = 0
-                break
+        open_results = self.open_devices(found_devices, timeout)
+        open_usb_devices = sum(open_results)
 
         return open_usb_devices
 
@@ -230,12 +456,12 @@ class gdx:
             for device in found_devices:
                 if x == str(device.name):
                     # print("device names match = True")
-                    gdx.devices.append(device)
+                    self.devices.append(device)
                 else:
                     # print("device names match = False")
                     pass
 
-        if len(device_to_open_list) == len(gdx.devices):
+        if len(device_to_open_list) == len(self.devices):
             pass
         else:
             print("serial number matching error. Check for typos in device_to_open")
@@ -259,7 +485,7 @@ class gdx:
             print("\n")
             print("One device found. Press 'enter' to connect", end=" ")
             input()
-            gdx.devices.append(found_devices[0])
+            self.devices.append(found_devices[0])
         else:
             print("\n")
             print("- If connecting a single device, type the number (e.g., 1) that")
@@ -272,7 +498,7 @@ class gdx:
             for s in input().split(","):
                 user_selected_device.append(int(s))
             for selected in user_selected_device:
-                gdx.devices.append(found_devices[selected - 1])
+                self.devices.append(found_devices[selected - 1])
             print("\n")
 
     def proximity_pairing(self, found_devices, number_found_devices):
@@ -297,35 +523,103 @@ class gdx:
         x = dmax
         selected = int(x)
         if selected <= number_found_devices:
-            gdx.devices.append(found_devices[selected - 1])
+            self.devices.append(found_devices[selected - 1])
             print("proximity device to open = ", found_devices[selected - 1])
         else:
             print("Error in proximity selection")
 
-    def open_selected_device(self):
+    def open_selected_device(self, timeout=30):
         """Open the device or devices that were selected in one of the cases above."""
 
-        open_success = False
+        print("attempting to open", len(self.devices), "device(s)...")
+        open_results = self.open_devices(self.devices, timeout)
         i = 0
-        print("attempting to open", len(gdx.devices), "device(s)...")
-        while i < len(gdx.devices):
-            try:
-                open_device_success = gdx.devices[i].open()
-                print("open device ", i, " = ", open_device_success, sep="")
-                if open_device_success:
-                    open_success = True
-                    gdx.ble_open = True
-                else:
-                    open_success = False
-                    return open_success
-                time.sleep(1)
-                i += 1
-            except:
-                open_success = False
-                break
+        while i < len(self.devices):
+            print("open device ", i, " = ", open_results[i], sep="")
+            i += 1
+
+        open_success = bool(open_results) and all(open_results)
+        if open_success:
+            self.ble_open = True
 
         return open_success
 
+    def open_devices(self, devices, timeout=30):
+        """Open several devices at the same time, one thread per device. Devices that share an
+        asyncio event loop (the bleak devices of one godirect scan) cannot run it at the same
+        time, so they are opened one after another on the same thread. The time-to-ready is
+        printed and stored in self.time_to_ready.
+
+        Args:
+            devices []: the device objects to open
+            timeout (float): seconds to wait for each device, a device that is not open by then
+            counts as failed
+
+        Returns:
+            open_results[]: True or False for each device
+        """
+
+        open_results = [False] * len(devices)
+        if not devices:
+            return open_results
+
+        # group the devices by their event loop, a device without one gets its own group
+        groups = {}
+        for index, device in enumerate(devices):
+            groups.setdefault(id(getattr(device, "_loop", device)), []).append(index)
+
+        ready_times = [None] * len(devices)
+        start_time = time.perf_counter()
+        # set once the waiting is over, a device that opens after that is closed again by its thread
+        timed_out = threading.Event()
+        lock = threading.Lock()
+
+        def open_group(indices):
+            for index in indices:
+                if timed_out.is_set():
+                    return
+                try:
+                    opened = bool(devices[index].open())
+                except Exception:
+                    opened = False
+                with lock:
+                    if not timed_out.is_set():
+                        open_results[index] = opened
+                        ready_times[index] = time.perf_counter() - start_time
+                        continue
+                if opened:
+                    try:
+                        devices[index].close()
+                    except Exception:
+                        pass
+                    print(f"{devices[index]} opened after the timeout and was closed again")
+                return
+
+        threads = [
+            threading.Thread(target=open_group, args=(indices,), daemon=True)
+            for indices in groups.values()
+        ]
+        for thread in threads:
+            thread.start()
+        # the devices of a group open one after another, so the group gets timeout seconds per device
+        for thread, indices in zip(threads, groups.values()):
+            thread.join(max(timeout * len(indices) - (time.perf_counter() - start_time), 0))
+
+        # a device still opening after the timeout counts as failed, its (daemon) thread closes it
+        with lock:
+            timed_out.set()
+            open_results = [
+                result and ready_time is not None
+                for result, ready_time in zip(open_results, ready_times)
+            ]
+
+        self.time_to_ready = time.perf_counter() - start_time
+        print(
+            f"{sum(open_results)} of {len(devices)} device(s) ready in {self.time_to_ready:.2f} s",
+            "(" + ", ".join(f"{str(d)}: {t:.2f} s" for d, t in zip(devices, ready_times) if t is not None) + ")",
+        )
+        return open_results
+
     def select_sensors(self, sensors=None):
         """Select the sensors you wish to enable for data collection.
 
@@ -338,18 +632,18 @@ class gdx:
         """
 
         # First check to make sure there are devices connected.
-        if not gdx.devices:
+        if not self.devices:
             print("select_sensors() - no device connected")
             return
 
         # If the sensors argument is left blank provide an input prompt for the user to select sensors
         if sensors == None:
             i = 0
-            while i < len(gdx.devices):
+            while i < len(self.devices):
                 selected_sensors = []
                 print("\n")
-                print("List of sensors for", gdx.devices[i])
-                sensors = gdx.devices[i].list_sensors()
+                print("List of sensors for", self.devices[i])
+                sensors = self.devices[i].list_sensors()
                 for s in sensors:
                     c = sensors[s]
                     print(str(c))
@@ -363,7 +657,7 @@ class gdx:
 
                 for x in input().split(","):
                     selected_sensors.append(int(x))
-                gdx.device_sensors.append(selected_sensors)
+                self.device_sensors.append(selected_sensors)
                 i += 1
 
         # If there is a sensor argument, it could be an integer, a list (1D), or a list of lists (2D).
@@ -373,57 +667,58 @@ class gdx:
                 # It is a list. Checks if it is a 2D list
                 if isinstance(sensors[0], list):
                     # Does this 2D sensor list have a list of sensors for each device?
-                    if len(sensors) != len(gdx.devices):
+                    if len(sensors) != len(self.devices):
                         print(
                             "the sensor parameter in select_sensors() does not match number of devices"
                         )
-                        gdx.devices = []
+                        self.devices = []
                         return
                     else:
                         # Save the 2D list of sensors in device_sensors, such as [[1],[1,2,3]]
                         # print("2d list of sensors = ", sensors)
-                        gdx.device_sensors = sensors
+                        self.device_sensors = sensors
                 # it is a 1D list
                 else:
                     # A 1D list is appropriate if one device is connected. Make sure just one device is connected
-                    if len(gdx.devices) != 1:
+                    if len(self.devices) != 1:
                         print(
                             "the sensor parameter in select_sensors() does not match number of devices"
                         )
-                        gdx.devices = []
+                        self.devices = []
                         return
                     else:
                         # Save the 1D list as a 2D list in device_sensors - [[1,2]]
-                        gdx.device_sensors.append(sensors)
+                        self.device_sensors.append(sensors)
             # It's not a list. Check if it is an integer
             else:
                 if isinstance(sensors, int):
                     # sensors are stored as a list, so change the int to a list
                     sensors = [sensors]
                     # Save the 1D list as a 2D list in device_sensors - [[1,2]]
-                    gdx.device_sensors.append(sensors)
+                    self.device_sensors.append(sensors)
 
-        # print("sensors for data collection = ", gdx.device_sensors)
+        # print("sensors for data collection = ", self.device_sensors)
 
         # check to make sure the user setup the device with a valid sensor number
         valid_sensor_num = self.check_sensor_number()
         if valid_sensor_num:
             # Enable the sensors that were selected for data collection.
             i = 0
-            while i < len(gdx.devices):
-                # print("device ",i, " enabled sensors = ", gdx.device_sensors[i], sep="")
-                gdx.devices[i].enable_sensors(sensors=gdx.device_sensors[i])
+            while i < len(self.devices):
+                # print("device ",i, " enabled sensors = ", self.device_sensors[i], sep="")
+                self.devices[i].enable_sensors(sensors=self.device_sensors[i])
                 i += 1
 
             # The enabled sensor objects are stored in a variable, to be used in the read() function.
             i = 0
-            while i < len(gdx.devices):
+            while i < len(self.devices):
                 # The variable "enabled_sensors" is a 2D list that stores each device's enabled sensor objects [[obj],[obj,obj]].
-                gdx.enabled_sensors.append(gdx.devices[i].get_enabled_sensors())
+                self.enabled_sensors.append(self.devices[i].get_enabled_sensors())
                 i += 1
-        # if it's not a valid number then empty the gdx.devices array so that no other functions are called
+            self.buffer = [deque() for sensors in self.enabled_sensors for sensor in sensors]
+        # if it's not a valid number then empty the self.devices array so that no other functions are called
         else:
-            gdx.devices = []
+            self.devices = []
 
     def check_sensor_number(self):
         """check to see if the user set an appropriate, available sensor number for this
@@ -432,9 +727,9 @@ class gdx:
 
         i = 0
         # Get the sensors from each device, one device at a time
-        while i < len(gdx.devices):
+        while i < len(self.devices):
             all_sensor_numbers = []
-            sensors = gdx.devices[i].list_sensors()
+            sensors = self.devices[i].list_sensors()
 
             # the all_sensor_numbers list will be used in the code below to determine incompatible sensors
             for x in sensors:
@@ -442,7 +737,7 @@ class gdx:
                 number = c.sensor_number
                 all_sensor_numbers.append(number)
 
-            sensors_selected_by_user = gdx.device_sensors[i]
+            sensors_selected_by_user = self.device_sensors[i]
             for sensor_selected in sensors_selected_by_user:
                 # print(f"sensor selected = {sensor_selected}, available sensors = {all_sensor_numbers}")
                 if sensor_selected in all_sensor_numbers:
@@ -468,17 +763,19 @@ class gdx:
 
         return valid_sensor_num
 
-    def start(self, period=None):
+    def start(self, period=None, confirm=True):
         """Start collecting data from the sensors that were selected in the select_sensors() function.
 
         Args:
             period (int): If period is left blank, a prompt in the terminal allows the user to enter
             the period (time between samples). To run the code without this prompt, set this argument to
             a period in milliseconds, e.g. period=1000
+            confirm (bool): Ask for confirmation before sampling faster than every 10 ms. Set it to
+            False for unattended runs (e.g. benchmarks), a warning is printed instead.
         """
 
         # First check to make sure there are devices connected.
-        if not gdx.devices:
+        if not self.devices:
             print("start() - no device connected")
             return
 
@@ -511,9 +808,12 @@ class gdx:
 
             # Provide a warning message if the user is attempting fast data collection
             if period < 10:
-                input(
-                    "Be aware that sampling at a period less than 10ms may be problemeatic. Press Enter to continue "
-                )
+                if confirm:
+                    input(
+                        "Be aware that sampling at a period less than 10ms may be problemeatic. Press Enter to continue "
+                    )
+                else:
+                    print("Be aware that sampling at a period less than 10ms may be problemeatic.")
 
         # if this is a vpython program, and this is the very first time that start() has
         # been called, do not start data collection yet. Why? Because the user's vpython
@@ -543,11 +843,18 @@ class gdx:
                 if gdx.vp_first_start == True:
                     gdx.vp_first_start = False
 
-            # Start all devices
+            # store the period of this instance, read_block() uses it to timestamp the samples
+            self.period = period
+
+            # Start all devices, dropping anything left in the buffer from a previous run
+            for sensor_buffer in self.buffer:
+                sensor_buffer.clear()
+            self.sample_clocks = []
             i = 0
-            while i < len(gdx.devices):
+            while i < len(self.devices):
                 # print("start device ", i, sep="")
-                gdx.devices[i].start(period=period)
+                self.sample_clocks.append(SampleClock(self.clock(), int(period * 1e6)))
+                self.devices[i].start(period=period)
                 i += 1
 
     def read(self):
@@ -559,47 +866,38 @@ class gdx:
         """
 
         retvalues = []
-        values = []
 
         # First check to make sure there are devices connected.
-        if not gdx.devices:
+        if not self.devices:
             print("read() - no device connected")
             return
 
-        # Are there data in the buffer? If so, pull data from the buffer to get the retvalues
-        if gdx.buffer:
-            i = 0
-            for i in range(len(gdx.buffer)):
-                pop_values = gdx.buffer[i].pop(0)
-                retvalues.append(pop_values)
-            # if this was the last value in the buffer, clear the list so that it is not a list of empty lists
-            if not gdx.buffer[0]:
-                gdx.buffer = []
-
-        # The buffer is empty, so take readings from the sensor to get retvalues
-        else:
-            gdx.buffer = []
+        # The buffer has one deque per enabled sensor (created in select_sensors)
+        if not self.buffer:
+            self.buffer = [deque() for sensors in self.enabled_sensors for sensor in sensors]
+
+        # The buffer is empty, so take readings from the sensor to fill it
+        if not all(self.buffer):
+            j = 0
             i = 0
             # Read from each device, one at a time
-            while i < len(gdx.devices):
-                if gdx.devices[i].read():
-                    sensors = gdx.enabled_sensors[i]
-                    # Take readings from each sensor in the device, one at time
-                    if sensors:
-                        for sensor in sensors:
-                            # The sensor.values call may read one sensor value, or multiple sensor values (if fast sampling)
-                            values[:] = sensor.values
-                            # Pull the first value off the values list
-                            pop_values = values.pop(0)
-                            # Build a list of each sensors' first value (this builds the return list)
-                            retvalues.append(pop_values)
-                            # Build a list of lists for each sensors data that is not returned and put it in the buffer
-                            if values:
-                                gdx.buffer.append(values)
-                            sensor.clear()
-                            values = []
+            while i < len(self.devices):
+                sensors = self.enabled_sensors[i]
+                if self.devices[i].read():
+                    # Move all readings of each sensor into its buffer. The sensor.values call may hold
+                    # one sensor value, or multiple sensor values (if fast sampling)
+                    for sensor in sensors:
+                        self.buffer[j].extend(sensor.values)
+                        sensor.clear()
+                        j += 1
+                else:
+                    j += len(sensors)
                 i += 1
 
+        # Pull the first value of each sensor off the buffer to build the return list
+        if self.buffer and all(self.buffer):
+            retvalues = [sensor_buffer.popleft() for sensor_buffer in self.buffer]
+
         if not retvalues:
             return None
         else:
@@ -616,6 +914,122 @@ class gdx:
 
             return retvalues
 
+    def read_block(self):
+        """Take all pending readings from the enabled sensors as NumPy arrays, with a timestamp
+        for every sample. Samples are timestamped from their index and the sampling period set in
+        start(), the host clock (self.clock), read right after the device read, only corrects the
+        offset and drift, see SampleClock.
+
+        Returns:
+                    blocks[]: a 1D list with one (timestamps, values) tuple per device. timestamps
+            is an int64 array in nanoseconds since epoch, values is a 2D float64 array with one
+            column per enabled sensor of the device.
+        """
+
+        # First check to make sure there are devices connected.
+        if not self.devices:
+            print("read_block() - no device connected")
+            return
+
+        if not self.buffer:
+            self.buffer = [deque() for sensors in self.enabled_sensors for sensor in sensors]
+
+        blocks = []
+        j = 0
+        i = 0
+        # Read from each device, one at a time
+        while i < len(self.devices):
+            sensors = self.enabled_sensors[i]
+            sensor_buffers = self.buffer[j : j + len(sensors)]
+            j += len(sensors)
+
+            # Move the new readings behind anything still left in the buffer by read()
+            if self.devices[i].read():
+                for sensor, sensor_buffer in zip(sensors, sensor_buffers):
+                    sensor_buffer.extend(sensor.values)
+                    sensor.clear()
+            host_ns = self.clock()
+
+            # Only complete rows are returned, a sensor that is ahead keeps its extra values buffered
+            n = min(len(sensor_buffer) for sensor_buffer in sensor_buffers) if sensors else 0
+            values = np.empty((n, len(sensors)), dtype=np.float64)
+            for col, sensor_buffer in enumerate(sensor_buffers):
+                if len(sensor_buffer) == n:
+                    values[:, col] = sensor_buffer
+                    sensor_buffer.clear()
+                else:
+                    values[:, col] = [sensor_buffer.popleft() for _ in range(n)]
+
+            timestamps = self.sample_clocks[i].stamp(n, host_ns)
+            blocks.append((timestamps, values))
+            i += 1
+
+        return blocks
+
+    def lost_samples(self):
+        """Estimated number of samples lost in transfer since start(), one count per device, see SampleClock."""
+
+        return [sample_clock.lost for sample_clock in self.sample_clocks]
+
+    async def stream(self, max_blocks=64):
+        """Yield sample blocks as they arrive, for use in an asyncio program:
+
+            async for blocks in gdx.stream():
+                timestamps, values = blocks[0]
+
+        The devices are read with read_block() on a reader thread, because godirect reads block
+        (and the bleak devices run their own event loop). Blocks are passed to the event loop
+        through a queue of max_blocks. When the consumer is slow and the queue is full, the reader
+        stops reading and the samples wait in the device, so memory use stays bounded.
+        Stop the stream by leaving the async for loop.
+
+        Args:
+            max_blocks (int): number of blocks that can wait for the consumer, default: 64
+
+        Yields:
+            blocks[]: the read_block() result, one (timestamps, values) tuple per device
+        """
+
+        if not self.devices:
+            print("stream() - no device connected")
+            return
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(max_blocks)
+        stop = threading.Event()
+
+        def put(item):
+            # wait for room in the queue, but give up when the stream is closed
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while not stop.is_set():
+                try:
+                    future.result(0.1)
+                    return
+                except concurrent.futures.TimeoutError:
+                    pass
+            future.cancel()
+
+        def reader():
+            try:
+                while not stop.is_set():
+                    blocks = self.read_block()
+                    if any(len(timestamps) for timestamps, values in blocks):
+                        put(blocks)
+            except Exception as e:
+                put(e)
+
+        thread = threading.Thread(target=reader, name="GDX-STREAM", daemon=True)
+        thread.start()
+        try:
+            while True:
+                blocks = await queue.get()
+                if isinstance(blocks, Exception):
+                    raise blocks
+                yield blocks
+        finally:
+            stop.set()
+            await loop.run_in_executor(None, thread.join)
+
     def readValues(self):
         """Take multiple point readings from the enabled sensors and return the readings as a 2D list.
 
@@ -626,9 +1040,9 @@ class gdx:
         retvalues = []
         i = 0
         # Read from each device, one at a time
-        while i < len(gdx.devices):
-            if gdx.devices[i].read():
-                sensors = gdx.enabled_sensors[i]
+        while i < len(self.devices):
+            if self.devices[i].read():
+                sensors = self.enabled_sensors[i]
                 # Take readings from each sensor in the device, one at time
                 if sensors:
                     for sensor in sensors:
@@ -678,32 +1092,32 @@ class gdx:
         """Stop data collection on the enabled sensors."""
 
         # First check to make sure there are devices connected.
-        if not gdx.devices:
+        if not self.devices:
             print("stop() - no device connected")
             return
 
         i = 0
-        while i < len(gdx.devices):
+        while i < len(self.devices):
             # print("stop device ",i, sep="")
-            gdx.devices[i].stop()
+            self.devices[i].stop()
             i += 1
 
     def close(self):
         """Disconnect the USB or BLE device and quit godirect."""
 
         # First check to make sure there are devices connected.
-        if not gdx.devices:
+        if not self.devices:
             print("close() - no device connected")
             return
 
         i = 0
-        while i < len(gdx.devices):
+        while i < len(self.devices):
             # print("close device ", i, sep="")
-            gdx.devices[i].close()
+            self.devices[i].close()
             i += 1
-        gdx.devices = []
+        self.devices = []
 
-        gdx.ble_open = False
+        self.ble_open = False
         self.godirect.quit()
         # print("quit godirect")
 
@@ -716,7 +1130,7 @@ class gdx:
             includes name, description, battery %, charger state, rssi
         """
 
-        if not gdx.devices:
+        if not self.devices:
             print("device_info - no device connected")
             return
 
@@ -724,26 +1138,26 @@ class gdx:
         device_info = []
 
         # If there is just one device connected, package the info in a 1D list [device info]
-        if len(gdx.devices) == 1:
-            device_info.append(gdx.devices[0]._name)
-            device_info.append(gdx.devices[0]._description)
-            device_info.append(gdx.devices[0]._battery_level_percent)
+        if len(self.devices) == 1:
+            device_info.append(self.devices[0]._name)
+            device_info.append(self.devices[0]._description)
+            device_info.append(self.devices[0]._battery_level_percent)
             charger_state = ["Idle", "Charging", "Complete", "Error"]
-            device_info.append(charger_state[gdx.devices[0]._charger_state])
-            device_info.append(gdx.devices[0]._rssi)
+            device_info.append(charger_state[self.devices[0]._charger_state])
+            device_info.append(self.devices[0]._rssi)
             return device_info
 
         # If there is more than one device connected, package the info in a 2D list [[device0 info], [device1 info]]
         else:
             i = 0
-            while i < len(gdx.devices):
+            while i < len(self.devices):
                 one_device_info = []
-                one_device_info.append(gdx.devices[i]._name)
-                one_device_info.append(gdx.devices[i]._description)
-                one_device_info.append(gdx.devices[i]._battery_level_percent)
+                one_device_info.append(self.devices[i]._name)
+                one_device_info.append(self.devices[i]._description)
+                one_device_info.append(self.devices[i]._battery_level_percent)
                 charger_state = ["Idle", "Charging", "Complete", "Error"]
-                one_device_info.append(charger_state[gdx.devices[i]._charger_state])
-                one_device_info.append(gdx.devices[i]._rssi)
+                one_device_info.append(charger_state[self.devices[i]._charger_state])
+                one_device_info.append(self.devices[i]._rssi)
                 i += 1
                 device_info.append(one_device_info)
             return device_info
@@ -756,7 +1170,7 @@ class gdx:
         with units, e.g. ['Force (N)', 'X-axis acceleration (m/s²)']
         """
 
-        if not gdx.devices:
+        if not self.devices:
             print("enabled_sensor_info() - no device connected")
             return
 
@@ -764,8 +1178,8 @@ class gdx:
 
         i = 0
         # Get the enabled sensors from each device, one device at a time
-        while i < len(gdx.devices):
-            sensors = gdx.enabled_sensors[i]
+        while i < len(self.devices):
+            sensors = self.enabled_sensors[i]
             for sensor in sensors:
                 info = sensor.sensor_description + " (" + sensor.sensor_units + ")"
                 sensor_info.append(info)
@@ -789,7 +1203,7 @@ class gdx:
         sensor at the same time as the EMG sensor.
         """
 
-        if not gdx.devices:
+        if not self.devices:
             print("sensor_info() - no device connected")
             return
 
@@ -798,8 +1212,8 @@ class gdx:
 
         i = 0
         # Get the sensors from each device, one device at a time
-        while i < len(gdx.devices):
-            sensors = gdx.devices[i].list_sensors()
+        while i < len(self.devices):
+            sensors = self.devices[i].list_sensors()
 
             # the all_sensor_numbers list will be used in the code below to determine incompatible sensors
             for x in sensors:
@@ -855,7 +1269,7 @@ class gdx:
         # The first time you call this function set init = True, the following times set init = False.
         if init == True:
             self.godirect.__init__(use_ble=True, use_usb=False)
-            gdx.ble_open = False
+            self.ble_open = False
             print("Begin search for ble devices...")
 
         # Find all available bluetooth devices
@@ -919,7 +1333,7 @@ class gdx:
         # gdx_vpython.py module in the collect_button() function
 
         # First check to make sure there are devices connected.
-        if not gdx.devices:
+        if not self.devices:
             print("vp_close_button() - no device connected")
             close_button_state = True
         else:
@@ -943,7 +1357,7 @@ class gdx:
         else:
             # if there are meters, update their values using a short data collection loop
             if gdx.vpython_meters:
-                for device in gdx.devices:
+                for device in self.devices:
                     device.start(period=250)
                 for x in range(4):
                     # The read() function has code to send the value to the meter
@@ -963,7 +1377,7 @@ class gdx:
         """
 
         # First check to make sure there are devices connected.
-        if not gdx.devices:
+        if not self.devices:
             print("vp_collect_button() - no device connected")
             return
 
@@ -990,3 +1404,49 @@ class gdx:
         """
         period = vp.slider_get()
         return period
+
+
+async def stream_devices(gdx_objects, max_blocks=64):
+    """Stream several gdx objects (e.g. one per device) concurrently in one event loop:
+
+        async for index, blocks in stream_devices([ecg_gdx, rb_gdx]):
+            ...
+
+    Args:
+        gdx_objects []: gdx objects that are opened, with their sensors selected and started
+        max_blocks (int): number of blocks that can wait for the consumer, default: 64
+
+    Yields:
+        (index, blocks): the position of the gdx object in gdx_objects and its stream() blocks
+    """
+
+    queue = asyncio.Queue(max_blocks)
+
+    async def forward(index, gdx_object):
+        # the bounded queue passes the backpressure on to every stream
+        stream = gdx_object.stream(max_blocks)
+        try:
+            async for blocks in stream:
+                await queue.put((index, blocks))
+        finally:
+            await stream.aclose()
+
+    tasks = [asyncio.ensure_future(forward(i, g)) for i, g in enumerate(gdx_objects)]
+    try:
+        while True:
+            get = asyncio.ensure_future(queue.get())
+            done, pending = await asyncio.wait(tasks + [get], return_when=asyncio.FIRST_COMPLETED)
+            if get in done:
+                yield get.result()
+                continue
+            get.cancel()
+            # a stream ended, re-raise its error
+            for task in done:
+                task.result()
+            tasks = [task for task in tasks if not task.done()]
+            if not tasks:
+                return
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
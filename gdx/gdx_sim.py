@@ -0,0 +1,320 @@
+# Simulated Go Direct backend. It mimics the parts of the godirect module used by gdx.py
+# (GoDirect, the device objects and their sensors), so gdx and the Vernier capture can be
+# load-tested without GDX-EKG / GDX-RB hardware.
+#
+#   g = gdx.gdx(backend="sim")   or   GDX_BACKEND=sim python vernier_capture.py ...
+
+import math
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+
+class SimSensorSpec:
+    """One sensor channel of a simulated device.
+
+    Args:
+        number (int): sensor number used in select_sensors()
+        description (str): sensor description, e.g. 'EKG'
+        units (str): sensor units, e.g. 'mV'
+        waveform (function): maps sample times in seconds (np.ndarray) to values
+        exclusion_mask (int): bit mask of the sensor numbers that cannot run at the same time
+    """
+
+    def __init__(self, number, description, units, waveform, exclusion_mask=0):
+        self.number = number
+        self.description = description
+        self.units = units
+        self.waveform = waveform
+        self.exclusion_mask = exclusion_mask
+
+
+class SimDeviceSpec:
+    """A simulated Go Direct device and how its packets are delivered.
+
+    Args:
+        name (str): device name with serial number, e.g. 'GDX-EKG 0U1000S2'
+        connection (str): 'usb' or 'ble'
+        sensors (list): SimSensorSpec objects of the device
+        burst (int): number of samples per sensor delivered by one read(), default: 1
+        jitter (float): maximum extra delay of a packet in seconds, default: 0
+        dropout (float): probability that a packet is lost, default: 0
+        rssi (int): signal strength reported before the device is opened, default: -50
+        open_delay (float): seconds open() takes (in realtime mode), default: 0
+    """
+
+    def __init__(self, name, connection, sensors, burst=1, jitter=0.0, dropout=0.0, rssi=-50, open_delay=0.0):
+        self.name = name
+        self.connection = connection
+        self.sensors = sensors
+        self.burst = burst
+        self.jitter = jitter
+        self.dropout = dropout
+        self.rssi = rssi
+        self.open_delay = open_delay
+
+
+def ecg_waveform(heart_rate=70):
+    """Synthetic ECG in mV: P, Q, R, S and T waves as gaussians repeated every beat."""
+
+    beat = 60 / heart_rate
+    # (position in the beat, width, amplitude) of each wave
+    waves = [(0.2, 0.025, 0.15), (0.36, 0.010, -0.10), (0.4, 0.012, 1.2), (0.44, 0.010, -0.25), (0.65, 0.040, 0.3)]
+
+    def waveform(t):
+        phase = np.mod(t, beat) / beat
+        ecg = np.zeros_like(t)
+        for position, width, amplitude in waves:
+            ecg += amplitude * np.exp(-(((phase - position) * beat) ** 2) / (2 * width**2))
+        return ecg
+
+    return waveform
+
+
+def respiration_waveform(breath_rate=15, baseline=5.0, depth=1.5):
+    """Synthetic respiration belt force in N, a slow sine around the belt tension."""
+
+    frequency = breath_rate / 60
+
+    def waveform(t):
+        return baseline + depth * np.sin(2 * math.pi * frequency * t)
+
+    return waveform
+
+
+def constant_waveform(value):
+    """A channel that always reads the same value, e.g. a computed heart or respiration rate."""
+
+    def waveform(t):
+        return np.full(len(t), float(value))
+
+    return waveform
+
+
+def default_devices(burst=None, jitter=None, dropout=None):
+    """The devices of our rig: GDX-EKG over USB and GDX-RB over bluetooth. The delivery settings
+    default to the GDX_SIM_BURST, GDX_SIM_JITTER and GDX_SIM_DROPOUT environment variables, so
+    the capture scripts can be run against a misbehaving device without changing them.
+    """
+
+    if burst is None:
+        burst = int(os.environ.get("GDX_SIM_BURST", 1))
+    if jitter is None:
+        jitter = float(os.environ.get("GDX_SIM_JITTER", 0))
+    if dropout is None:
+        dropout = float(os.environ.get("GDX_SIM_DROPOUT", 0))
+
+    ekg_sensors = [
+        SimSensorSpec(1, "EKG", "mV", ecg_waveform(), exclusion_mask=0b1000),
+        SimSensorSpec(2, "Heart Rate", "bpm", constant_waveform(70)),
+        SimSensorSpec(3, "EMG", "mV", constant_waveform(0), exclusion_mask=0b0010),
+    ]
+    rb_sensors = [
+        SimSensorSpec(1, "Force", "N", respiration_waveform()),
+        SimSensorSpec(2, "Respiration Rate", "bpm", constant_waveform(15)),
+    ]
+    return [
+        SimDeviceSpec("GDX-EKG 0U1000S2", "usb", ekg_sensors, burst, jitter, dropout, open_delay=0.5),
+        SimDeviceSpec("GDX-RB 0K1002H6", "ble", rb_sensors, burst, jitter, dropout, open_delay=2.0),
+    ]
+
+
+class SimSensor:
+    """Stand-in for a godirect sensor. read() appends new samples to values."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.sensor_number = spec.number
+        self.sensor_description = spec.description
+        self.sensor_units = spec.units
+        self._mutual_exclusion_mask = spec.exclusion_mask
+        self.values = []
+
+    def clear(self):
+        self.values = []
+
+    def __str__(self):
+        return f"{self.sensor_number}: {self.sensor_description} ({self.sensor_units})"
+
+
+class SimDevice:
+    """Stand-in for a godirect device. Once started, read() blocks until the next packet is
+    due, like the real device, and delivers spec.burst samples per enabled sensor. A packet
+    can arrive up to spec.jitter seconds late or be lost (spec.dropout), the samples of a lost
+    packet are never delivered.
+
+    Args:
+        spec (SimDeviceSpec): the simulated device
+        realtime (bool): wait for the packets in real time. Set to False to deliver them as
+            fast as possible (benchmarks), default: True
+        seed (int): seed of the jitter and dropout random numbers, default: None
+    """
+
+    def __init__(self, spec, realtime=True, seed=None):
+        self.spec = spec
+        self.realtime = realtime
+        self.id = spec.name
+        self.name = spec.name
+        self.type = spec.connection.upper()
+        self.rssi = spec.rssi
+
+        self._name = spec.name
+        self._description = spec.name.split(" ")[0]
+        self._battery_level_percent = 100
+        self._charger_state = 0
+        self._rssi = spec.rssi
+
+        self._sensors = {s.number: SimSensor(s) for s in spec.sensors}
+        self._enabled = []
+        self._random = random.Random(seed)
+        self._opened = False
+        self._started = False
+        self._period = 0.1
+        self._start_time = 0.0
+        self._sample_no = 0
+        self._due = 0.0
+
+        self.packets_sent = 0
+        self.packets_dropped = 0
+
+    def __str__(self):
+        return self.name
+
+    def open(self, auto_start=False):
+        if self.realtime and self.spec.open_delay > 0:
+            time.sleep(self.spec.open_delay)
+        self._opened = True
+        return True
+
+    def list_sensors(self):
+        return self._sensors
+
+    def enable_sensors(self, sensors):
+        self._enabled = [self._sensors[number] for number in sensors]
+
+    def get_enabled_sensors(self):
+        return self._enabled
+
+    def start(self, period=None):
+        if not self._opened:
+            return False
+        if period is not None:
+            self._period = period / 1000
+        for sensor in self._enabled:
+            sensor.clear()
+        self._start_time = time.monotonic()
+        self._sample_no = 0
+        self._due = self._next_due()
+        self._started = True
+        return True
+
+    def _next_due(self):
+        due = self._start_time + (self._sample_no + self.spec.burst) * self._period
+        if self.spec.jitter > 0:
+            due += self._random.uniform(0, self.spec.jitter)
+        return due
+
+    def read(self, timeout=5000):
+        if not self._started:
+            return False
+
+        deadline = time.monotonic() + timeout / 1000
+        while True:
+            if self.realtime:
+                if self._due > deadline:
+                    time.sleep(max(deadline - time.monotonic(), 0))
+                    return False
+                delay = self._due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            first = self._sample_no
+            self._sample_no += self.spec.burst
+            self._due = self._next_due()
+
+            if self.spec.dropout > 0 and self._random.random() < self.spec.dropout:
+                self.packets_dropped += 1
+                continue
+
+            t = np.arange(first, self._sample_no) * self._period
+            for sensor in self._enabled:
+                sensor.values.extend(sensor.spec.waveform(t).tolist())
+            self.packets_sent += 1
+            return True
+
+    def stop(self):
+        self._started = False
+        return True
+
+    def close(self):
+        self._started = False
+        self._opened = False
+        return True
+
+
+class SimGoDirect:
+    """Stand-in for godirect.GoDirect. list_devices() returns the simulated devices of the
+    enabled transports. gdx.py calls __init__() again to switch between USB and bluetooth,
+    so the device specs are kept unless new ones are passed.
+
+    Args:
+        use_ble (bool): list the bluetooth devices, default: True
+        use_ble_bg (bool): ignored, kept for the godirect signature
+        use_usb (bool): list the USB devices, default: True
+        devices (list): SimDeviceSpec objects, default: default_devices()
+        realtime (bool): see SimDevice, default: True
+        seed (int): see SimDevice, default: None
+        scan_delay (dict): seconds list_devices() takes per transport (in realtime mode),
+            default: {'usb': 0.1, 'ble': 5.0}, the bluetooth scan time of godirect
+    """
+
+    def __init__(
+        self, use_ble=True, use_ble_bg=False, use_usb=True, devices=None, realtime=None, seed=None, scan_delay=None
+    ):
+        if devices is not None or not hasattr(self, "specs"):
+            self.specs = devices if devices is not None else default_devices()
+            self.realtime = True if realtime is None else realtime
+            self.seed = seed
+            self.scan_delay = scan_delay if scan_delay is not None else {"usb": 0.1, "ble": 5.0}
+            self._lock = threading.Lock()
+            self._devices = {}
+        elif realtime is not None:
+            self.realtime = realtime
+        self.use_ble = use_ble or use_ble_bg
+        self.use_usb = use_usb
+
+    def _device(self, spec):
+        if spec.name not in self._devices:
+            self._devices[spec.name] = SimDevice(spec, self.realtime, self.seed)
+        return self._devices[spec.name]
+
+    def list_devices(self):
+        if self.realtime:
+            time.sleep(
+                (self.scan_delay["usb"] if self.use_usb else 0) + (self.scan_delay["ble"] if self.use_ble else 0)
+            )
+
+        found_devices = []
+        with self._lock:
+            for spec in self.specs:
+                if (spec.connection == "usb" and self.use_usb) or (spec.connection == "ble" and self.use_ble):
+                    found_devices.append(self._device(spec))
+        return found_devices
+
+    def device_from_id(self, connection, device_id, name):
+        """Returns the device with a known id without a scan, like gdx does with its device cache."""
+
+        with self._lock:
+            for spec in self.specs:
+                if spec.name == device_id and spec.connection == connection:
+                    return self._device(spec)
+        raise LookupError(f"no simulated {connection} device with id {device_id}")
+
+    def quit(self):
+        with self._lock:
+            for device in self._devices.values():
+                device.close()
+            self._devices = {}
@@ -0,0 +1,161 @@
+import queue
+import time
+import numpy as np
+
+
+class MetricsPublisher:
+    """
+    Live metrics of one capture loop. tick() is called once per loop iteration and only stores
+    the loop time, about once per second a summary (effective rate, late iterations, dropped
+    frames, writer backlog, p50/p99 loop time) is sent to the channel. Publishing never blocks
+    the capture: when the channel is full the summary is skipped.
+    Args:
+        name (str): Name of the worker shown in the dashboard, e.g. "rgb" or "vernier-ecg"
+        channel (Queue): multiprocessing.Queue of the capture supervisor, None disables publishing
+        expected_rate (float): Nominal frame/sample rate in Hz, default: None
+        late_after (float): Loop iterations longer than this many seconds count as late, default: None (not counted)
+        interval (float): Seconds between two summaries, default: 1.0
+        max_loops (int): Maximum number of loop times kept per interval, default: 4096
+    """
+
+    def __init__(
+        self,
+        name,
+        channel=None,
+        expected_rate=None,
+        late_after=None,
+        interval=1.0,
+        max_loops=4096,
+    ):
+        self.name = name
+        self.channel = channel
+        self.expected_rate = expected_rate
+        self.late_after_ns = int(late_after * 1e9) if late_after else None
+        self.interval_ns = int(interval * 1e9)
+
+        self.total = 0
+        self.late = 0
+        self._loop_ns = np.empty(max_loops, dtype=np.int64)
+        self._loops = 0
+        self._count = 0
+        self._last_tick = None
+        self._last_publish = time.perf_counter_ns()
+
+    def tick(self, count=1):
+        """
+        Record one loop iteration
+        Args:
+            count (int): Number of frames/samples read in this iteration, default: 1
+        """
+        if self.channel is None:
+            return
+
+        now = time.perf_counter_ns()
+        if self._last_tick is not None:
+            loop_ns = now - self._last_tick
+            if self._loops < len(self._loop_ns):
+                self._loop_ns[self._loops] = loop_ns
+                self._loops += 1
+            if self.late_after_ns is not None and loop_ns > self.late_after_ns:
+                self.late += 1
+        self._last_tick = now
+        self._count += count
+        self.total += count
+
+    def publish(self, phase, dropped=0, backlog=0, max_backlog=None, recorded=None, failed=0):
+        """
+        Send a summary when the interval has passed
+        Args:
+            phase (str): "preroll" before the start time, "recording" inside the recording window
+            dropped (int): Frames/samples dropped so far, e.g. by the writer overflow policy
+            backlog (int): Frames/rows waiting to be written
+            max_backlog (int): Capacity of the writer queue, default: None
+            recorded (int): Frames/samples stored so far, default: None
+            failed (int): Frames whose write failed so far, default: 0
+        """
+        if self.channel is None:
+            return
+
+        now = time.perf_counter_ns()
+        elapsed = now - self._last_publish
+        if elapsed < self.interval_ns:
+            return
+
+        loops = self._loop_ns[: self._loops]
+        summary = {
+            "worker": self.name,
+            "phase": phase,
+            "rate": self._count / (elapsed / 1e9),
+            "expected_rate": self.expected_rate,
+            "total": self.total,
+            "recorded": recorded,
+            "late": self.late if self.late_after_ns is not None else None,
+            "dropped": dropped,
+            "failed": failed,
+            "backlog": backlog,
+            "max_backlog": max_backlog,
+            "loop_p50_ms": float(np.percentile(loops, 50)) / 1e6 if len(loops) else None,
+            "loop_p99_ms": float(np.percentile(loops, 99)) / 1e6 if len(loops) else None,
+        }
+        try:
+            self.channel.put_nowait(summary)
+        except queue.Full:
+            pass
+
+        self._loops = 0
+        self._count = 0
+        self._last_publish = now
+
+
+class MetricsDashboard:
+    """
+    Console view of the metrics of all capture workers, printed by the supervisor
+    Args:
+        channel (Queue): multiprocessing.Queue the workers publish to
+        interval (float): Seconds between two prints, default: 1.0
+    """
+
+    def __init__(self, channel, interval=1.0):
+        self.channel = channel
+        self.interval = interval
+        self.latest = {}
+        self._fresh = False
+        self._last_print = time.monotonic()
+
+    def poll(self):
+        """
+        Take all waiting summaries and print the dashboard when the interval has passed
+        """
+        while True:
+            try:
+                summary = self.channel.get_nowait()
+            except queue.Empty:
+                break
+            self.latest[summary["worker"]] = summary
+            self._fresh = True
+
+        if self._fresh and time.monotonic() - self._last_print >= self.interval:
+            self._last_print = time.monotonic()
+            self._fresh = False
+            print(self.render())
+
+    def render(self):
+        lines = ["[METRICS]"]
+        for name in sorted(self.latest):
+            m = self.latest[name]
+            rate = f"{m['rate']:.1f}"
+            if m["expected_rate"]:
+                rate += f"/{m['expected_rate']:g}"
+            backlog = f"{m['backlog']}" + (f"/{m['max_backlog']}" if m["max_backlog"] else "")
+            loop = (
+                f"p50 {m['loop_p50_ms']:.1f} ms p99 {m['loop_p99_ms']:.1f} ms"
+                if m["loop_p50_ms"] is not None
+                else "-"
+            )
+            recorded = m["recorded"] if m["recorded"] is not None else "-"
+            late = m["late"] if m["late"] is not None else "-"
+            lines.append(
+                f"  {name:<12} {m['phase']:<9} rate {rate:>11} Hz | recorded {recorded} | "
+                f"late {late} | dropped {m['dropped']} | failed {m['failed']} | backlog {backlog} | loop {loop}"
+            )
+        return "\n".join(lines)
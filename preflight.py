@@ -0,0 +1,93 @@
+import numpy as np
+
+# the capture classes start reading 3 seconds before the start time, a source that needs
+# longer than this for its first frame misses the start of the recording
+READ_LEAD = 3
+
+
+def qualify(name, arrivals_ns, started_ns, target_rate, counts=None, warn_ratio=0.97, fail_ratio=0.9):
+    """
+    Qualify the delivery of one source from a short pre-flight capture (kept in memory only)
+    Args:
+        name (str): Name of the source, e.g. "rgb" or "vernier-ecg"
+        arrivals_ns (np.ndarray): Timebase nanoseconds at which every frame (or sample block) arrived
+        started_ns (int): Timebase nanoseconds at which the reading was started
+        target_rate (float): Requested frame/sample rate in Hz
+        counts (np.ndarray): Frames/samples per arrival, default: one each
+        warn_ratio (float): Warn when the delivered rate is below this part of the target, default: 0.97
+        fail_ratio (float): Fail when the delivered rate is below this part of the target, default: 0.9
+    Returns:
+        dict with the delivered rate, the inter-arrival times and jitter in ms, the first-frame
+        latency in s, "status" ("ok", "warn" or "fail") and the "problems" found
+    """
+    arrivals_ns = np.asarray(arrivals_ns, dtype=np.int64)
+    counts = np.ones(len(arrivals_ns), dtype=np.int64) if counts is None else np.asarray(counts)
+    result = {
+        "source": name,
+        "target_rate": target_rate,
+        "arrivals": int(len(arrivals_ns)),
+        "frames": int(counts.sum()),
+        "rate": None,
+        "interval_p50_ms": None,
+        "interval_p99_ms": None,
+        "jitter_ms": None,
+        "first_frame_latency_s": None,
+        "status": "ok",
+        "problems": [],
+    }
+
+    if len(arrivals_ns) < 2:
+        result["status"] = "fail"
+        result["problems"].append(f"only {len(arrivals_ns)} frame(s) delivered")
+        if len(arrivals_ns):
+            result["first_frame_latency_s"] = (int(arrivals_ns[0]) - started_ns) / 1e9
+        return result
+
+    # the rate counts what arrived after the first arrival, over the time since the first arrival
+    intervals_ms = np.diff(arrivals_ns) / 1e6
+    rate = counts[1:].sum() / ((arrivals_ns[-1] - arrivals_ns[0]) / 1e9)
+    result.update(
+        {
+            "rate": float(rate),
+            "interval_p50_ms": float(np.percentile(intervals_ms, 50)),
+            "interval_p99_ms": float(np.percentile(intervals_ms, 99)),
+            "jitter_ms": float(np.std(intervals_ms)),
+            "first_frame_latency_s": (int(arrivals_ns[0]) - started_ns) / 1e9,
+        }
+    )
+
+    def problem(status, message):
+        if status == "fail" or result["status"] == "ok":
+            result["status"] = status
+        result["problems"].append(message)
+
+    if target_rate:
+        if rate < fail_ratio * target_rate:
+            problem("fail", f"delivers {rate:.2f} Hz, target {target_rate:g} Hz")
+        elif rate < warn_ratio * target_rate:
+            problem("warn", f"delivers {rate:.2f} Hz, target {target_rate:g} Hz")
+        # a stall of several frame periods shows up as a gap in the data
+        if result["interval_p99_ms"] > 3 * 1000 * counts[1:].mean() / target_rate:
+            problem("warn", f"p99 inter-frame time {result['interval_p99_ms']:.1f} ms")
+    if result["first_frame_latency_s"] >= READ_LEAD:
+        problem("fail", f"first frame after {result['first_frame_latency_s']:.2f} s")
+    return result
+
+
+def print_qualification(result):
+    """
+    One line per source, e.g. for the capture logs
+    """
+
+    def show(value, fmt):
+        return format(value, fmt) if value is not None else "-"
+
+    line = (
+        f"[PREFLIGHT] -> {result['source']:<12} {result['status']:<4} "
+        f"rate {show(result['rate'], '.2f')}/{show(result['target_rate'], 'g')} Hz | "
+        f"interval p50 {show(result['interval_p50_ms'], '.1f')} ms p99 {show(result['interval_p99_ms'], '.1f')} ms | "
+        f"jitter {show(result['jitter_ms'], '.2f')} ms | first frame {show(result['first_frame_latency_s'], '.2f')} s"
+    )
+    if result["problems"]:
+        line += " | " + "; ".join(result["problems"])
+    print(line)
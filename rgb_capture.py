@@ -3,13 +3,81 @@ import numpy as np
 import cv2
 import os
 import argparse
+import threading
+from frame_store import FrameManifest, MJPEGSegmentStore
+from camera_capture import CameraCapture
+from frame_writer import FrameWriter
+from metrics import MetricsPublisher
+from scheduling import PreRollBuffer, sleep_until
+from timebase import Timebase
 
 
-class RGBCapture:
+# JPEG start (SOI) and end (EOI) of image markers
+JPEG_SOI = b"\xff\xd8"
+JPEG_EOI = b"\xff\xd9"
+
+
+def is_mjpeg_payload(img):
+    """
+    True if a frame from cap.retrieve() is the compressed MJPEG buffer (CAP_PROP_CONVERT_RGB=0)
+    instead of a decoded BGR image, i.e. a single row of bytes starting with the JPEG SOI marker
+    """
+    if img.dtype != np.uint8 or not (img.ndim == 1 or img.shape[0] == 1):
+        return False
+    return img.size >= 2 and img.ravel()[:2].tobytes() == JPEG_SOI
+
+
+def trim_mjpeg_payload(img):
+    """
+    JPEG bytes of an MJPEG buffer up to the last EOI marker. Some backends hand out the whole
+    driver buffer, padded after the end of the image. A buffer without EOI (truncated frame) is
+    kept as it is
+    Args:
+        img (np.ndarray): MJPEG buffer from cap.retrieve(), see is_mjpeg_payload()
+    Returns:
+        The JPEG bytes of the frame
+    """
+    payload = img.tobytes()
+    end = payload.rfind(JPEG_EOI)
+    if end < 0:
+        return payload
+    return payload[: end + len(JPEG_EOI)]
+
+
+def decode_mjpeg(payload):
+    """
+    Decode a stored MJPEG payload to a BGR image, for preview or verification only
+    Args:
+        payload (bytes or np.ndarray): Compressed JPEG bytes of one frame
+    """
+    buffer = np.frombuffer(payload, dtype=np.uint8)
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+class RGBCapture(CameraCapture):
     """
     Capturing RGB images from camera
+    Args:
+        subject_name (str): Name of the subject
+        record_start_time (str or datetime): Start time of the recording in the format of "HH:MM:SS", None to set it later with set_start_time()
+        device_id (int): Device ID of the camera
+        save_path (str): Directory of Dataset
+        duration (int): Duration of capturing in seconds
+        writer_workers (int): Number of background writer threads, default: 2
+        queue_size (int): Maximum number of frames waiting to be written, default: 64
+        overflow_policy (str): "block", "drop_oldest" or "drop_newest" when the queue is full, default: "block"
+        preroll (float): Seconds of frames before the start time to keep (less than 3), default: 0
+        passthrough (bool): Store the camera's MJPEG payload as-is instead of decoding and re-encoding every frame, default: False
+        output_format (str): "jpg" for one JPEG file per frame, "segments" for rotating MJPEG segments with an index, default: "jpg"
+        stop_event (Event): Stops the capture early when set (threading or multiprocessing), default: None
+        timebase (Timebase): Session clock shared with the other workers, default: a new one
+        metrics (Queue): Channel of the capture supervisor for live metrics (about 1 Hz), default: None
     """
 
+    SOURCE = "rgb"
+    # frame rate requested from the camera, checked by preflight()
+    TARGET_FPS = 30
+
     def __init__(
         self,
         subject_name,
@@ -17,7 +85,18 @@ class RGBCapture:
         device_id=1,
         save_path="./dataset",
         duration=10,
+        writer_workers=2,
+        queue_size=64,
+        overflow_policy="block",
+        preroll=0,
+        passthrough=False,
+        output_format="jpg",
+        stop_event=None,
+        timebase=None,
+        metrics=None,
     ):
+        if output_format not in ("jpg", "segments"):
+            raise ValueError(f"Unknown output format: {output_format}")
 
         cap = cv2.VideoCapture(
             device_id, cv2.CAP_DSHOW
@@ -25,7 +104,7 @@ class RGBCapture:
 
         cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
         cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-        cap.set(cv2.CAP_PROP_FPS, 30)
+        cap.set(cv2.CAP_PROP_FPS, self.TARGET_FPS)
 
         # disable auto exposure
         cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 0)
@@ -38,8 +117,10 @@ class RGBCapture:
         cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter.fourcc("M", "J", "P", "G"))
         # cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter.fourcc("Y", "U", "Y", "2"))
         # cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
-        
 
+        # keep the compressed MJPEG buffer, frames are only decoded on demand
+        if passthrough:
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
 
         if not cap.isOpened():
             print("RGB Camera not found!")
@@ -48,71 +129,175 @@ class RGBCapture:
         self.cap = cap
         self.save_path = save_path
         self.duration = duration
-        self.subject_name = subject_name
-        self.record_start_time = dt.datetime.combine(
-            dt.date.today(), dt.datetime.strptime(record_start_time, "%H:%M:%S").time()
-        )
+        self.writer_workers = writer_workers
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.preroll = preroll
+        self.passthrough = passthrough
+        self.output_format = output_format
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        self.timebase = timebase if timebase is not None else Timebase()
+        self.metrics = metrics
+        self.record_start_time = None
+        if record_start_time is not None:
+            self.set_start_time(record_start_time)
 
-        # check if time is in the past
-        if self.record_start_time - dt.timedelta(seconds=4) < dt.datetime.now():
-            raise ValueError(
-                "Start time is in the past. Please enter a valid start time."
-            )
+        # frames are only read from 3 seconds before the start time
+        if not 0 <= self.preroll < 3:
+            raise ValueError("Pre-roll must be between 0 and 3 seconds.")
 
-        self.record_end_time = self.record_start_time + dt.timedelta(
-            seconds=self.duration
-        )
+        self.set_subject(subject_name)
+
+    def set_subject(self, subject_name, duration=None):
+        """
+        Set the subject (and the duration) of the next session, the camera stays open
+        Args:
+            subject_name (str): Name of the subject
+            duration (int): Duration of capturing in seconds, default: keep the current one
+        """
+        self.subject_name = subject_name
+        if duration is not None:
+            self.duration = duration
 
         if not os.path.exists(self.save_path + "/" + self.subject_name + "/rgb"):
             os.makedirs(self.save_path + "/" + self.subject_name + "/rgb")
             print("Created folder for RGB images")
 
+    def _write_frame(self, frame_no, timestamp_ns, img, driver_timestamp_ns=-1):
+        # runs on several writer threads, frames finish in any order
+        if is_mjpeg_payload(img):
+            # the payload already is a complete JPEG, no re-encode needed
+            payload = trim_mjpeg_payload(img)
+        else:
+            payload = cv2.imencode(".jpg", img)[1].tobytes()
+
+        if self.store is None:
+            timestamp = dt.datetime.fromtimestamp(timestamp_ns / 1e9)
+            filename = f"{frame_no}_{timestamp.strftime('%Y%m%d_%H%M%S_%f')}.jpg"
+            filepath = f"{self.save_path}/{self.subject_name}/rgb/{filename}"
+            with open(filepath, "wb") as f:
+                f.write(payload)
+        return frame_no, timestamp_ns, payload, driver_timestamp_ns
+
+    def _commit_frame(self, frame_no, timestamp_ns, payload, driver_timestamp_ns):
+        # called in frame order, so the segment index and the manifest follow the frame numbers
+        if self.store is not None:
+            self.store.append(frame_no, payload, timestamp_ns, driver_timestamp_ns)
+        self.manifest.append(frame_no, timestamp_ns, payload, driver_timestamp_ns)
+
     def start_capture_rgb(self):
         """
         Capturing RGB images from camera
+        Returns:
+            Stats of the session (frames written and dropped, writer queue depth)
         """
+        if self.record_start_time is None:
+            raise ValueError("No start time. Use set_start_time() first.")
 
-        cnt = 0
         frame_no = 0
+        preroll = PreRollBuffer(self.preroll)
+        passthrough_checked = False
+        self.store = None
+        if self.output_format == "segments":
+            self.store = MJPEGSegmentStore(
+                f"{self.save_path}/{self.subject_name}/rgb"
+            )
+        self.manifest = FrameManifest(f"{self.save_path}/{self.subject_name}/rgb")
+        self.timebase.save(
+            f"{self.save_path}/{self.subject_name}/rgb",
+            self.record_start_time,
+            self.record_end_time,
+        )
+        writer = FrameWriter(
+            self._write_frame,
+            commit_fn=self._commit_frame,
+            max_queue=self.queue_size,
+            num_workers=self.writer_workers,
+            policy=self.overflow_policy,
+            name="RGBCAPTURE",
+        )
 
-        while dt.datetime.now() <= self.record_start_time - dt.timedelta(seconds=3):
-            if cnt == 0:
-                print(
-                    f"[RGBCAPTURE] -> Waiting for start time {self.record_start_time.strftime('%H:%M:%S')}..."
-                )
-                print(f"Time Remaining: {self.record_start_time - dt.datetime.now()}")
-                cnt += 1
+        print(
+            f"[RGBCAPTURE] -> Waiting for start time {self.record_start_time.strftime('%H:%M:%S')}..."
+        )
+        print(f"Time Remaining: {self.record_start_time - dt.datetime.now()}")
+        sleep_until(self.record_start_time - dt.timedelta(seconds=self.read_lead), stop_event=self.stop_event)
+
+        # one clock reading per frame, compared with the recording window in nanoseconds
+        start_ns = self.timebase.to_ns(self.record_start_time)
+        end_ns = self.timebase.to_ns(self.record_end_time)
+
+        # a frame that takes more than 1.5 frame periods to arrive counts as late
+        metrics = MetricsPublisher(
+            "rgb",
+            self.metrics,
+            expected_rate=self.TARGET_FPS,
+            late_after=1.5 / self.TARGET_FPS,
+        )
 
-        print(f"Capturing RGB Images... (-3 seconds)")
+        print(f"Capturing RGB Images... (-{self.read_lead:g} seconds)")
         # cv2.namedWindow("PreviewRGB", cv2.WINDOW_NORMAL) #TODO: hide preview window
-        while True:
-            ret, img = self.cap.read()
-
-            if ret == False:
-                raise Exception("Error reading image")
-            # cv2.imshow("PreviewRGB", img) #TODO: hide preview window
-            key = cv2.waitKey(1)
-            if key == ord("q"):
-                break
-
-            if (
-                dt.datetime.now() <= self.record_end_time
-                and dt.datetime.now() >= self.record_start_time
-            ):
-                filename = (
-                    f"{frame_no}_{dt.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jpg"
-                )
-                cv2.imwrite(
-                    f"{self.save_path}/{self.subject_name}/rgb/{filename}",
-                    img,
+        try:
+            while not self.stop_event.is_set():
+                # stamp the frame right when it is grabbed, decoding (retrieve) comes afterwards
+                if self.cap.grab() == False:
+                    raise Exception("Error reading image")
+                timestamp_ns = self.timebase.now_ns()
+                driver_timestamp_ns = self._driver_timestamp_ns()
+                metrics.tick()
+
+                ret, img = self.cap.retrieve()
+                if ret == False:
+                    raise Exception("Error reading image")
+
+                if self.passthrough and not passthrough_checked:
+                    if not is_mjpeg_payload(img):
+                        print("[RGBCAPTURE] -> Backend delivered decoded frames, falling back to JPEG encoding")
+                    passthrough_checked = True
+
+                # cv2.imshow("PreviewRGB", decode_mjpeg(img) if is_mjpeg_payload(img) else img) #TODO: hide preview window
+                key = cv2.waitKey(1)
+                if key == ord("q"):
+                    break
+
+                if start_ns <= timestamp_ns <= end_ns:
+                    # flush the pre-roll frames first, they keep their own timestamps
+                    for preroll_ns, (frame, preroll_driver_ns) in preroll.drain():
+                        writer.put(frame_no, preroll_ns, frame, preroll_driver_ns)
+                        frame_no += 1
+
+                    writer.put(frame_no, timestamp_ns, img, driver_timestamp_ns)
+                    frame_no += 1
+                elif timestamp_ns < start_ns:
+                    preroll.push(timestamp_ns, (img, driver_timestamp_ns))
+
+                metrics.publish(
+                    "recording" if timestamp_ns >= start_ns else "preroll",
+                    dropped=writer.dropped,
+                    failed=writer.failed,
+                    backlog=writer.depth,
+                    max_backlog=writer.max_queue,
+                    recorded=frame_no,
                 )
-                frame_no += 1
 
-            if dt.datetime.now() > self.record_end_time:
-                break
+                if timestamp_ns > end_ns:
+                    break
+        finally:
+            # write the queued frames and the final index, also when the loop or a write failed
+            try:
+                writer.close()
+            finally:
+                if self.store is not None:
+                    self.store.close()
+                self.manifest.close()
+                writer.report()
 
         # cv2.destroyAllWindows() #TODO: hide preview window
 
+        stats = writer.stats()
+        stats["stopped_early"] = self.stop_event.is_set()
+        return stats
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -138,10 +323,57 @@ if __name__ == "__main__":
         help="Device ID of the camera",
         default=2,
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of background writer threads",
+        default=2,
+    )
+    parser.add_argument(
+        "--queue",
+        type=int,
+        help="Maximum number of frames waiting to be written",
+        default=64,
+    )
+    parser.add_argument(
+        "--overflow",
+        type=str,
+        choices=list(FrameWriter.POLICIES),
+        help="What to do when the writer queue is full",
+        default="block",
+    )
+    parser.add_argument(
+        "--passthrough",
+        action="store_true",
+        default=False,
+        help="Store the camera's MJPEG payload without decoding and re-encoding",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=["jpg", "segments"],
+        help="Output format: one JPEG per frame (jpg) or rotating MJPEG segments with an index (segments)",
+        default="jpg",
+    )
+    parser.add_argument(
+        "--preroll",
+        type=float,
+        help="Seconds of frames before the start time to keep",
+        default=0,
+    )
 
     args = parser.parse_args()
     RGBCapture(
-        args.name, args.stime, duration=args.duration, device_id=args.device
+        args.name,
+        args.stime,
+        duration=args.duration,
+        device_id=args.device,
+        writer_workers=args.workers,
+        queue_size=args.queue,
+        overflow_policy=args.overflow,
+        preroll=args.preroll,
+        passthrough=args.passthrough,
+        output_format=args.format,
     ).start_capture_rgb()
 
     # subject_name = "alice"
@@ -1,7 +1,464 @@
 import argparse
-import subprocess
 import datetime as dt
-from pygrabber.dshow_graph import FilterGraph
+import functools
+import json
+import multiprocessing as mp
+import os
+import queue
+import sys
+import time
+import traceback
+from frame_store import write_json_atomic
+from metrics import MetricsDashboard
+from timebase import Timebase
+
+# workers need at least this long between the start instant being handed out and the start of
+# the recording (capture classes start reading 3 seconds early and refuse a start time < 4 s away)
+START_MARGIN = 5
+# batch sessions after the first: the devices are already streaming, the workers read them only this
+# many seconds before the start (enough for the pre-roll), and the start is this close at the earliest.
+# set_start_time() refuses a start less than lead + 1 s away when the command reaches the worker, the
+# other 0.5 s cover the command queue and a worker still busy with its session stats. A "margin" in
+# the session plan overrides it, e.g. with the round-trip measured on a faster machine
+REARM_LEAD = 1
+REARM_MARGIN = REARM_LEAD + 1.5
+# seconds the other workers get to flush their data after a failure, before they are terminated
+STOP_GRACE = 30
+
+
+def capture_worker(name, options, status, commands, stop_event, preflight_seconds=0):
+    """
+    Run one capture (rgb, thermal or vernier) in its own process. The worker opens its device,
+    qualifies the delivered rate (pre-flight), reports "armed" with the pre-flight results, waits
+    for a session from the supervisor, records and reports "done" with
+    its stats (or "error" with the traceback) and is armed again for the next session. The
+    device stays open until the supervisor sends None.
+    Args:
+        name (str): "rgb", "thermal" or "vernier"
+        options (dict): Keyword arguments of the capture class
+        status (Queue): (name, state, payload) messages to the supervisor
+        commands (Queue): (subject name, duration, start instant, lead in seconds or None) of the
+            next session from the supervisor, None to stop
+        stop_event (Event): Set by the supervisor to stop all workers early
+        preflight_seconds (float): Duration of the pre-flight capture, 0 to skip it, default: 0
+    """
+    try:
+        # only import what this worker needs, e.g. the vernier worker never loads cv2
+        if name == "rgb":
+            from rgb_capture import RGBCapture
+
+            capture = RGBCapture(record_start_time=None, stop_event=stop_event, **options)
+            start_capture = capture.start_capture_rgb
+        elif name == "thermal":
+            from thermal_capture import PT2Capture
+
+            capture = PT2Capture(record_start_time=None, stop_event=stop_event, **options)
+            start_capture = capture.start_capture_pt
+        elif name == "vernier":
+            from vernier_capture import DEVICE_PRESETS, VernierCapture
+
+            devices = [DEVICE_PRESETS[d] for d in options.pop("devices")]
+            capture = VernierCapture(
+                record_start_time=None, devices=devices, stop_event=stop_event, **options
+            )
+            start_capture = functools.partial(capture.start_capture_vernier, keep_open=True)
+        else:
+            raise ValueError(f"Unknown capture worker: {name}")
+
+        preflight = capture.preflight(preflight_seconds) if preflight_seconds > 0 else None
+        while True:
+            status.put((name, "armed", preflight))
+            preflight = None
+            session = commands.get()
+            if session is None:
+                capture.close()
+                status.put((name, "stopped", None))
+                return
+
+            subject_name, duration, record_start_time, lead = session
+            if subject_name is not None:
+                capture.set_subject(subject_name, duration)
+            if lead is None:
+                capture.set_start_time(record_start_time)
+            else:
+                capture.set_start_time(record_start_time, lead=max(lead, capture.preroll))
+            status.put((name, "done", start_capture()))
+    except BaseException:
+        status.put((name, "error", traceback.format_exc()))
+        sys.exit(1)
+
+
+class CaptureSupervisor:
+    """
+    Start the capture workers as processes, wait until every device is armed, hand out one
+    shared start instant per session and collect the stats and exit codes. The workers keep
+    their devices open between sessions, so a batch of subjects pays the device setup once.
+    Before arming, every source is qualified with a short pre-flight capture, the results are
+    saved to preflight.json in the folder of every session. When a worker fails, all the other
+    workers are stopped (their data so far is flushed to disk). While waiting, the live metrics
+    of the workers are printed as one dashboard about once per second.
+    Args:
+        workers (dict): name -> keyword arguments of the capture class, see capture_worker()
+        arm_timeout (float): Seconds to wait for all workers to be armed, default: 120
+        preflight_seconds (float): Duration of the pre-flight capture, 0 to skip it, default: 3
+        preflight_policy (str): "refuse" to not arm when a source fails its pre-flight, "warn" to
+            only print a warning, default: "refuse"
+    """
+
+    def __init__(self, workers, arm_timeout=120, preflight_seconds=3, preflight_policy="refuse"):
+        if preflight_policy not in ("refuse", "warn"):
+            raise ValueError(f"Unknown pre-flight policy: {preflight_policy}")
+
+        self.workers = workers
+        self.arm_timeout = arm_timeout
+        self.preflight_seconds = preflight_seconds
+        self.preflight_policy = preflight_policy
+        self.preflight = {}
+        self.status = mp.Queue()
+        self.stop_event = mp.Event()
+        self.commands = {name: mp.Queue() for name in workers}
+        self.processes = {}
+        self.states = {name: "starting" for name in workers}
+        self.results = {}
+        self.failed = False
+        self.fail_time = None
+        # one clock for the whole session, every worker timestamps on it
+        self.timebase = Timebase()
+        # bounded, the workers skip a summary instead of blocking when the launcher falls behind
+        self.metrics = mp.Queue(maxsize=1000)
+        self.dashboard = MetricsDashboard(self.metrics)
+
+    def _handle(self, timeout):
+        """
+        Handle one status message, or check for workers that died without one
+        """
+        self.dashboard.poll()
+        try:
+            name, state, payload = self.status.get(timeout=timeout)
+        except queue.Empty:
+            for name, process in self.processes.items():
+                if process.exitcode is not None and self.states[name] in ("starting", "armed", "recording"):
+                    self.states[name] = "error"
+                    self.results[name] = f"exited with code {process.exitcode}"
+                    self._fail(name)
+            return
+
+        if state == "armed" and self.states[name] == "starting":
+            print(f"[SUPERVISOR] -> {name} armed")
+            if payload is not None:
+                self.preflight[name] = payload
+        self.states[name] = state
+        if state == "done":
+            self.results[name] = payload
+        elif state == "error":
+            self.results[name] = payload
+            print(f"[SUPERVISOR] -> {name} failed:\n{payload}")
+            self._fail(name)
+
+    def _fail(self, name):
+        if not self.failed:
+            print(f"[SUPERVISOR] -> Stopping all workers because {name} failed")
+            self.fail_time = time.monotonic()
+        self.failed = True
+        self.stop_event.set()
+        # workers that are still waiting for the start instant stop right away
+        for commands in self.commands.values():
+            commands.put(None)
+
+    def _wait_armed(self, timeout):
+        """
+        Wait until every worker is armed
+        Returns:
+            Seconds it took, None when a worker failed or was not armed in time
+        """
+        arm_start = time.monotonic()
+        deadline = arm_start + timeout
+        while not self.failed and any(state != "armed" for state in self.states.values()):
+            if time.monotonic() > deadline:
+                waiting = [name for name, state in self.states.items() if state != "armed"]
+                self.results.update({name: "not armed in time" for name in waiting})
+                self._fail(", ".join(waiting))
+                break
+            self._handle(timeout=0.1)
+        if self.failed:
+            return None
+        return time.monotonic() - arm_start
+
+    def start(self):
+        """
+        Start the workers and wait until every device is open
+        Returns:
+            True when all workers are armed
+        """
+        for name, options in self.workers.items():
+            options = dict(options, timebase=self.timebase, metrics=self.metrics)
+            process = mp.Process(
+                target=capture_worker,
+                args=(
+                    name,
+                    options,
+                    self.status,
+                    self.commands[name],
+                    self.stop_event,
+                    self.preflight_seconds,
+                ),
+                name=f"CAPTURE-{name.upper()}",
+            )
+            process.start()
+            self.processes[name] = process
+
+        # wait until every worker has opened its device
+        time_to_arm = self._wait_armed(self.arm_timeout)
+        if time_to_arm is None:
+            return False
+        print(f"[SUPERVISOR] -> All workers armed in {time_to_arm:.2f} s")
+        return self._check_preflight()
+
+    def _check_preflight(self):
+        """
+        Refuse to record (or warn) when a source did not deliver its target rate in the pre-flight
+        """
+        problems = {"fail": [], "warn": []}
+        for name, results in self.preflight.items():
+            for result in results:
+                if result["status"] in problems:
+                    problems[result["status"]].append(f"{result['source']} ({'; '.join(result['problems'])})")
+
+        if problems["warn"]:
+            print(f"[SUPERVISOR] -> Pre-flight warning: {', '.join(problems['warn'])}")
+        if problems["fail"]:
+            print(f"[SUPERVISOR] -> Pre-flight failed: {', '.join(problems['fail'])}")
+            if self.preflight_policy == "refuse":
+                for name, results in self.preflight.items():
+                    if any(result["status"] == "fail" for result in results):
+                        self.results[name] = "failed pre-flight"
+                self._fail("the pre-flight")
+                return False
+        return True
+
+    def _save_preflight(self, subject_name):
+        options = next(iter(self.workers.values()))
+        if subject_name is None:
+            subject_name = options["subject_name"]
+        save_dir = options.get("save_path", "./dataset") + "/" + subject_name
+        os.makedirs(save_dir, exist_ok=True)
+        write_json_atomic(
+            save_dir + "/preflight.json",
+            {
+                "seconds": self.preflight_seconds,
+                "policy": self.preflight_policy,
+                "sources": [result for results in self.preflight.values() for result in results],
+            },
+        )
+
+    def run_session(self, record_start_time, subject_name=None, duration=None, rearmed=False, margin=None):
+        """
+        Record one session with the armed workers and wait until they are armed again
+        Args:
+            record_start_time (str or datetime): Requested start time, "HH:MM:SS" today or a datetime.
+                It is postponed when it is too close for the workers.
+            subject_name (str): Subject of the session, default: the subject the workers were started with
+            duration (int): Duration of the session in seconds, default: the current one of the workers
+            rearmed (bool): The workers were re-armed after a session of the same batch, their devices
+                are warm and the start can be REARM_MARGIN away instead of START_MARGIN, default: False
+            margin (float): Seconds the start of a re-armed session is away at the earliest, more than
+                REARM_LEAD + 1, default: REARM_MARGIN
+        Returns:
+            name -> (state, stats or error) of every worker
+        """
+        from scheduling import parse_start_time
+
+        self.results = {}
+        if not self.failed:
+            if self.preflight:
+                self._save_preflight(subject_name)
+            start_time = parse_start_time(record_start_time)
+            if rearmed:
+                earliest = dt.datetime.now() + dt.timedelta(seconds=REARM_MARGIN if margin is None else margin)
+            else:
+                earliest = dt.datetime.now() + dt.timedelta(seconds=START_MARGIN)
+            if start_time < earliest:
+                start_time = earliest.replace(microsecond=0) + dt.timedelta(seconds=1)
+                print(f"[SUPERVISOR] -> Start time postponed to {start_time.strftime('%H:%M:%S')}")
+            lead = REARM_LEAD if rearmed else None
+            for name in self.workers:
+                self.states[name] = "recording"
+                self.commands[name].put((subject_name, duration, start_time, lead))
+
+        # wait until every worker has finished the session
+        while any(state == "recording" for state in self.states.values()):
+            self._handle(timeout=0.5)
+            if self.failed and time.monotonic() - self.fail_time > STOP_GRACE:
+                self._terminate()
+        session = {name: (self.states[name], self.results.get(name)) for name in self.workers}
+
+        # the devices are still open, re-arming only resets the capture objects
+        time_to_arm = self._wait_armed(timeout=STOP_GRACE)
+        if time_to_arm is not None:
+            print(f"[SUPERVISOR] -> All workers re-armed in {time_to_arm:.3f} s")
+        return session
+
+    def _terminate(self):
+        for name, state in self.states.items():
+            if state in ("starting", "armed", "recording"):
+                print(f"[SUPERVISOR] -> {name} did not stop, terminating it")
+                self.processes[name].terminate()
+                self.states[name] = "killed"
+
+    def stop(self):
+        """
+        Close the devices and wait for the workers to exit
+        Returns:
+            name -> exit code of every worker
+        """
+        for commands in self.commands.values():
+            commands.put(None)
+        deadline = (self.fail_time if self.failed else time.monotonic()) + STOP_GRACE
+        while any(state in ("starting", "armed", "recording") for state in self.states.values()):
+            self._handle(timeout=0.5)
+            if time.monotonic() > deadline:
+                self._terminate()
+
+        for process in self.processes.values():
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        return {name: process.exitcode for name, process in self.processes.items()}
+
+    def run(self, record_start_time):
+        """
+        Run a single capture session
+        Args:
+            record_start_time (str or datetime): Requested start time, "HH:MM:SS" today or a datetime.
+                It is postponed when the workers need longer to arm.
+        Returns:
+            name -> (state, exit code, stats or error) of every worker
+        """
+        if self.start():
+            session = self.run_session(record_start_time)
+        else:
+            session = {name: ("failed", self.results.get(name)) for name in self.workers}
+        exitcodes = self.stop()
+
+        summary = {
+            name: (state, exitcodes[name], result) for name, (state, result) in session.items()
+        }
+        self.report(summary)
+        return summary
+
+    def run_batch(self, plan):
+        """
+        Record the sessions of a plan one after the other, without closing the devices in between.
+        Once the workers are re-armed, the next session starts after its countdown, at least
+        REARM_MARGIN (or the "margin" of the session) later. The batch stops at the first failed session.
+        Args:
+            plan (list): Sessions as dicts with "name", "duration", "countdown" (seconds between
+                the workers being armed and the start of the session) and "margin", see load_session_plan()
+        Returns:
+            List of (subject name, name -> (state, stats or error) of every worker)
+        """
+        sessions = []
+        if self.start():
+            for entry in plan:
+                rearmed = bool(sessions) and all(state == "armed" for state in self.states.values())
+                start_time = dt.datetime.now() + dt.timedelta(seconds=entry["countdown"])
+                print(
+                    f"[SUPERVISOR] -> Session {len(sessions) + 1}/{len(plan)}: {entry['name']} "
+                    f"({entry['duration']} s)"
+                )
+                session = self.run_session(
+                    start_time, entry["name"], entry["duration"], rearmed=rearmed, margin=entry.get("margin")
+                )
+                sessions.append((entry["name"], session))
+                self.report({name: (state, "-", result) for name, (state, result) in session.items()})
+                if self.failed:
+                    break
+        exitcodes = self.stop()
+
+        print("[SUPERVISOR] -> Batch summary")
+        for subject_name, session in sessions:
+            states = ", ".join(f"{name} {state}" for name, (state, result) in session.items())
+            print(f"  {subject_name:<16} {states}")
+        skipped = [entry["name"] for entry in plan[len(sessions) :]]
+        if skipped:
+            print(f"  not recorded: {', '.join(skipped)}")
+        print(f"  exit codes: {exitcodes}")
+        return sessions
+
+    def report(self, summary):
+        print("[SUPERVISOR] -> Session summary")
+        for name, (state, exitcode, result) in summary.items():
+            # tracebacks were printed when the worker failed
+            detail = result if isinstance(result, dict) or (result and "\n" not in result) else ""
+            print(f"  {name:<8} {state:<8} exit code: {exitcode}  {detail}")
+
+
+def load_session_plan(plan_path, duration=60, countdown=10):
+    """
+    Read a session plan, a JSON list of sessions, e.g.
+    [{"name": "alice", "duration": 120, "countdown": 15}, {"name": "bob", "margin": 2.2}]
+    Args:
+        plan_path (str): Path of the JSON file
+        duration (int): Duration of the sessions without one, default: 60
+        countdown (int): Countdown of the first session when it has none, the later sessions start
+            as soon as the workers are re-armed unless they set one, default: 10
+    "margin" (seconds) is the earliest start of a session after re-arming, REARM_MARGIN when it has none
+    """
+    with open(plan_path, "r") as f:
+        entries = json.load(f)
+
+    plan = []
+    for number, entry in enumerate(entries):
+        if isinstance(entry, str):
+            entry = {"name": entry}
+        if not entry.get("name"):
+            raise ValueError(f"Session without a name in {plan_path}: {entry}")
+        margin = entry.get("margin")
+        if margin is not None and float(margin) <= REARM_LEAD + 1:
+            # the workers would refuse the start time, see set_start_time()
+            raise ValueError(f"Margin of {entry['name']} in {plan_path} must be more than {REARM_LEAD + 1} s")
+        plan.append(
+            {
+                "name": entry["name"],
+                "duration": int(entry.get("duration", duration)),
+                "countdown": float(entry.get("countdown", countdown if number == 0 else 0)),
+                "margin": None if margin is None else float(margin),
+            }
+        )
+
+    # every session is saved to its own dataset folder
+    names = [entry["name"] for entry in plan]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Subjects recorded twice in {plan_path}: {duplicates}")
+    return plan
+
+
+def capture_workers(subject_name, duration, device_id_thermal, device_id_rgb, vernier_devices=("ecg", "rb")):
+    """
+    Worker options of our rig: RGB and thermal camera and the Vernier devices
+    """
+    return {
+        "rgb": {
+            "subject_name": subject_name,
+            "duration": duration,
+            "device_id": device_id_rgb,
+            "passthrough": True,
+            "output_format": "segments",
+        },
+        "thermal": {
+            "subject_name": subject_name,
+            "duration": duration,
+            "device_id": device_id_thermal,
+        },
+        # one process records all Vernier devices, each on its own thread
+        "vernier": {
+            "subject_name": subject_name,
+            "duration": duration,
+            "devices": list(vernier_devices),
+        },
+    }
 
 
 def runcapture(
@@ -10,31 +467,59 @@ def runcapture(
     duration,
     device_id_thermal,
     device_id_rgb,
+    vernier_devices=("ecg", "rb"),
+    arm_timeout=120,
+    preflight_seconds=3,
+    preflight_policy="refuse",
 ):
+    """
+    Record RGB, thermal and Vernier data of one subject with a shared start instant
+    Returns:
+        True when every worker finished without an error
+    """
+    workers = capture_workers(subject_name, duration, device_id_thermal, device_id_rgb, vernier_devices)
+    supervisor = CaptureSupervisor(
+        workers,
+        arm_timeout=arm_timeout,
+        preflight_seconds=preflight_seconds,
+        preflight_policy=preflight_policy,
+    )
+    summary = supervisor.run(record_start_time)
+    return all(state == "done" for state, exitcode, result in summary.values())
+
 
-    # list of subprocesses
-    subprocess.Popen(
-        f"start python rgb_capture.py --name {subject_name} --stime {record_start_time} --duration {duration} --device {device_id_rgb}",
-        shell=True,
+def runbatch(
+    plan,
+    device_id_thermal,
+    device_id_rgb,
+    vernier_devices=("ecg", "rb"),
+    arm_timeout=120,
+    preflight_seconds=3,
+    preflight_policy="refuse",
+):
+    """
+    Record every session of a plan, the devices are opened once for the whole batch
+    Returns:
+        True when every session was recorded without an error
+    """
+    workers = capture_workers(
+        plan[0]["name"], plan[0]["duration"], device_id_thermal, device_id_rgb, vernier_devices
     )
-    subprocess.Popen(
-        f"start python thermal_capture.py --name {subject_name} --stime {record_start_time} --duration {duration} --device {device_id_thermal}",
-        shell=True,
+    supervisor = CaptureSupervisor(
+        workers,
+        arm_timeout=arm_timeout,
+        preflight_seconds=preflight_seconds,
+        preflight_policy=preflight_policy,
     )
-    # subprocess.Popen(
-    #     f"start python vernier_capture.py --name {subject_name} --stime {record_start_time} --duration {duration} --conn {connection_mode} --fps {dps}",
-    #     shell=True,
-    # )
-    subprocess.Popen(
-        f"start python vernier_capture_ecg.py --name {subject_name} --stime {record_start_time} --duration {duration} --conn usb --fps 100",
-        shell=True,
-    )
-    subprocess.Popen(
-        f"start python vernier_capture_rb.py --name {subject_name} --stime {record_start_time} --duration {duration} --conn ble --fps 20",
-        shell=True,
+    sessions = supervisor.run_batch(plan)
+    return len(sessions) == len(plan) and all(
+        state == "done" for _, session in sessions for state, result in session.values()
     )
 
+
 if __name__ == "__main__":
+    from pygrabber.dshow_graph import FilterGraph
+
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--name",
@@ -77,6 +562,35 @@ if __name__ == "__main__":
         default=False,
         help="Run the capture automatically in the next minute",
     )
+    parser.add_argument(
+        "--plan",
+        type=str,
+        help="JSON session plan to record several subjects with the devices kept open, "
+        'e.g. [{"name": "alice", "duration": 120, "countdown": 15}, {"name": "bob"}]. '
+        "--duration is the default of the sessions, --cdown the default countdown of the first one "
+        '(the later ones start right after re-arming, at least "margin" or 2.5 s later)',
+        default=None,
+    )
+    parser.add_argument(
+        "--armtimeout",
+        type=float,
+        help="Seconds to wait for all devices to be armed",
+        default=120,
+    )
+
+    parser.add_argument(
+        "--preflight",
+        type=float,
+        help="Seconds of the pre-flight rate check of every source before arming, 0 to skip it",
+        default=3,
+    )
+    parser.add_argument(
+        "--preflightpolicy",
+        type=str,
+        choices=["refuse", "warn"],
+        help="Refuse to record or only warn when a source fails the pre-flight check",
+        default="refuse",
+    )
 
     args = parser.parse_args()
 
@@ -86,12 +600,24 @@ if __name__ == "__main__":
     # rgb_cam_id = graph.get_input_devices().index("C270 HD WEBCAM")
     rgb_cam_id = graph.get_input_devices().index("c922 Pro Stream Webcam")
 
+    if args.plan is not None:
+        plan = load_session_plan(args.plan, duration=args.duration, countdown=args.cdown)
+        success = runbatch(
+            plan,
+            thermal_cam_id,
+            rgb_cam_id,
+            arm_timeout=args.armtimeout,
+            preflight_seconds=args.preflight,
+            preflight_policy=args.preflightpolicy,
+        )
+        sys.exit(0 if success else 1)
+
     if not args.runmin:
         if args.cdown > 0:
             capture_start_time = dt.datetime.now() + dt.timedelta(seconds=args.cdown)
             capture_start_time = capture_start_time.strftime("%H:%M:%S")
         else:
-            capture_start_time = args.rstime
+            capture_start_time = args.stime
 
     if args.runmin:
         nowtime = dt.datetime.now()
@@ -101,10 +627,14 @@ if __name__ == "__main__":
         nowtime = nowtime + dt.timedelta(seconds=60)
         capture_start_time = nowtime.strftime("%H:%M:%S")
 
-    runcapture(
+    success = runcapture(
         args.name,
         capture_start_time,
         args.duration,
         thermal_cam_id,
         rgb_cam_id,
+        arm_timeout=args.armtimeout,
+        preflight_seconds=args.preflight,
+        preflight_policy=args.preflightpolicy,
     )
+    sys.exit(0 if success else 1)
@@ -0,0 +1,286 @@
+import argparse
+import datetime as dt
+import json
+import os
+import numpy as np
+from frame_store import write_json_atomic
+
+
+def format_timestamps(timestamps):
+    """
+    Format int64 nanosecond timestamps as local "YYYY-mm-dd HH:MM:SS.ffffff" strings,
+    the time format of the legacy Vernier CSV files
+    """
+    if len(timestamps) == 0:
+        return np.empty(0, dtype="<U26")
+    offset = dt.datetime.fromtimestamp(timestamps[0] / 1e9).astimezone().utcoffset()
+    local = (timestamps + int(offset.total_seconds() * 1e9)).astype("datetime64[ns]")
+    return np.char.replace(np.datetime_as_string(local, unit="us"), "T", " ")
+
+
+class CSVSampleWriter:
+    """
+    Stream Vernier samples to a CSV file in fixed-size chunks during the session,
+    so memory stays constant however long the recording is. A sidecar index
+    (<csv>.index.json) lists every chunk with its byte offset, row count and
+    first/last timestamp. It is rewritten after every chunk and marked complete on close().
+    Args:
+        csv_path (str): Path of the CSV file
+        num_channels (int): Number of sensor columns
+        chunk_size (int): Number of rows kept in memory before they are written, default: 4096
+    """
+
+    def __init__(self, csv_path, num_channels, chunk_size=4096):
+        self.csv_path = csv_path
+        self.index_path = csv_path + ".index.json"
+        self.num_channels = num_channels
+        self.chunk_size = chunk_size
+        self.num_rows = 0
+        self.chunks = []
+
+        self._timestamps = np.empty(chunk_size, dtype=np.int64)
+        self._values = np.empty((chunk_size, num_channels), dtype=np.float64)
+        self._fill = 0
+        self._fmt = "%s" + ", %.20f" * num_channels
+        self._file = open(csv_path, "wb")
+
+    def append(self, timestamps, values):
+        """
+        Append a block of samples
+        Args:
+            timestamps (np.ndarray): int64 nanosecond timestamps, shape (n,)
+            values (np.ndarray): Sensor values, shape (n, num_channels)
+        """
+        start = 0
+        while start < len(timestamps):
+            count = min(len(timestamps) - start, self.chunk_size - self._fill)
+            self._timestamps[self._fill : self._fill + count] = timestamps[start : start + count]
+            self._values[self._fill : self._fill + count] = values[start : start + count]
+            self._fill += count
+            start += count
+
+            if self._fill == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Write the rows kept in memory to disk and update the index
+        """
+        if self._fill == 0:
+            return
+
+        timestamps = self._timestamps[: self._fill]
+        rows = np.empty((self._fill, self.num_channels + 1), dtype=object)
+        rows[:, 0] = format_timestamps(timestamps)
+        rows[:, 1:] = self._values[: self._fill]
+
+        offset = self._file.tell()
+        np.savetxt(self._file, rows, delimiter=",", fmt=self._fmt)
+        self._file.flush()
+
+        self.chunks.append(
+            {
+                "offset": offset,
+                "rows": self._fill,
+                "first_timestamp": int(timestamps[0]),
+                "last_timestamp": int(timestamps[-1]),
+            }
+        )
+        self.num_rows += self._fill
+        self._fill = 0
+        self._write_index(complete=False)
+
+    def _write_index(self, complete):
+        write_json_atomic(
+            self.index_path,
+            {
+                "rows": self.num_rows,
+                "num_channels": self.num_channels,
+                "timestamp_unit": "ns",
+                "complete": complete,
+                "chunks": self.chunks,
+            },
+        )
+
+    @property
+    def pending(self):
+        """
+        Number of rows kept in memory, not yet written to disk
+        """
+        return self._fill
+
+    def close(self):
+        """
+        Write the last rows and the final index
+        """
+        self.flush()
+        self._file.close()
+        self._write_index(complete=True)
+
+
+class BinarySampleWriter:
+    """
+    Stream Vernier samples to a compact binary file of fixed-size records
+    (int64 nanosecond timestamp plus one float column per sensor). A small JSON
+    header (<bin>.json) carries the column names and units from
+    enabled_sensor_info(), the record layout and the row count. The header is
+    rewritten after every chunk, so a crashed session stays readable with load_samples().
+    Args:
+        bin_path (str): Path of the binary file
+        columns (list): Sensor column headers, e.g. ['EKG (mV)', 'Heart Rate (bpm)']
+        value_dtype (str): "float32" (what the device sends) or "float64", default: "float32"
+        chunk_size (int): Number of rows kept in memory before they are written, default: 4096
+        sampling_rate (float): Nominal sampling rate of the device in Hz, stored in the header, default: None
+    """
+
+    FORMAT = "vernier-binary-v1"
+
+    def __init__(self, bin_path, columns, value_dtype="float32", chunk_size=4096, sampling_rate=None):
+        self.bin_path = bin_path
+        self.sampling_rate = sampling_rate
+        self.header_path = bin_path + ".json"
+        self.columns = list(columns)
+        self.chunk_size = chunk_size
+        self.num_rows = 0
+        self.dtype = record_dtype(len(self.columns), value_dtype)
+
+        self._records = np.empty(chunk_size, dtype=self.dtype)
+        self._fill = 0
+        self._file = open(bin_path, "wb")
+        self._write_header(complete=False)
+
+    def append(self, timestamps, values):
+        """
+        Append a block of samples
+        Args:
+            timestamps (np.ndarray): int64 nanosecond timestamps, shape (n,)
+            values (np.ndarray): Sensor values, shape (n, number of columns)
+        """
+        start = 0
+        while start < len(timestamps):
+            count = min(len(timestamps) - start, self.chunk_size - self._fill)
+            chunk = self._records[self._fill : self._fill + count]
+            chunk["timestamp"] = timestamps[start : start + count]
+            for col in range(len(self.columns)):
+                chunk[f"ch{col}"] = values[start : start + count, col]
+            self._fill += count
+            start += count
+
+            if self._fill == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Write the rows kept in memory to disk and update the header
+        """
+        if self._fill == 0:
+            return
+
+        self._file.write(self._records[: self._fill].tobytes())
+        self._file.flush()
+        self.num_rows += self._fill
+        self._fill = 0
+        self._write_header(complete=False)
+
+    def _write_header(self, complete):
+        names, units = zip(*(split_column(c) for c in self.columns)) if self.columns else ((), ())
+        write_json_atomic(
+            self.header_path,
+            {
+                "format": self.FORMAT,
+                "columns": self.columns,
+                "names": list(names),
+                "units": list(units),
+                "value_dtype": self.dtype["ch0"].name if self.columns else None,
+                "timestamp_unit": "ns",
+                "sampling_rate": self.sampling_rate,
+                "rows": self.num_rows,
+                "complete": complete,
+            },
+        )
+
+    @property
+    def pending(self):
+        """
+        Number of rows kept in memory, not yet written to disk
+        """
+        return self._fill
+
+    def close(self):
+        """
+        Write the last rows and the final header
+        """
+        self.flush()
+        self._file.close()
+        self._write_header(complete=True)
+
+
+def record_dtype(num_channels, value_dtype="float32"):
+    """
+    Record layout of the binary Vernier format: timestamp, ch0, ch1, ...
+    """
+    return np.dtype(
+        [("timestamp", "<i8")]
+        + [(f"ch{col}", np.dtype(value_dtype).newbyteorder("<")) for col in range(num_channels)]
+    )
+
+
+def split_column(column):
+    """
+    Split an enabled_sensor_info() header like 'EKG (mV)' into ('EKG', 'mV')
+    """
+    if column.endswith(")") and " (" in column:
+        name, units = column[:-1].rsplit(" (", 1)
+        return name, units
+    return column, ""
+
+
+def load_samples(bin_path):
+    """
+    Memory-map a binary Vernier file written by BinarySampleWriter
+    Args:
+        bin_path (str): Path of the binary file
+    Returns:
+        1. The header (dict)
+        2. The records (np.memmap with fields timestamp, ch0, ch1, ...)
+    """
+    with open(bin_path + ".json", "r") as f:
+        header = json.load(f)
+
+    dtype = record_dtype(len(header["columns"]), header["value_dtype"] or "float32")
+    # use the file size rather than the header, the last chunk may be newer than the header
+    rows = os.path.getsize(bin_path) // dtype.itemsize
+    if rows == 0:
+        return header, np.empty(0, dtype=dtype)
+    return header, np.memmap(bin_path, dtype=dtype, mode="r", shape=(rows,))
+
+
+def export_csv(bin_path, csv_path=None, chunk_size=4096):
+    """
+    Export a binary Vernier file to the legacy CSV layout ("time, value, value, ...")
+    Args:
+        bin_path (str): Path of the binary file
+        csv_path (str): Path of the CSV file, default: bin_path with a .csv extension
+    """
+    if csv_path is None:
+        csv_path = os.path.splitext(bin_path)[0] + ".csv"
+
+    header, records = load_samples(bin_path)
+    num_channels = len(header["columns"])
+    writer = CSVSampleWriter(csv_path, num_channels, chunk_size=chunk_size)
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start : start + chunk_size]
+        values = np.column_stack([chunk[f"ch{col}"] for col in range(num_channels)])
+        writer.append(chunk["timestamp"], values)
+    writer.close()
+
+    return csv_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export binary Vernier files to CSV")
+    parser.add_argument("--input", type=str, nargs="+", help="Binary Vernier file(s)")
+    args = parser.parse_args()
+
+    for bin_path in args.input:
+        print(f"Exported {bin_path} to {export_csv(bin_path)}")
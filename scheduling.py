@@ -0,0 +1,112 @@
+import datetime as dt
+import time
+from collections import deque
+from preflight import READ_LEAD
+
+
+def parse_start_time(record_start_time):
+    """
+    Convert a start time given as "HH:MM:SS" (today) or as a datetime to a datetime
+    """
+    if isinstance(record_start_time, dt.datetime):
+        return record_start_time
+    return dt.datetime.combine(
+        dt.date.today(), dt.datetime.strptime(record_start_time, "%H:%M:%S").time()
+    )
+
+
+def sleep_until(target_time, spin=0.005, max_sleep=0.5, stop_event=None):
+    """
+    Sleep until a wall-clock time without busy-waiting. The remaining time is
+    converted once to a monotonic deadline, most of it is spent in time.sleep()
+    and only the last few milliseconds are spun for precision.
+    Args:
+        target_time (datetime): Wall-clock time to wake up at
+        spin (float): Seconds before the deadline to switch from sleeping to spinning, default: 0.005
+        max_sleep (float): Longest single sleep in seconds, default: 0.5
+        stop_event (Event): Wake up early when this (threading or multiprocessing) event is set, default: None
+    Returns:
+        False if woken up by stop_event, True otherwise
+    """
+    remaining = (target_time - dt.datetime.now()).total_seconds()
+    deadline = time.monotonic() + remaining
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= spin:
+            break
+        if stop_event is not None:
+            if stop_event.wait(min(remaining - spin, max_sleep)):
+                return False
+        else:
+            time.sleep(min(remaining - spin, max_sleep))
+
+    while time.monotonic() < deadline:
+        pass
+    return True
+
+
+class PreRollBuffer:
+    """
+    Ring buffer that keeps the frames/samples of the last few seconds before
+    the recording starts, so they can be kept without writing them to disk early.
+    Args:
+        seconds (float): Length of the pre-roll in seconds, 0 disables it
+    """
+
+    def __init__(self, seconds=0):
+        self.seconds = seconds
+        self._span_ns = int(seconds * 1e9)
+        self._items = deque()
+
+    def push(self, timestamp_ns, item):
+        """
+        Add one frame/sample and forget everything older than the pre-roll length
+        """
+        if self.seconds <= 0:
+            return
+
+        self._items.append((timestamp_ns, item))
+        while self._items[0][0] < timestamp_ns - self._span_ns:
+            self._items.popleft()
+
+    def drain(self):
+        """
+        Returns the buffered (timestamp_ns, item) pairs, oldest first, and empties the buffer
+        """
+        items = list(self._items)
+        self._items.clear()
+        return items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ScheduledCapture:
+    """
+    Recording window of a capture class (RGBCapture, PT2Capture, VernierCapture). Expects the
+    duration and preroll attributes of the capture class.
+    """
+
+    def set_start_time(self, record_start_time, lead=READ_LEAD):
+        """
+        Set the start time of the recording, e.g. once the capture supervisor has armed all devices
+        Args:
+            record_start_time (str or datetime): "HH:MM:SS" today, or a datetime
+            lead (float): Seconds the device is read before the start time (warm-up and pre-roll),
+                a device re-armed between batch sessions needs less, default: READ_LEAD (3)
+        """
+        if lead < self.preroll:
+            raise ValueError("The lead must be at least the pre-roll.")
+        self.read_lead = lead
+        self.record_start_time = parse_start_time(record_start_time)
+
+        # check if time is in the past
+        if self.record_start_time - dt.timedelta(seconds=self.read_lead + 1) < dt.datetime.now():
+            raise ValueError(
+                "Start time is in the past. Please enter a valid start time."
+            )
+
+        self.record_end_time = self.record_start_time + dt.timedelta(
+            seconds=self.duration
+        )
@@ -0,0 +1,34 @@
+import numpy as np
+
+from frame_store import MJPEGSegmentReader, MJPEGSegmentStore, ThermalFrameStore, ThermalStoreReader
+
+
+def test_mjpeg_store_crash_keeps_open_segment(tmp_path):
+    save_dir = str(tmp_path / "rgb")
+    store = MJPEGSegmentStore(save_dir, frames_per_segment=20, flush_every=4)
+    for frame_no in range(25):
+        store.append(frame_no, b"\xff\xd8frame%d\xff\xd9" % frame_no, 1_000_000 + frame_no)
+    # the process dies here, without close()
+
+    reader = MJPEGSegmentReader(save_dir)
+    # the closed segment and the open one up to its last flush
+    assert len(reader) == 24
+    assert reader[23] == b"\xff\xd8frame23\xff\xd9"
+    assert reader.frame(21) == b"\xff\xd8frame21\xff\xd9"
+    assert reader.timestamps.tolist() == [1_000_000 + i for i in range(24)]
+
+    store.close()
+    assert len(MJPEGSegmentReader(save_dir)) == 25
+
+
+def test_thermal_store_crash_keeps_open_chunk(tmp_path):
+    save_dir = str(tmp_path / "thermal")
+    store = ThermalFrameStore(save_dir, frame_shape=(2, 2), chunk_size=16)
+    for frame_no in range(40):
+        store.append(np.full((2, 2), frame_no, dtype=np.uint16), 1_000_000 + frame_no)
+    # the process dies here, without close()
+
+    reader = ThermalStoreReader(save_dir)
+    assert len(reader) == 40
+    assert reader[39][0, 0] == 39
+    assert reader.timestamps.tolist() == [1_000_000 + i for i in range(40)]
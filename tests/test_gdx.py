@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+
+from gdx import gdx, gdx_sim
+
+
+def record_sim_ecg(seconds, jitter=0.0, dropout=0.0, burst=1, period=10):
+    """
+    Read the simulated GDX-EKG in real time with read_block()
+    Returns:
+        timestamps of every sample, the gdx object and the simulated device
+    """
+    ekg = gdx_sim.default_devices()[0]
+    spec = gdx_sim.SimDeviceSpec(ekg.name, "usb", ekg.sensors, burst=burst, jitter=jitter, dropout=dropout)
+    sim_gdx = gdx.gdx(gdx_sim.SimGoDirect(devices=[spec], seed=1), device_cache=False)
+    sim_gdx.open(connection="usb", device_to_open=spec.name)
+    sim_gdx.select_sensors([1])
+    sim_gdx.start(period)
+
+    blocks = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        timestamps, _ = sim_gdx.read_block()[0]
+        blocks.append(timestamps)
+    device = sim_gdx.devices[0]
+    sim_gdx.stop()
+    sim_gdx.close()
+    return np.concatenate(blocks), sim_gdx, device
+
+
+def test_read_block_intervals_stay_uniform_with_jitter():
+    # packets up to 3 periods late must not show up as gaps or squashed intervals
+    timestamps, _, _ = record_sim_ecg(3, jitter=0.03)
+    intervals_ms = np.diff(timestamps) / 1e6
+    assert len(timestamps) > 250
+    assert intervals_ms.min() >= 7.5
+    assert intervals_ms.max() <= 12.5
+    assert abs(np.median(intervals_ms) - 10) < 0.1
+
+
+def test_read_block_intervals_stay_uniform_with_bursts():
+    timestamps, _, _ = record_sim_ecg(3, jitter=0.01, burst=5)
+    intervals_ms = np.diff(timestamps) / 1e6
+    assert intervals_ms.min() >= 7.5
+    assert intervals_ms.max() <= 12.5
+
+
+def test_sample_clock_ignores_backed_up_blocks():
+    # the newest sample of every block arrives 1-40 ms late, the timestamps stay on the sample grid
+    period_ns = 10_000_000
+    clock = gdx.SampleClock(0, period_ns)
+    rng = np.random.default_rng(1)
+    timestamps = []
+    for block in range(300):
+        n = 1 if block % 50 else 8
+        newest = clock.received + n - 1
+        timestamps.append(clock.stamp(n, newest * period_ns + int(rng.uniform(1e6, 40e6))))
+    intervals = np.diff(np.concatenate(timestamps))
+    assert intervals.min() >= 0.75 * period_ns
+    assert intervals.max() <= 1.25 * period_ns
+    assert clock.lost == 0
+
+
+def test_device_opening_after_timeout_is_closed():
+    ekg = gdx_sim.default_devices()[0]
+    fast = gdx_sim.SimDevice(gdx_sim.SimDeviceSpec("GDX-EKG 0U1000S1", "usb", ekg.sensors))
+    slow = gdx_sim.SimDevice(gdx_sim.SimDeviceSpec("GDX-EKG 0U1000S2", "usb", ekg.sensors, open_delay=0.5))
+    sim_gdx = gdx.gdx(gdx_sim.SimGoDirect(devices=[], seed=1), device_cache=False)
+
+    assert sim_gdx.open_devices([fast, slow], timeout=0.2) == [True, False]
+    assert fast._opened
+    # the slow device finishes opening after the timeout, its thread closes it again
+    time.sleep(0.5)
+    assert not slow._opened
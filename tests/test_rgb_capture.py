@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+
+from rgb_capture import is_mjpeg_payload, trim_mjpeg_payload
+
+
+def test_mjpeg_payload_needs_soi():
+    jpeg = np.frombuffer(b"\xff\xd8frame\xff\xd9", dtype=np.uint8)
+    assert is_mjpeg_payload(jpeg)
+    assert is_mjpeg_payload(jpeg.reshape(1, -1))
+    # a single row of bytes that is not a JPEG, and a decoded BGR image
+    assert not is_mjpeg_payload(np.frombuffer(b"\x00\x00frame", dtype=np.uint8))
+    assert not is_mjpeg_payload(np.zeros((720, 1280, 3), dtype=np.uint8))
+
+
+def test_mjpeg_payload_trimmed_to_last_eoi():
+    # the thumbnail of the EXIF header has its own EOI, the padding of the driver buffer follows the image
+    padded = np.frombuffer(b"\xff\xd8thumb\xff\xd9frame\xff\xd9" + b"\x00" * 64, dtype=np.uint8)
+    assert trim_mjpeg_payload(padded) == b"\xff\xd8thumb\xff\xd9frame\xff\xd9"
+    # a truncated frame is kept as it is
+    truncated = np.frombuffer(b"\xff\xd8fra", dtype=np.uint8)
+    assert trim_mjpeg_payload(truncated) == b"\xff\xd8fra"
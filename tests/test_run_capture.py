@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+from run_capture import REARM_MARGIN, load_session_plan
+
+
+def write_plan(tmp_path, entries):
+    plan_path = tmp_path / "plan.json"
+    plan_path.write_text(json.dumps(entries))
+    return str(plan_path)
+
+
+def test_session_plan_margin_from_plan(tmp_path):
+    plan = load_session_plan(write_plan(tmp_path, [{"name": "alice"}, {"name": "bob", "margin": 2.2}]))
+    assert plan[0]["margin"] is None
+    assert plan[1]["margin"] == 2.2
+    assert 2.2 < REARM_MARGIN
+
+
+def test_session_plan_margin_too_short(tmp_path):
+    # the workers refuse a start time less than REARM_LEAD + 1 s away
+    with pytest.raises(ValueError):
+        load_session_plan(write_plan(tmp_path, [{"name": "alice"}, {"name": "bob", "margin": 2}]))
@@ -0,0 +1,41 @@
+import datetime as dt
+
+import numpy as np
+import pytest
+
+# verify_data plots with matplotlib and detects the heart rate with heartpy and scipy
+pytest.importorskip("matplotlib")
+pytest.importorskip("heartpy")
+pytest.importorskip("scipy")
+
+import verify_data
+from test_vernier_capture import record_sim_session
+
+
+def test_clean_sim_vernier_session_passes(tmp_path, monkeypatch):
+    # jitter of the packet delivery must not show up as drops or missing samples
+    save_path, _ = record_sim_session(tmp_path, monkeypatch, jitter=0.03)
+    monkeypatch.setattr(verify_data, "ROOT", save_path)
+
+    _, num_samples, _, _, _, _, status, intervals = verify_data.verify_start_end_dur("sim01", "vernier_ecg")
+    assert num_samples >= 298
+    assert intervals["drops"] == 0
+    assert intervals["missing"] == 0
+    assert intervals["duplicates"] == 0
+    assert status
+
+
+def test_legacy_csv_with_whole_second_timestamps(tmp_path, monkeypatch):
+    vernier_dir = tmp_path / "legacy01" / "vernier"
+    vernier_dir.mkdir(parents=True)
+    rows = [dt.datetime(2024, 1, 1, 10, 0, 0, 990000) + dt.timedelta(milliseconds=10 * i) for i in range(3)]
+    # the second row falls on a whole second, str() writes it without a fraction
+    (vernier_dir / "legacy01_vernier_ecg.csv").write_text(
+        "".join(f"{row},{i * 0.1},{i}\n" for i, row in enumerate(rows))
+    )
+    monkeypatch.setattr(verify_data, "ROOT", str(tmp_path))
+
+    _, timestamps, values = verify_data.load_vernier("legacy01", "vernier_ecg")
+    assert str(rows[1]) == "2024-01-01 10:00:01"
+    assert np.diff(timestamps).tolist() == [10_000_000, 10_000_000]
+    assert values.shape == (3, 2)
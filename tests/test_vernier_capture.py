@@ -0,0 +1,28 @@
+import datetime as dt
+
+from vernier_capture import DEVICE_PRESETS, VernierCapture
+
+
+def record_sim_session(tmp_path, monkeypatch, jitter=0.0, dropout=0.0, duration=3):
+    """
+    Record one session of the simulated GDX-EKG with VernierCapture
+    Returns:
+        save path of the dataset and the stats of the session
+    """
+    monkeypatch.setenv("GDX_BACKEND", "sim")
+    monkeypatch.setenv("GDX_SIM_JITTER", str(jitter))
+    monkeypatch.setenv("GDX_SIM_DROPOUT", str(dropout))
+    monkeypatch.setenv("GDX_DEVICE_CACHE", str(tmp_path / "device_cache.json"))
+    save_path = str(tmp_path / "dataset")
+
+    capture = VernierCapture(
+        "sim01", None, devices=[DEVICE_PRESETS["ecg"]], save_path=save_path, duration=duration
+    )
+    capture.set_start_time(dt.datetime.now() + dt.timedelta(seconds=2), lead=0.5)
+    return save_path, capture.start_capture_vernier()
+
+
+def test_jitter_is_not_counted_as_lost_samples(tmp_path, monkeypatch):
+    _, stats = record_sim_session(tmp_path, monkeypatch, jitter=0.03)
+    assert stats["ecg"]["dropped"] == 0
+    assert abs(stats["ecg"]["samples"] - 300) <= 2
@@ -1,20 +1,41 @@
 import datetime as dt
 import numpy as np
 import cv2
+import io
 import os
 import argparse
+import threading
+from frame_store import FrameManifest, ThermalFrameStore
+from camera_capture import CameraCapture
+from frame_writer import FrameWriter
+from metrics import MetricsPublisher
+from scheduling import PreRollBuffer, sleep_until
+from timebase import Timebase
 
 
-class PT2Capture:
+class PT2Capture(CameraCapture):
     """
-    Capturing from PureThermal2 and save it to CSV
+    Capturing from PureThermal2 and save it to a chunked binary store (or CSV)
     Args:
         subject_name (str): Name of the subject
+        record_start_time (str or datetime): Start time of the recording in the format of "HH:MM:SS", None to set it later with set_start_time()
         device_id (int): Device ID of the camera
         save_path (str): Directory of Dataset
         duration (int): Duration of capturing in seconds
+        output_format (str): "npy" for the chunked binary store, "csv" for one CSV per frame, default: "npy"
+        writer_workers (int): Number of background writer threads, default: 1
+        queue_size (int): Maximum number of frames waiting to be written, default: 64
+        overflow_policy (str): "block", "drop_oldest" or "drop_newest" when the queue is full, default: "block"
+        preroll (float): Seconds of frames before the start time to keep (less than 3), default: 0
+        stop_event (Event): Stops the capture early when set (threading or multiprocessing), default: None
+        timebase (Timebase): Session clock shared with the other workers, default: a new one
+        metrics (Queue): Channel of the capture supervisor for live metrics (about 1 Hz), default: None
     """
 
+    SOURCE = "thermal"
+    # the Lepton of the PureThermal 2 delivers 8.7 Hz, checked by preflight()
+    TARGET_FPS = 8.7
+
     def __init__(
         self,
         subject_name,
@@ -22,7 +43,18 @@ class PT2Capture:
         device_id=0,
         save_path="./dataset",
         duration=10,
+        output_format="npy",
+        writer_workers=1,
+        queue_size=64,
+        overflow_policy="block",
+        preroll=0,
+        stop_event=None,
+        timebase=None,
+        metrics=None,
     ):
+        if output_format not in ("npy", "csv"):
+            raise ValueError(f"Unknown output format: {output_format}")
+
         cap = cv2.VideoCapture(
             device_id, cv2.CAP_DSHOW
         )  # windowsOS needs cv2.CAP_DSHOW
@@ -38,80 +70,174 @@ class PT2Capture:
         self.cap = cap
         self.save_path = save_path
         self.duration = duration
-        self.subject_name = subject_name
-        self.record_start_time = dt.datetime.combine(
-            dt.date.today(), dt.datetime.strptime(record_start_time, "%H:%M:%S").time()
-        )
+        self.output_format = output_format
+        self.writer_workers = writer_workers
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.preroll = preroll
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        self.timebase = timebase if timebase is not None else Timebase()
+        self.metrics = metrics
+        self.record_start_time = None
+        if record_start_time is not None:
+            self.set_start_time(record_start_time)
 
-        if self.record_start_time - dt.timedelta(seconds=4) < dt.datetime.now():
-            raise ValueError(
-                "Start time is in the past. Please enter a valid start time."
-            )
+        # frames are only read from 3 seconds before the start time
+        if not 0 <= self.preroll < 3:
+            raise ValueError("Pre-roll must be between 0 and 3 seconds.")
 
-        self.record_end_time = self.record_start_time + dt.timedelta(
-            seconds=self.duration
-        )
+        self.set_subject(subject_name)
+
+    def set_subject(self, subject_name, duration=None):
+        """
+        Set the subject (and the duration) of the next session, the camera stays open
+        Args:
+            subject_name (str): Name of the subject
+            duration (int): Duration of capturing in seconds, default: keep the current one
+        """
+        self.subject_name = subject_name
+        if duration is not None:
+            self.duration = duration
 
         if not os.path.exists(self.save_path + "/" + self.subject_name + "/thermal"):
             os.makedirs(self.save_path + "/" + self.subject_name + "/thermal")
             print("Created folder for Thermal images")
 
+    def _write_frame(self, frame_no, timestamp_ns, img, driver_timestamp_ns=-1):
+        # runs on the writer threads, frames finish in any order
+        if self.store is not None:
+            data = img.tobytes()
+        else:
+            # get filename from count + timestamp
+            timestamp = dt.datetime.fromtimestamp(timestamp_ns / 1e9)
+            filename = f"{frame_no}_{timestamp.strftime('%Y%m%d_%H%M%S_%f')}.csv"
+
+            # dump to CSV, through memory so the manifest gets the bytes as written
+            buffer = io.BytesIO()
+            np.savetxt(buffer, np.array(img), delimiter=",", fmt="%d")
+            data = buffer.getvalue()
+            with open(f"{self.save_path}/{self.subject_name}/thermal/{filename}", "wb") as f:
+                f.write(data)
+        return frame_no, timestamp_ns, img, data, driver_timestamp_ns
+
+    def _commit_frame(self, frame_no, timestamp_ns, img, data, driver_timestamp_ns):
+        # called in frame order, the store has no frame numbers and relies on it
+        if self.store is not None:
+            self.store.append(img, timestamp_ns, driver_timestamp_ns)
+        self.manifest.append(frame_no, timestamp_ns, data, driver_timestamp_ns)
+
     def start_capture_pt(self):
-        cnt = 0
+        """
+        Capturing thermal images from camera
+        Returns:
+            Stats of the session (frames written and dropped, writer queue depth)
+        """
+        if self.record_start_time is None:
+            raise ValueError("No start time. Use set_start_time() first.")
+
         frame_no = 0
+        preroll = PreRollBuffer(self.preroll)
+        self.store = None
+        if self.output_format == "npy":
+            self.store = ThermalFrameStore(
+                f"{self.save_path}/{self.subject_name}/thermal"
+            )
+        self.manifest = FrameManifest(f"{self.save_path}/{self.subject_name}/thermal")
+        self.timebase.save(
+            f"{self.save_path}/{self.subject_name}/thermal",
+            self.record_start_time,
+            self.record_end_time,
+        )
+        writer = FrameWriter(
+            self._write_frame,
+            commit_fn=self._commit_frame,
+            max_queue=self.queue_size,
+            num_workers=self.writer_workers,
+            policy=self.overflow_policy,
+            name="THERMALCAPTURE",
+        )
 
-        while dt.datetime.now() <= self.record_start_time - dt.timedelta(seconds=3):
-            if cnt == 0:
-                print(
-                    f"[THERMALCAPTURE] -> Waiting for start time {self.record_start_time.strftime('%H:%M:%S')}..."
-                )
-                print(f"Time Remaining: {self.record_start_time - dt.datetime.now()}")
-                cnt += 1
+        print(
+            f"[THERMALCAPTURE] -> Waiting for start time {self.record_start_time.strftime('%H:%M:%S')}..."
+        )
+        print(f"Time Remaining: {self.record_start_time - dt.datetime.now()}")
+        sleep_until(self.record_start_time - dt.timedelta(seconds=self.read_lead), stop_event=self.stop_event)
+
+        # one clock reading per frame, compared with the recording window in nanoseconds
+        start_ns = self.timebase.to_ns(self.record_start_time)
+        end_ns = self.timebase.to_ns(self.record_end_time)
 
-        print(f"Capturing Thermal Images... (-3 seconds)")
+        # a frame that takes more than 1.5 frame periods to arrive counts as late
+        metrics = MetricsPublisher(
+            "thermal",
+            self.metrics,
+            expected_rate=self.TARGET_FPS,
+            late_after=1.5 / self.TARGET_FPS,
+        )
+
+        print(f"Capturing Thermal Images... (-{self.read_lead:g} seconds)")
         cv2.namedWindow("PreviewThermal", cv2.WINDOW_NORMAL)
 
-        while True:
-            # start reading frames
-            ret, img = self.cap.read()
-            if ret == False:
-                raise Exception("Error reading image")
-
-            img_8bit = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
-            cv2.imshow("PreviewThermal", img_8bit)
-
-            # break when q is pressed
-            key = cv2.waitKey(1)
-            if key == ord("q"):
-                break
-
-            if (
-                dt.datetime.now() <= self.record_end_time
-                and dt.datetime.now() >= self.record_start_time
-            ):
-                frame_numpy = np.array(img)
-
-                # get filename from count + timestamp
-                filename = (
-                    f"{frame_no}_{dt.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.csv"
-                )
+        try:
+            while not self.stop_event.is_set():
+                # stamp the frame right when it is grabbed, decoding (retrieve) comes afterwards
+                if self.cap.grab() == False:
+                    raise Exception("Error reading image")
+                timestamp_ns = self.timebase.now_ns()
+                driver_timestamp_ns = self._driver_timestamp_ns()
+                metrics.tick()
 
-                # dump to CSV
-                np.savetxt(
-                    f"{self.save_path}/{self.subject_name}/thermal/{filename}",
-                    frame_numpy,
-                    delimiter=",",
-                    fmt="%d",
-                )
+                ret, img = self.cap.retrieve()
+                if ret == False:
+                    raise Exception("Error reading image")
+
+                img_8bit = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+                cv2.imshow("PreviewThermal", img_8bit)
+
+                # break when q is pressed
+                key = cv2.waitKey(1)
+                if key == ord("q"):
+                    break
 
-                frame_no += 1
+                if start_ns <= timestamp_ns <= end_ns:
+                    # flush the pre-roll frames first, they keep their own timestamps
+                    for preroll_ns, (frame, preroll_driver_ns) in preroll.drain():
+                        writer.put(frame_no, preroll_ns, frame, preroll_driver_ns)
+                        frame_no += 1
+
+                    writer.put(frame_no, timestamp_ns, img, driver_timestamp_ns)
+                    frame_no += 1
+                elif timestamp_ns < start_ns:
+                    preroll.push(timestamp_ns, (img, driver_timestamp_ns))
+
+                metrics.publish(
+                    "recording" if timestamp_ns >= start_ns else "preroll",
+                    dropped=writer.dropped,
+                    failed=writer.failed,
+                    backlog=writer.depth,
+                    max_backlog=writer.max_queue,
+                    recorded=frame_no,
+                )
 
-            if dt.datetime.now() > self.record_end_time:
-                break
+                if timestamp_ns > end_ns:
+                    break
+        finally:
+            # write the queued frames and the final header, also when the loop or a write failed
+            try:
+                writer.close()
+            finally:
+                if self.store is not None:
+                    self.store.close()
+                self.manifest.close()
+                writer.report()
 
         cv2.destroyAllWindows()
         end_time = dt.datetime.now()
 
+        stats = writer.stats()
+        stats["stopped_early"] = self.stop_event.is_set()
+        return stats
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -137,6 +263,38 @@ if __name__ == "__main__":
         help="Device ID of the camera",
         default=2,
     )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=["npy", "csv"],
+        help="Output format: chunked binary store (npy) or legacy CSV per frame (csv)",
+        default="npy",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of background writer threads",
+        default=1,
+    )
+    parser.add_argument(
+        "--queue",
+        type=int,
+        help="Maximum number of frames waiting to be written",
+        default=64,
+    )
+    parser.add_argument(
+        "--overflow",
+        type=str,
+        choices=list(FrameWriter.POLICIES),
+        help="What to do when the writer queue is full",
+        default="block",
+    )
+    parser.add_argument(
+        "--preroll",
+        type=float,
+        help="Seconds of frames before the start time to keep",
+        default=0,
+    )
 
     args = parser.parse_args()
     PT2Capture(
@@ -144,6 +302,11 @@ if __name__ == "__main__":
         record_start_time=args.stime,
         device_id=args.device,
         duration=args.duration,
+        output_format=args.format,
+        writer_workers=args.workers,
+        queue_size=args.queue,
+        overflow_policy=args.overflow,
+        preroll=args.preroll,
     ).start_capture_pt()
 
     # subject_name = "alice"
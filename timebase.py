@@ -0,0 +1,291 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from frame_store import (
+    MJPEGSegmentReader,
+    ThermalStoreReader,
+    is_segment_store,
+    is_thermal_store,
+    write_json_atomic,
+)
+from sample_store import load_samples
+
+ROOT = "dataset"
+
+
+class Timebase:
+    """
+    Session clock of the capture workers. The wall clock is read once, as the anchor of the
+    session, and every frame/sample is then timestamped with a single time.perf_counter_ns()
+    reading, which is monotonic and shared by all processes of the machine (QueryPerformanceCounter
+    on Windows, CLOCK_MONOTONIC on Linux). Timestamps are int64 nanoseconds on the wall-clock
+    scale of the anchor, so NTP adjustments during the session cannot move them.
+    Pass the same Timebase to every worker to put all modalities on one clock.
+    Args:
+        anchor_wall_ns (int): time.time_ns() of the anchor, default: read now
+        anchor_mono_ns (int): time.perf_counter_ns() at the same instant, default: read now
+    """
+
+    FILE_NAME = "timebase.json"
+
+    def __init__(self, anchor_wall_ns=None, anchor_mono_ns=None):
+        if anchor_wall_ns is None or anchor_mono_ns is None:
+            anchor_wall_ns, anchor_mono_ns = self._read_anchor()
+        self.anchor_wall_ns = anchor_wall_ns
+        self.anchor_mono_ns = anchor_mono_ns
+
+    @staticmethod
+    def _read_anchor(tries=5):
+        # bracket the wall clock reading between two monotonic readings, keep the tightest pair
+        best = None
+        for _ in range(tries):
+            before = time.perf_counter_ns()
+            wall_ns = time.time_ns()
+            after = time.perf_counter_ns()
+            if best is None or after - before < best[0]:
+                best = (after - before, wall_ns, (before + after) // 2)
+        return best[1], best[2]
+
+    def now_ns(self):
+        """
+        Current time in nanoseconds since epoch, from one monotonic clock reading
+        """
+        return self.anchor_wall_ns + (time.perf_counter_ns() - self.anchor_mono_ns)
+
+    def to_ns(self, moment):
+        """
+        Convert a datetime (e.g. the record start time) to int64 nanoseconds since epoch
+        """
+        return round(moment.timestamp() * 1e6) * 1000
+
+    def to_dict(self):
+        return {
+            "anchor_wall_ns": self.anchor_wall_ns,
+            "anchor_mono_ns": self.anchor_mono_ns,
+            "clock": "perf_counter_ns",
+        }
+
+    def save(self, save_dir, record_start_time=None, record_end_time=None):
+        """
+        Write the anchor (and the recording window) to save_dir/timebase.json
+        """
+        info = self.to_dict()
+        if record_start_time is not None:
+            info["record_start_ns"] = self.to_ns(record_start_time)
+        if record_end_time is not None:
+            info["record_end_ns"] = self.to_ns(record_end_time)
+        write_json_atomic(os.path.join(save_dir, self.FILE_NAME), info)
+
+
+def load_timebase(save_dir):
+    """
+    Read save_dir/timebase.json, None if the modality was recorded without one
+    """
+    path = os.path.join(save_dir, Timebase.FILE_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def load_modality_timestamps(subject):
+    """
+    Collect the int64 nanosecond timestamps of every modality of a subject that has them
+    Returns:
+        dict of modality -> (timestamps, nominal rate in Hz or None, modality directory)
+    """
+    subject_dir = os.path.join(ROOT, subject)
+    modalities = {}
+
+    rgb_dir = os.path.join(subject_dir, "rgb")
+    if os.path.isdir(rgb_dir) and is_segment_store(rgb_dir):
+        modalities["rgb"] = (MJPEGSegmentReader(rgb_dir).timestamps, None, rgb_dir)
+
+    thermal_dir = os.path.join(subject_dir, "thermal")
+    if os.path.isdir(thermal_dir) and is_thermal_store(thermal_dir):
+        modalities["thermal"] = (ThermalStoreReader(thermal_dir).timestamps, None, thermal_dir)
+
+    vernier_dir = os.path.join(subject_dir, "vernier")
+    for the_type in ["vernier_ecg", "vernier_rb"]:
+        bin_path = os.path.join(vernier_dir, f"{subject}_{the_type}.bin")
+        if os.path.exists(bin_path):
+            header, records = load_samples(bin_path)
+            modalities[the_type] = (
+                np.asarray(records["timestamp"]),
+                header.get("sampling_rate"),
+                vernier_dir,
+            )
+
+    return modalities
+
+
+def load_driver_timestamps(subject):
+    """
+    Collect the host and driver timestamps of the camera modalities that have both
+    Returns:
+        dict of modality -> (host timestamps, driver timestamps), both int64 nanoseconds
+    """
+    subject_dir = os.path.join(ROOT, subject)
+    modalities = {}
+
+    rgb_dir = os.path.join(subject_dir, "rgb")
+    if os.path.isdir(rgb_dir) and is_segment_store(rgb_dir):
+        reader = MJPEGSegmentReader(rgb_dir)
+        if reader.driver_timestamps is not None:
+            modalities["rgb"] = (reader.timestamps, reader.driver_timestamps)
+
+    thermal_dir = os.path.join(subject_dir, "thermal")
+    if os.path.isdir(thermal_dir) and is_thermal_store(thermal_dir):
+        reader = ThermalStoreReader(thermal_dir)
+        if reader.driver_timestamps is not None:
+            modalities["thermal"] = (reader.timestamps, reader.driver_timestamps)
+
+    return modalities
+
+
+def fit_driver_clock(host_ns, driver_ns):
+    """
+    Fit host = offset + slope * driver (least squares) over the frames with a driver timestamp. The
+    residual is the error of the host timestamps against the capture instant reported by the driver.
+    Returns:
+        dict with the drift of the driver clock in ppm and the host timestamp error in ms, None when
+        fewer than two frames have a driver timestamp
+    """
+    known = driver_ns >= 0
+    if known.sum() < 2:
+        return None
+
+    driver = (driver_ns[known] - driver_ns[known][0]).astype(np.float64)
+    host = (host_ns[known] - host_ns[known][0]).astype(np.float64)
+    slope, offset = np.polyfit(driver, host, 1)
+    error_ms = np.abs(host - (offset + slope * driver)) / 1e6
+    return {
+        "frames": int(known.sum()),
+        "drift_ppm": (slope - 1) * 1e6,
+        "error_p50_ms": float(np.percentile(error_ms, 50)),
+        "error_p99_ms": float(np.percentile(error_ms, 99)),
+        "error_max_ms": float(error_ms.max()),
+    }
+
+
+def fit_clock(timestamps, nominal_rate=None):
+    """
+    Fit timestamp = offset + index * period (least squares) over the samples of one modality
+    Returns:
+        dict with the fitted period and rate, the drift against the nominal rate in ppm (None without
+        one) and the residual jitter in ms
+    """
+    index = np.arange(len(timestamps), dtype=np.float64)
+    t = (timestamps - timestamps[0]).astype(np.float64)
+    period, offset = np.polyfit(index, t, 1)
+    residual_ms = np.abs(t - (offset + period * index)) / 1e6
+
+    drift_ppm = None
+    if nominal_rate:
+        drift_ppm = ((1e9 / nominal_rate) / period - 1) * 1e6
+    return {
+        "period_ms": period / 1e6,
+        "rate": 1e9 / period,
+        "drift_ppm": drift_ppm,
+        "jitter_p50_ms": float(np.percentile(residual_ms, 50)),
+        "jitter_p99_ms": float(np.percentile(residual_ms, 99)),
+    }
+
+
+def report_alignment(subject, reference=None):
+    """
+    Report the offset and drift between the modalities of a recorded session. Offsets are the
+    first/last timestamp against the recording window (and against the reference modality), the
+    drift is the device clock against the nominal sampling rate, relative to the reference.
+    Args:
+        subject (str): Name of the subject
+        reference (str): Modality to compare the others with, default: the first one found
+    """
+    modalities = {
+        name: value for name, value in load_modality_timestamps(subject).items() if len(value[0]) > 1
+    }
+    if not modalities:
+        print(f"No timestamped data found for {subject}")
+        return {}
+
+    anchors = {}
+    windows = {}
+    for name, (_, _, save_dir) in modalities.items():
+        info = load_timebase(save_dir)
+        if info is not None:
+            anchors[name] = (info["anchor_wall_ns"], info["anchor_mono_ns"])
+            if "record_start_ns" in info:
+                windows[name] = (info["record_start_ns"], info["record_end_ns"])
+
+    if reference is None or reference not in modalities:
+        reference = next(iter(modalities))
+    ref_timestamps = modalities[reference][0]
+    ref_fit = fit_clock(ref_timestamps, modalities[reference][1])
+
+    results = {}
+    print(f"Timebase report for {subject} (reference: {reference})")
+    if anchors:
+        shared = len(set(anchors.values())) == 1 and len(anchors) == len(modalities)
+        print(f"Shared session anchor: {'yes' if shared else 'no'}")
+    header = f"{'modality':<12} {'samples':>8} {'rate (Hz)':>10} {'drift (ppm)':>12} {'jitter p99 (ms)':>16} {'start off (ms)':>15} {'end off (ms)':>13} {'vs ref start (ms)':>18} {'vs ref end (ms)':>16}"
+    print(header)
+    for name, (timestamps, nominal_rate, _) in modalities.items():
+        fit = fit_clock(timestamps, nominal_rate)
+        start_off = end_off = None
+        if name in windows:
+            start_off = (timestamps[0] - windows[name][0]) / 1e6
+            end_off = (timestamps[-1] - windows[name][1]) / 1e6
+        fit.update(
+            {
+                "samples": len(timestamps),
+                "start_offset_ms": start_off,
+                "end_offset_ms": end_off,
+                "start_vs_ref_ms": (timestamps[0] - ref_timestamps[0]) / 1e6,
+                "end_vs_ref_ms": (timestamps[-1] - ref_timestamps[-1]) / 1e6,
+            }
+        )
+        if fit["drift_ppm"] is not None and ref_fit["drift_ppm"] is not None:
+            fit["drift_vs_ref_ppm"] = fit["drift_ppm"] - ref_fit["drift_ppm"]
+        results[name] = fit
+
+        def show(value, fmt):
+            return format(value, fmt) if value is not None else "-"
+
+        print(
+            f"{name:<12} {fit['samples']:>8} {fit['rate']:>10.3f} {show(fit['drift_ppm'], '>12.1f')} "
+            f"{fit['jitter_p99_ms']:>16.2f} {show(start_off, '>15.1f')} {show(end_off, '>13.1f')} "
+            f"{fit['start_vs_ref_ms']:>18.1f} {fit['end_vs_ref_ms']:>16.1f}"
+        )
+
+    # alignment error of the host timestamps, measured against the driver timestamps
+    driver_fits = {}
+    for name, (host_ns, driver_ns) in load_driver_timestamps(subject).items():
+        fit = fit_driver_clock(host_ns, driver_ns)
+        if fit is not None:
+            driver_fits[name] = fit
+            results.setdefault(name, {})["driver"] = fit
+    if driver_fits:
+        print("Host vs driver timestamps")
+        print(f"{'modality':<12} {'frames':>8} {'drift (ppm)':>12} {'error p50 (ms)':>15} {'error p99 (ms)':>15} {'error max (ms)':>15}")
+        for name, fit in driver_fits.items():
+            print(
+                f"{name:<12} {fit['frames']:>8} {fit['drift_ppm']:>12.1f} {fit['error_p50_ms']:>15.2f} "
+                f"{fit['error_p99_ms']:>15.2f} {fit['error_max_ms']:>15.2f}"
+            )
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the offset and drift between modalities")
+    parser.add_argument("--subject", type=str, help="Name of the subject")
+    parser.add_argument(
+        "--reference",
+        type=str,
+        help="Modality to compare the others with (rgb, thermal, vernier_ecg, vernier_rb)",
+        default=None,
+    )
+    args = parser.parse_args()
+    report_alignment(args.subject, args.reference)
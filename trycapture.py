@@ -4,6 +4,7 @@ import numpy as np
 import pandas as pd
 import datetime as dt
 from gdx import gdx
+from scheduling import sleep_until
 
 connection_mode = "usb"
 fps = 400
@@ -35,27 +36,34 @@ print(f"Start recording at {record_start_time}")
 record_end_time = record_start_time + dt.timedelta(seconds=duration)
 print(f"End recording at {record_end_time} (duration: {duration} seconds)")
 
-# create a trap for waiting
-while dt.datetime.now() < record_start_time - dt.timedelta(seconds=3):
-    if cnt == 0:
-        print(f"Waiting for {delta_second} seconds..")
-        cnt += 1
+# sleep until 3 seconds before the start time
+print(f"Waiting for {delta_second} seconds..")
+cnt += 1
+sleep_until(record_start_time - dt.timedelta(seconds=3))
+
+start_ns = int(record_start_time.timestamp() * 1e9)
+end_ns = int(record_end_time.timestamp() * 1e9)
 
 while True:
-    measurements = gdx.read()
+    # every sample of a block is timestamped from its index and the sampling period
+    timestamps, values = gdx.read_block()[0]
+    if len(timestamps) == 0:
+        continue
 
-    if (dt.datetime.now() <= record_end_time and dt.datetime.now() >= record_start_time):    
+    inside = (timestamps >= start_ns) & (timestamps <= end_ns)
+    if inside.any():
         if cnt == 1:
             print(f"Capturing the data..")
             cnt += 1
-        
-        measurement_combine = (
-            dt.datetime.now(),
-            measurements[0],
-        )
-        captured_data.append(measurement_combine)
-
-    if dt.datetime.now() > record_end_time:
+
+        for t, value in zip(timestamps[inside].tolist(), values[inside, 0].tolist()):
+            measurement_combine = (
+                dt.datetime.fromtimestamp(t / 1e9),
+                value,
+            )
+            captured_data.append(measurement_combine)
+
+    if timestamps[-1] > end_ns:
         break
 
 # stop and close the connection
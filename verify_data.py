@@ -1,19 +1,164 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from glob import glob
+import hashlib
+import json
 import os
+import time
 import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import heartpy as hp
 import argparse
 import scipy.signal as signal
+from figures import signal_figure
+from frame_store import (
+    FrameManifest,
+    MJPEGSegmentReader,
+    ThermalStoreReader,
+    is_segment_store,
+    is_thermal_store,
+    load_manifest,
+    write_json_atomic,
+)
+from sample_store import load_samples
 
 ROOT = "dataset"
+# frame/sample rate of every modality
+NOMINAL_RATE = {"rgb": 30, "thermal": 8.7, "vernier_ecg": 100, "vernier_rb": 20}
+# a gap longer than this many nominal periods counts as a drop
+DROP_FACTOR = 1.5
+# a session fails when more than this part of the expected frames/samples is missing
+MAX_MISSING = 0.01
+# layout of {subject}_verify.json, files of another format are verified again
+VERIFY_CACHE_FORMAT = "verify-cache-v1"
+
+
+def analysis_settings():
+    """
+    This function returns the settings the cached results depend on, a cache written with other
+    settings is verified again
+    """
+    return {"nominal_rate": NOMINAL_RATE, "drop_factor": DROP_FACTOR, "max_missing": MAX_MISSING}
+
+
+def load_vernier(subjectname, the_type):
+    """
+    This function loads a Vernier recording, the binary file if there is one, the legacy CSV otherwise
+        Args
+            subjectname: name of the subject
+            the_type: type of data ('vernier_ecg', 'vernier_rb')
+        Returns
+            1. The file path of the data
+            2. Timestamps of the samples (int64 nanoseconds since epoch)
+            3. Sensor values (2D array, one column per sensor)
+    """
+    bin_path = os.path.join(ROOT, subjectname, "vernier", f"{subjectname}_{the_type}.bin")
+    if os.path.exists(bin_path):
+        _, records = load_samples(bin_path)
+        values = np.column_stack([records[name] for name in records.dtype.names[1:]])
+        return bin_path, np.asarray(records["timestamp"]), values
+
+    csv_path = os.path.join(ROOT, subjectname, "vernier", f"{subjectname}_{the_type}.csv")
+    df = pd.read_csv(csv_path, header=None)
+
+    # the CSV holds local wall-clock times, parse all of them at once
+    local_tz = dt.datetime.now().astimezone().tzinfo
+    # str(datetime) leaves out the fraction when it is 0, e.g. "2024-01-01 10:00:01"
+    times = pd.to_datetime(df[0], format="ISO8601").dt.tz_localize(local_tz)
+    timestamps = times.values.astype("datetime64[ns]").astype(np.int64)
+    return csv_path, timestamps, df.iloc[:, 1:].values
+
+
+def load_frame_timestamps(subjectname, the_type):
+    """
+    This function loads the timestamps of all frames of a camera recording: from the manifest,
+    the binary store, or the file names of a legacy session
+        Args
+            subjectname: name of the subject
+            the_type: type of data ('rgb', 'thermal')
+        Returns
+            1. The directory path of the data
+            2. Timestamps of the frames (int64 nanoseconds since epoch) in frame order
+    """
+    the_dirpath = os.path.join(ROOT, subjectname, the_type)
+
+    manifest = load_manifest(the_dirpath)
+    if manifest is not None and len(manifest) > 0:
+        # manifest written while recording, one read
+        return the_dirpath, manifest["timestamp"]
+    if the_type == "thermal" and is_thermal_store(the_dirpath):
+        # binary store: the timestamp chunks
+        return the_dirpath, ThermalStoreReader(the_dirpath).timestamps
+    if the_type == "rgb" and is_segment_store(the_dirpath):
+        # segment store: the sidecar index
+        return the_dirpath, MJPEGSegmentReader(the_dirpath).timestamps
+
+    # legacy session: {frame}_{YYYYmmdd}_{HHMMSS}_{ffffff}.{ext}, parse all file names at once
+    ext = "jpg" if the_type == "rgb" else "csv"
+    names = pd.Series([os.path.basename(p)[: -len(ext) - 1] for p in glob(os.path.join(the_dirpath, f"*.{ext}"))])
+    if names.empty:
+        raise FileNotFoundError(f"No {the_type} frames in {the_dirpath}")
+    parts = names.str.split("_", n=1, expand=True)
+    order = np.argsort(parts[0].astype(np.int64).values, kind="stable")
+    local_tz = dt.datetime.now().astimezone().tzinfo
+    times = pd.to_datetime(parts[1], format="%Y%m%d_%H%M%S_%f").dt.tz_localize(local_tz)
+    timestamps = times.values.astype("datetime64[ns]").astype(np.int64)
+    return the_dirpath, timestamps[order]
+
+
+def analyze_intervals(timestamps, nominal_rate, max_locations=10):
+    """
+    This function computes the inter-frame/sample interval distribution of one recording with np.diff
+        Args
+            timestamps: int64 nanosecond timestamps in recording order
+            nominal_rate: expected frame/sample rate in Hz
+            max_locations: number of the longest drops to locate
+        Returns
+            dict with the interval p50/p99/max in ms, the drops (gaps longer than DROP_FACTOR nominal
+            periods) with the number of missing frames/samples and the location of the longest ones
+            (index, seconds into the recording, gap in ms), the duplicated timestamps and the
+            timestamps that go backwards
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    intervals = np.diff(timestamps)
+    result = {
+        "interval_p50_ms": None,
+        "interval_p99_ms": None,
+        "interval_max_ms": None,
+        "drops": 0,
+        "missing": 0,
+        "drop_locations": [],
+        "duplicates": 0,
+        "backwards": 0,
+    }
+    if len(intervals) == 0:
+        return result
+
+    period_ns = 1e9 / nominal_rate
+    p50, p99 = np.percentile(intervals, [50, 99]) / 1e6
+    drops = np.flatnonzero(intervals > DROP_FACTOR * period_ns)
+    longest = np.sort(drops[np.argsort(intervals[drops])[::-1][:max_locations]])
+    result.update(
+        {
+            "interval_p50_ms": float(p50),
+            "interval_p99_ms": float(p99),
+            "interval_max_ms": float(intervals.max() / 1e6),
+            "drops": int(len(drops)),
+            "missing": int(np.sum(np.rint(intervals[drops] / period_ns) - 1)),
+            "drop_locations": [
+                (int(i), float((timestamps[i] - timestamps[0]) / 1e9), float(intervals[i] / 1e6))
+                for i in longest
+            ],
+            "duplicates": int(np.count_nonzero(intervals == 0)),
+            "backwards": int(np.count_nonzero(intervals < 0)),
+        }
+    )
+    return result
 
 
 def verify_start_end_dur(subjectname, the_type):
     """
-    This function verifies the start, end and duration of the data
+    This function verifies the start, end, duration and the gaps of the data
         Args
             subjectname: name of the subject
             type: type of data ('rgb', 'thermal', 'vernier_ecg', 'vernier_rb')
@@ -25,125 +170,66 @@ def verify_start_end_dur(subjectname, the_type):
             5. Duration
             6. Sampling Rate
             7. Status (True/False)
+            8. Interval analysis, see analyze_intervals()
     """
     print(f"The Type: {the_type}")
-    if the_type is "rgb" or the_type is "thermal":
-        if the_type == "rgb":
-            ext = "jpg"
-        else:
-            ext = "csv"
-
-        the_dirpath = os.path.join(ROOT, subjectname, the_type)
-
-        # List all files
-        filelist = glob(os.path.join(the_dirpath, f"*.{ext}"))
-
-        filelist = sorted(
-            filelist, key=lambda x: int(os.path.basename(x).split(".")[0])
-        )
-        num_files = len(filelist)
-
-        # get the first filename, only filename not the path. Then identify the start time
-        first_file = os.path.basename(filelist[0])
-        first_file = dt.datetime.strptime(
-            first_file.split("_")[1]
-            + first_file.split("_")[2]
-            + first_file.split("_")[3][0:-4],
-            "%Y%m%d%H%M%S%f",
-        )
-
-        # get the last filename, only filename not the path. Then identify the end time
-        last_file = os.path.basename(filelist[-1])
-        last_file = dt.datetime.strptime(
-            last_file.split("_")[1]
-            + last_file.split("_")[2]
-            + last_file.split("_")[3][0:-4],
-            "%Y%m%d%H%M%S%f",
-        )
-
-        # get the duration
-        duration = last_file - first_file
-
-        # validate fps
-        fps = num_files / duration.total_seconds()
-
-        # status is true if the fps for rgb is 30 and for thermal is 8
-        if the_type == "rgb":
-            status = int(fps) == 30
-        else:
-            status = int(fps) == 8
-
-        return the_dirpath, num_files, first_file, last_file, duration, fps, status
-
+    if the_type in ("rgb", "thermal"):
+        the_path, timestamps = load_frame_timestamps(subjectname, the_type)
     else:
-        filename = f"{subjectname}_{the_type}.csv"
-        csv_path = os.path.join(ROOT, subjectname, "vernier", filename)
+        the_path, timestamps, _ = load_vernier(subjectname, the_type)
+    num_samples = len(timestamps)
 
-        # load csv using pandas
-        df = pd.read_csv(csv_path, header=None)
-        df.columns = ["TIME", "DATA1", "DATA2"]
-        length_of_data = len(df)
+    # get the start and end time
+    start_time = dt.datetime.fromtimestamp(timestamps[0] / 1e9)
+    end_time = dt.datetime.fromtimestamp(timestamps[-1] / 1e9)
 
-        # get the start time
-        start_time = df["TIME"][0]
-        start_time = dt.datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S.%f")
+    # get the duration
+    duration = end_time - start_time
 
-        # get the end time
-        end_time = df["TIME"][length_of_data - 1]
-        end_time = dt.datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S.%f")
-
-        # get the duration
-        duration = end_time - start_time
-
-        # validate fps
-        fps = length_of_data / duration.total_seconds()
-
-        # check if there's null
-        # null = df.isnull().values.any()
+    # validate fps
+    fps = num_samples / duration.total_seconds()
+
+    # status is true if the fps for rgb is 30, for thermal 8 and at least 100 / 20 for the vernier ecg / rb
+    if the_type == "rgb":
+        status = int(fps) == 30
+    elif the_type == "thermal":
+        status = int(fps) == 8
+    elif the_type == "vernier_ecg":
+        status = int(fps) >= 100
+    else:
+        status = int(fps) >= 20
 
-        # status is true if fps = 20 and there is no null
-        # status = int(fps) == 20 and not null #TODO: Fix this
-        if the_type == "vernier_ecg":
-            status = int(fps) >= 100
-        else:
-            status = int(fps) >= 20
+    # a freeze in the middle or repeated timestamps fail the session even when the average rate is fine
+    intervals = analyze_intervals(timestamps, NOMINAL_RATE[the_type])
+    expected = duration.total_seconds() * NOMINAL_RATE[the_type]
+    status = status and intervals["missing"] <= MAX_MISSING * expected and intervals["duplicates"] == 0
 
-        return csv_path, length_of_data, start_time, end_time, duration, fps, status
+    return the_path, num_samples, start_time, end_time, duration, fps, status, intervals
 
 
 def plot_gt(subject, duration, the_type):
-    # load the csv
-    filename = f"{subject}_{the_type}.csv"
-    csv_path = os.path.join(ROOT, subject, "vernier", filename)
-    df = pd.read_csv(csv_path, header=None)
-    df.columns = ["TIME", "DATA1", "DATA2"]
+    # load the recording
+    _, _, values = load_vernier(subject, the_type)
 
     # create timeaxis
     duration = duration.total_seconds()
-    timeaxis = np.linspace(0, duration, len(df))
+    timeaxis = np.linspace(0, duration, len(values))
 
     # plot data 1
-    plt.figure()
-    plt.plot(timeaxis, df["DATA1"].values, label=the_type)
-    plt.title(f"{subject} {the_type}")
-
     savename = f"{subject}_gt_{the_type}.png"
     saveloc = os.path.join(ROOT, subject, savename)
-    plt.savefig(saveloc)
-    plt.show()
+    signal_figure().render(saveloc, timeaxis, values[:, 0], f"{subject} {the_type}", label=the_type)
 
 
 def ecg_heartpy(subject, duration, the_type):
-    csv_path = os.path.join(ROOT, subject, "vernier", f"{subject}_vernier_ecg.csv")
-    print(csv_path)
-    df = pd.read_csv(csv_path, header=None)
-    df.columns = ["TIME", "DATA1", "DATA2"]
+    data_path, _, values = load_vernier(subject, "vernier_ecg")
+    print(data_path)
     # validate fps
-    fps = int(len(df) / duration.total_seconds())
+    fps = int(len(values) / duration.total_seconds())
     print(f"FPS in Heartpyfunc: {fps}")
 
     # normalize the ecg
-    norm_ecg = df["DATA1"].values
+    norm_ecg = values[:, 0]
     # norm_ecg = norm_ecg - norm_ecg.min()
     # norm_ecg = norm_ecg / norm_ecg.max()
     # norm_ecg = norm_ecg * 1000
@@ -164,58 +250,261 @@ def ecg_heartpy(subject, duration, the_type):
     # plotresults.savefig(saveloc)
     # plotresults.show()
 
-    plt.plot(norm_ecg)
-    plt.plot(ecg_peak, norm_ecg[ecg_peak], "x")
-    plt.title(f"{subject} {the_type} HR: {hrbpm}")
-    plt.savefig(saveloc)
+    timeaxis = np.linspace(0, duration.total_seconds(), len(norm_ecg))
+    signal_figure().render(
+        saveloc,
+        timeaxis,
+        norm_ecg,
+        f"{subject} {the_type} HR: {hrbpm}",
+        markers=(timeaxis[ecg_peak], norm_ecg[ecg_peak]),
+    )
 
 
-def generate_report(subject):
-    item = ["rgb", "thermal", "vernier_ecg", "vernier_rb"]
+def render_figures(subject, durations, workers=1):
+    """
+    This function renders the ground-truth figures of the Vernier modalities, in a process pool
+    when more than one worker is given. Every process reuses its figure for all the plots it renders.
+        Args
+            subject: name of the subject
+            durations: dict of modality ('vernier_ecg', 'vernier_rb') -> duration of the modalities to plot
+            workers: number of worker processes, default: 1 (render in this process)
+    """
+    jobs = []
+    if "vernier_ecg" in durations:
+        jobs += [(plot_gt, "vernier_ecg"), (ecg_heartpy, "vernier_ecg")]
+    if "vernier_rb" in durations:
+        jobs.append((plot_gt, "vernier_rb"))
+
+    if workers <= 1 or len(jobs) <= 1:
+        for function, the_type in jobs:
+            function(subject, durations[the_type], the_type)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        futures = [pool.submit(function, subject, durations[the_type], the_type) for function, the_type in jobs]
+        for future in futures:
+            future.result()
+
+
+def fingerprint(subject, the_type):
+    """
+    This function computes a cheap fingerprint of the data of one modality: the names, sizes and
+    mtimes of its files, and a hash of the manifest when there is one. The frames themselves are
+    not read.
+        Args
+            subject: name of the subject
+            the_type: type of data ('rgb', 'thermal', 'vernier_ecg', 'vernier_rb')
+        Returns
+            Hex digest, None when the modality has no data
+    """
+    if the_type in ("rgb", "thermal"):
+        the_dirpath = os.path.join(ROOT, subject, the_type)
+        if not os.path.isdir(the_dirpath):
+            return None
+        with os.scandir(the_dirpath) as entries:
+            files = [(entry.name, entry.stat()) for entry in entries if entry.is_file()]
+    else:
+        base = os.path.join(ROOT, subject, "vernier", f"{subject}_{the_type}")
+        files = [
+            (os.path.basename(base + ext), os.stat(base + ext))
+            for ext in (".bin", ".bin.json", ".csv")
+            if os.path.exists(base + ext)
+        ]
+    if not files:
+        return None
+
+    digest = hashlib.sha1()
+    for name, stat in sorted(files, key=lambda f: f[0]):
+        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    if the_type in ("rgb", "thermal"):
+        manifest_path = os.path.join(the_dirpath, FrameManifest.INDEX_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def verify_modality(subject, the_type):
+    """
+    This function verifies one modality and keeps the result as plain values, so it can be cached
+    """
+    the_path, num_files, first_file, last_file, duration, fps, status, intervals = verify_start_end_dur(
+        subject, the_type
+    )
+    return {
+        "path": the_path,
+        "samples": int(num_files),
+        "start": str(first_file),
+        "end": str(last_file),
+        "duration_s": duration.total_seconds(),
+        "fps": float(fps),
+        "status": bool(status),
+        "intervals": intervals,
+    }
+
+
+def report_section(source, result):
+    """
+    This function formats the report of one modality
+    """
+    intervals = result["intervals"]
+    lines = [
+        f"Source: {source}",
+        f"Directory: {result['path']}",
+        f"Number of files: {result['samples']}",
+        f"Start Time: {result['start']}",
+        f"End Time: {result['end']}",
+        f"Duration: {dt.timedelta(seconds=result['duration_s'])}",
+        f"Sampling Rate: {result['fps']}",
+    ]
+    if intervals["interval_p50_ms"] is not None:
+        lines.append(
+            f"Interval p50/p99/max: {intervals['interval_p50_ms']:.2f} / "
+            f"{intervals['interval_p99_ms']:.2f} / {intervals['interval_max_ms']:.2f} ms"
+        )
+    lines.append(f"Drops (> {DROP_FACTOR}x period): {intervals['drops']}, missing: {intervals['missing']}")
+    for index, seconds, gap_ms in intervals["drop_locations"]:
+        lines.append(f"    after #{index} at {seconds:.3f} s: {gap_ms:.1f} ms")
+    lines.append(f"Duplicated timestamps: {intervals['duplicates']}, backwards: {intervals['backwards']}")
+    lines.append(f"Status: {result['status']}")
+    return "\n".join(lines) + "\n\n"
 
+
+def generate_report(subject, show=True, force=False, plot_workers=1):
+    """
+    This function verifies every modality of a subject and writes {subject}_report.txt. The
+    results are cached per modality in {subject}_verify.json with the fingerprint of the data,
+    only the modalities whose data changed are verified (and plotted) again. The whole cache is
+    dropped when its format or the analysis settings changed.
+        Args
+            subject: name of the subject
+            show: print the report on the terminal
+            force: verify every modality again
+            plot_workers: number of processes rendering the figures, default: 1
+        Returns
+            1. Result of every modality (samples, start, end, duration, rate, gaps, status)
+            2. The modalities that were verified again
+    """
+    item = ["rgb", "thermal", "vernier_ecg", "vernier_rb"]
+    cache_path = os.path.join(ROOT, subject, f"{subject}_verify.json")
+    settings = analysis_settings()
+    cache = {}
+    if not force and os.path.exists(cache_path):
+        with open(cache_path, "r") as f:
+            previous = json.load(f)
+        if previous.get("format") == VERIFY_CACHE_FORMAT and previous.get("settings") == settings:
+            cache = previous["modalities"]
+
+    results = {}
+    recomputed = []
+    durations = {}
     for source in item:
-        (
-            the_dirpath,
-            num_files,
-            first_file,
-            last_file,
-            duration,
-            fps,
-            status,
-        ) = verify_start_end_dur(subject, source)
-        if source == "vernier_ecg":
-            plot_gt(subject, duration, source)
-            ecg_heartpy(subject, duration, source)
-        elif source == "vernier_rb":
-            plot_gt(subject, duration, source)
-
-        # dump the report as txt
-        filename = f"{subject}_report.txt"
-        saveloc = os.path.join(ROOT, subject, filename)
-
-        # check if the file exists, if not, create an empty txt
-        if not os.path.exists(saveloc):
-            with open(saveloc, "w") as f:
-                f.write("")
-
-        # write the report
-        with open(saveloc, "a") as f:
-            # write the source
-            f.write(f"Source: {source}\n")
-            f.write(f"Directory: {the_dirpath}\n")
-            f.write(f"Number of files: {num_files}\n")
-            f.write(f"Start Time: {first_file}\n")
-            f.write(f"End Time: {last_file}\n")
-            f.write(f"Duration: {duration}\n")
-            f.write(f"Sampling Rate: {fps}\n")
-            f.write(f"Status: {status}\n")
-            f.write("\n")
-
-    print(f"Report for {subject} is generated")
-
-    # open the txt and show it on terminal
-    with open(saveloc, "r") as f:
-        print(f.read())
+        # the fingerprint is taken before reading, data changed meanwhile is verified next time
+        source_fingerprint = fingerprint(subject, source)
+        cached = cache.get(source)
+        if cached is not None and source_fingerprint is not None and cached["fingerprint"] == source_fingerprint:
+            results[source] = cached
+            continue
+
+        result = verify_modality(subject, source)
+        if source in ("vernier_ecg", "vernier_rb"):
+            durations[source] = dt.timedelta(seconds=result["duration_s"])
+
+        result["fingerprint"] = source_fingerprint
+        results[source] = result
+        recomputed.append(source)
+
+    # plot only the modalities that were verified again, before they are cached
+    render_figures(subject, durations, plot_workers)
+    write_json_atomic(cache_path, {"format": VERIFY_CACHE_FORMAT, "settings": settings, "modalities": results})
+
+    # rewrite the whole report, readers never see a half written one
+    report = "".join(report_section(source, results[source]) for source in item)
+    saveloc = os.path.join(ROOT, subject, f"{subject}_report.txt")
+    with open(saveloc + ".tmp", "w") as f:
+        f.write(report)
+    os.replace(saveloc + ".tmp", saveloc)
+
+    if recomputed:
+        print(f"Report for {subject} is generated ({', '.join(recomputed)} verified)")
+    else:
+        print(f"Report for {subject} is up to date")
+
+    # show the report on terminal
+    if show:
+        print(report)
+    return results, recomputed
+
+
+def verify_session(subject, force=False):
+    """
+    Verify one subject in a worker process, only the modalities whose data changed
+        Returns
+            (subject, result of every modality or error message, modalities verified again)
+    """
+    try:
+        results, recomputed = generate_report(subject, show=False, force=force)
+        return subject, results, recomputed
+    except Exception as e:
+        return subject, f"{type(e).__name__}: {e}", []
+
+
+def verify_dataset(subjects, workers=None, force=False):
+    """
+    Verify many subjects across a process pool and write the dataset summary table
+    (dataset/verification_summary.csv)
+        Args
+            subjects: names of the subjects
+            workers: number of worker processes, default: the number of cores
+            force: verify again even when the data did not change since the last run
+        Returns
+            The summary table (one row per subject and modality)
+    """
+    workers = workers or os.cpu_count() or 1
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=min(workers, max(len(subjects), 1))) as pool:
+        futures = [pool.submit(verify_session, subject, force) for subject in subjects]
+        for future in as_completed(futures):
+            subject, summary, recomputed = future.result()
+            if not isinstance(summary, dict):
+                print(f"[VERIFY] -> {subject}: {summary}")
+            else:
+                print(f"[VERIFY] -> {subject}: {', '.join(recomputed) + ' verified' if recomputed else 'cached'}")
+            results.append((subject, summary, recomputed))
+
+    rows = []
+    for subject, summary, recomputed in sorted(results, key=lambda r: r[0]):
+        if not isinstance(summary, dict):
+            rows.append({"subject": subject, "modality": "-", "status": False, "cached": False, "error": summary})
+            continue
+        for modality, result in summary.items():
+            rows.append(
+                {
+                    "subject": subject,
+                    "modality": modality,
+                    "samples": result["samples"],
+                    "start": result["start"],
+                    "duration_s": result["duration_s"],
+                    "fps": result["fps"],
+                    "drops": result["intervals"]["drops"],
+                    "missing": result["intervals"]["missing"],
+                    "duplicates": result["intervals"]["duplicates"],
+                    "status": result["status"],
+                    "cached": modality not in recomputed,
+                    "error": "",
+                }
+            )
+
+    table = pd.DataFrame(rows)
+    table.to_csv(os.path.join(ROOT, "verification_summary.csv"), index=False)
+    columns = [c for c in ["subject", "modality", "samples", "fps", "missing", "duplicates", "status", "cached", "error"] if c in table]
+    print(table[columns].to_string(index=False))
+    print(
+        f"{len(subjects)} session(s) in {time.perf_counter() - start:.1f} s with {workers} worker(s), "
+        f"{sum(1 for _, summary, recomputed in results if isinstance(summary, dict) and not recomputed)} fully cached"
+    )
+    return table
 
 
 if __name__ == "__main__":
@@ -232,5 +521,17 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--subject", type=str, help="subject name")
+    parser.add_argument("--subjects", type=str, nargs="+", help="verify several subjects in parallel")
+    parser.add_argument("--all", action="store_true", default=False, help="verify every subject in the dataset in parallel")
+    parser.add_argument("--workers", type=int, help="number of worker processes (sessions, or the figures of one subject), default: number of cores", default=None)
+    parser.add_argument("--force", action="store_true", default=False, help="verify again even when the data did not change")
     args = parser.parse_args()
-    generate_report(args.subject)
+
+    if args.all or args.subjects:
+        if args.all:
+            subjects = sorted(d for d in os.listdir(ROOT) if os.path.isdir(os.path.join(ROOT, d)))
+        else:
+            subjects = args.subjects
+        verify_dataset(subjects, workers=args.workers, force=args.force)
+    else:
+        generate_report(args.subject, force=args.force, plot_workers=args.workers or os.cpu_count() or 1)
@@ -1,67 +1,156 @@
 from gdx import gdx
+import asyncio
 import datetime as dt
+import logging
 import numpy as np
 import os
-import pandas as pd
-import matplotlib.pyplot as plt
-import math
+import threading
+import time
 import argparse
+from metrics import MetricsPublisher
+from preflight import print_qualification, qualify
+from sample_store import BinarySampleWriter, CSVSampleWriter
+from scheduling import PreRollBuffer, ScheduledCapture, sleep_until
+from timebase import Timebase
 
+# show the device cache hits and misses of gdx.open()
+logging.getLogger("gdx").setLevel(logging.INFO)
 
-class VernierCapture:
+
+class VernierDevice:
     """
-    Capturing RR and ECG from Vernier Go Direct Sensors and save it to CSV files
+    One Go Direct device recorded by VernierCapture
+    Args:
+        name (str): Device name with serial number, e.g. "GDX-EKG 0U1000S2"
+        connection_mode (str): "usb" or "ble"
+        sensors (list): Sensor numbers to enable, e.g. [1, 2]
+        fps (int): Sampling rate of the device
+        suffix (str): The data is saved to {subject}_vernier_{suffix}.bin (or .csv)
+    """
+
+    def __init__(self, name, connection_mode, sensors, fps, suffix):
+        self.name = name
+        self.connection_mode = connection_mode
+        self.sensors = sensors
+        self.fps = fps
+        self.suffix = suffix
+
+    @property
+    def period(self):
+        """
+        Sampling period in ms
+        """
+        return 1000 / self.fps
+
+
+# the devices of our rig, ECG over USB at 100 Hz and RB over BLE at 20 Hz (bluetooth max 20)
+DEVICE_PRESETS = {
+    "ecg": VernierDevice("GDX-EKG 0U1000S2", "usb", [1, 2], 100, "ecg"),
+    "rb": VernierDevice("GDX-RB 0K1002H6", "ble", [1, 2], 20, "rb"),
+}
+
+
+class VernierCapture(ScheduledCapture):
+    """
+    Capturing RR and ECG from Vernier Go Direct Sensors and save it to binary (or CSV) files.
+    Every device is opened and read on its own thread, so a slow BLE link never
+    stalls the USB ECG stream. All devices share the clock of this process.
+    Samples are streamed to disk in fixed-size chunks while recording.
     Args:
         subject_name (str): Name of the subject
-        record_start_time (str): Start time of the recording in the format of "HH:MM:SS"
+        record_start_time (str or datetime): Start time of the recording in the format of "HH:MM:SS", None to set it later with set_start_time()
+        devices (list): VernierDevice objects to record, default: all DEVICE_PRESETS
         save_path (str): Path to save the data, default: "./dataset"
         duration (int): Duration of the recording in seconds, default: 10
-        fps (int): Frames per second, default: 20 (currently only support 20 for the RR)
+        preroll (float): Seconds of samples before the start time to keep (less than 3), default: 0
+        output_format (str): "bin" for int64 timestamps + float32 columns with a JSON header, "csv" for the legacy CSV, default: "bin"
+        open_timeout (float): Seconds to wait for every device to be opened, default: 60
+        stop_event (Event): Stops the capture early when set (threading or multiprocessing), default: None
+        timebase (Timebase): Session clock shared with the other workers, default: a new one
+        metrics (Queue): Channel of the capture supervisor for live metrics of every device (about 1 Hz), default: None
     """
 
     def __init__(
         self,
         subject_name,
         record_start_time,
+        devices=None,
         save_path="./dataset",
         duration=10,
-        fps=20,
-        connection_mode="ble",
+        preroll=0,
+        output_format="bin",
+        open_timeout=60,
+        stop_event=None,
+        timebase=None,
+        metrics=None,
     ):
+        if output_format not in ("bin", "csv"):
+            raise ValueError(f"Unknown output format: {output_format}")
 
         self.save_path = save_path
         self.duration = duration
-        self.subject_name = subject_name
-        self.record_start_time = dt.datetime.combine(
-            dt.date.today(), dt.datetime.strptime(record_start_time, "%H:%M:%S").time()
-        )
+        self.preroll = preroll
+        self.output_format = output_format
+        self.devices = devices if devices is not None else list(DEVICE_PRESETS.values())
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        self.timebase = timebase if timebase is not None else Timebase()
+        self.metrics = metrics
+        self.record_start_time = None
+        if record_start_time is not None:
+            self.set_start_time(record_start_time)
 
-        # check if start_time is in the past -> Raise Error
-        if self.record_start_time - dt.timedelta(seconds=4) < dt.datetime.now():
-            raise ValueError(
-                "Start time is in the past. Please enter a valid start time."
-            )
+        # samples are only read from 3 seconds before the start time
+        if not 0 <= self.preroll < 3:
+            raise ValueError("Pre-roll must be between 0 and 3 seconds.")
 
-        # count the end time
-        self.record_end_time = self.record_start_time + dt.timedelta(
-            seconds=self.duration
-        )
-
-        period = 1000/fps  # in ms
+        self.set_subject(subject_name)
 
-        try:
-            gdx.open(
-                connection=connection_mode,
-                device_to_open="GDX-RB 0K1002H6, GDX-EKG 0U1000S2",
+        # open every device on its own thread and wait until all of them are ready
+        self.open_timeout = open_timeout
+        self.errors = {}
+        self.stats = {}
+        self._opened = [threading.Event() for _ in self.devices]
+        self._recorded = [threading.Event() for _ in self.devices]
+        # the device threads run the task (record a session or a pre-flight check) every time the
+        # session number goes up
+        self._wake = threading.Condition()
+        self._session = 0
+        self._task = None
+        self.preflight_results = {}
+        self._closing = False
+        self._threads = [
+            threading.Thread(
+                target=self._run_device,
+                args=(device, opened, recorded),
+                name=f"VERNIER-{device.suffix.upper()}",
+                daemon=True,
             )
-            gdx.select_sensors([[1], [1,2]])
-            gdx.start(period)
-        except:
-            gdx.stop()
-            gdx.close()
+            for device, opened, recorded in zip(self.devices, self._opened, self._recorded)
+        ]
+        open_start = time.perf_counter()
+        for thread in self._threads:
+            thread.start()
+        for device, opened in zip(self.devices, self._opened):
+            if not opened.wait(max(open_timeout - (time.perf_counter() - open_start), 0)):
+                self.errors[device.suffix] = TimeoutError(f"{device.name} did not open")
+
+        if self.errors:
+            self.close()
+            raise RuntimeError(f"Could not open Vernier devices: {self.errors}")
 
-        self.column_headers = gdx.enabled_sensor_info()
-        self.gdx = gdx
+        self.time_to_ready = time.perf_counter() - open_start
+        print(f"[VERNIER] -> {len(self.devices)} device(s) ready in {self.time_to_ready:.2f} s")
+
+    def set_subject(self, subject_name, duration=None):
+        """
+        Set the subject (and the duration) of the next session, the devices stay connected
+        Args:
+            subject_name (str): Name of the subject
+            duration (int): Duration of the recording in seconds, default: keep the current one
+        """
+        self.subject_name = subject_name
+        if duration is not None:
+            self.duration = duration
 
         # check if the directory exists
         if not os.path.exists(self.save_path + "/" + self.subject_name + "/vernier"):
@@ -70,56 +159,231 @@ class VernierCapture:
                 f"Created directory {self.save_path + '/' + self.subject_name + '/vernier'}"
             )
 
-    def start_capture_vernier(self):
-        """
-        Start capturing RR and ECG from Vernier Go Direct Sensors
-        """
-        cnt = 0
-        captured_data = []
-        while dt.datetime.now() <= self.record_start_time - dt.timedelta(seconds=3):
-            if cnt == 0:
-                print(f"[VERNIER] -> Waiting for the start time at {self.record_start_time}...")
-                print(f"Time Remaining: {self.record_start_time - dt.datetime.now()}")
-                cnt += 1
-
-        print("Capturing the data... (-3 Seconds)")
-        # We need to do this because everytime the gdx.read() called, it flows with huge amount of data.
-
-        while True:
-            measurements = self.gdx.read()
-
-            if (
-                dt.datetime.now() <= self.record_end_time
-                and dt.datetime.now() >= self.record_start_time
-            ):
-                measurement_combine = (
-                    dt.datetime.now(),
-                    measurements[0],
-                    measurements[1],
-                    measurements[2],
-                )
-                captured_data.append(measurement_combine)
-
-            if dt.datetime.now() > self.record_end_time:
-                break
-
-        # save the data to CSV
-        csv_name = (
+    def _data_name(self, device):
+        return (
             self.save_path
             + "/"
             + self.subject_name
             + "/vernier/"
             + self.subject_name
-            + "_vernier.csv"
+            + f"_vernier_{device.suffix}.{self.output_format}"
+        )
+
+    def _run_device(self, device, opened, recorded):
+        # the bleak backend of godirect needs an event loop in the thread that uses the device
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        device_gdx = gdx.gdx()
+        # timestamp the sample blocks on the session clock
+        device_gdx.clock = self.timebase.now_ns
+
+        try:
+            device_gdx.open(
+                connection=device.connection_mode,
+                device_to_open=device.name,
+                timeout=self.open_timeout,
+            )
+            if not device_gdx.devices:
+                raise RuntimeError(f"{device.name} not found")
+            device_gdx.select_sensors([device.sensors])
+        except Exception as e:
+            self.errors[device.suffix] = e
+            device_gdx.close()
+            opened.set()
+            return
+
+        opened.set()
+        # the device stays connected between sessions, until close()
+        session = 0
+        try:
+            while True:
+                with self._wake:
+                    self._wake.wait_for(lambda: self._session > session or self._closing)
+                    if self._closing:
+                        break
+                    session = self._session
+                    task = self._task
+                try:
+                    if not self.errors and not self.stop_event.is_set():
+                        task(device, device_gdx)
+                except Exception as e:
+                    self.errors[device.suffix] = e
+                finally:
+                    recorded.set()
+        finally:
+            device_gdx.close()
+
+    def _preflight(self, device, device_gdx):
+        arrivals = []
+        counts = []
+        started_ns = self.timebase.now_ns()
+        end_ns = started_ns + int(self._preflight_seconds * 1e9)
+        device_gdx.start(device.period)
+        try:
+            while not self.stop_event.is_set():
+                timestamps, values = device_gdx.read_block()[0]
+                arrival_ns = self.timebase.now_ns()
+                if arrival_ns > end_ns:
+                    break
+                if len(timestamps):
+                    arrivals.append(arrival_ns)
+                    counts.append(len(timestamps))
+        finally:
+            device_gdx.stop()
+
+        self.preflight_results[device.suffix] = qualify(
+            f"vernier-{device.suffix}",
+            np.array(arrivals, dtype=np.int64),
+            started_ns,
+            device.fps,
+            counts=np.array(counts, dtype=np.int64),
         )
-        np.savetxt(csv_name, captured_data, delimiter=",", fmt="%s, %.20f, %.20f, %.20f")
 
-        print(
-            f"Captured data saved to {self.save_path}/{self.subject_name}/vernier/{self.subject_name}_vernier.csv"
+    def _run_task(self, task):
+        # wake all device threads at the same instant and wait until every one has run the task
+        for recorded in self._recorded:
+            recorded.clear()
+        with self._wake:
+            self._task = task
+            self._session += 1
+            self._wake.notify_all()
+        for recorded in self._recorded:
+            recorded.wait()
+
+    def _record(self, device, device_gdx):
+        tag = f"[VERNIER-{device.suffix.upper()}]"
+        start_ns = self.timebase.to_ns(self.record_start_time)
+        end_ns = self.timebase.to_ns(self.record_end_time)
+        preroll_ns = int(self.preroll * 1e9)
+        data_name = self._data_name(device)
+        if self.output_format == "bin":
+            writer = BinarySampleWriter(
+                data_name, device_gdx.enabled_sensor_info(), sampling_rate=device.fps
+            )
+        else:
+            writer = CSVSampleWriter(data_name, len(device.sensors))
+        preroll = PreRollBuffer(self.preroll)
+        # one loop iteration is one block of samples, the rate is counted in samples. A block that
+        # takes more than 1.5 sampling periods counts as late
+        metrics = MetricsPublisher(
+            f"vernier-{device.suffix}",
+            self.metrics,
+            expected_rate=device.fps,
+            late_after=1.5 * device.period / 1000,
         )
+        # samples lost in transfer, estimated by gdx from the delay of the samples (SampleClock)
+        dropped = 0
+        print(f"{tag} -> Capturing the data... (-{self.read_lead:g} Seconds)")
+
+        # sampling runs only during the session, the device is stopped between sessions
+        device_gdx.start(device.period)
+        try:
+            while not self.stop_event.is_set():
+                # every sample of a block is timestamped from its index and the sampling period
+                timestamps, values = device_gdx.read_block()[0]
+                metrics.tick(len(timestamps))
+                if len(timestamps) == 0:
+                    metrics.publish("waiting", dropped=dropped, backlog=writer.pending, recorded=writer.num_rows)
+                    if self.timebase.now_ns() > end_ns:
+                        break
+                    continue
+
+                dropped = device_gdx.lost_samples()[0]
+
+                before = timestamps < start_ns
+                if before.any():
+                    preroll.push(int(timestamps[before][-1]), (timestamps[before], values[before]))
+
+                inside = ~before & (timestamps <= end_ns)
+                if inside.any():
+                    # flush the pre-roll samples first
+                    for _, (pre_timestamps, pre_values) in preroll.drain():
+                        keep = pre_timestamps >= start_ns - preroll_ns
+                        writer.append(pre_timestamps[keep], pre_values[keep])
+                    writer.append(timestamps[inside], values[inside])
+
+                metrics.publish(
+                    "recording" if timestamps[-1] >= start_ns else "preroll",
+                    dropped=dropped,
+                    backlog=writer.pending,
+                    recorded=writer.num_rows + writer.pending,
+                )
 
-        self.gdx.stop()
-        self.gdx.close()
+                if timestamps[-1] > end_ns:
+                    break
+        finally:
+            # write the last chunk and the final index, also when the loop failed
+            writer.close()
+            self.stats[device.suffix] = {"samples": writer.num_rows, "dropped": device_gdx.lost_samples()[0]}
+            device_gdx.stop()
+
+        print(f"{tag} -> Captured data saved to {data_name}")
+
+    def close(self):
+        """
+        Disconnect the devices, after the last session or when the session is stopped before the start
+        """
+        with self._wake:
+            self._closing = True
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def preflight(self, seconds=3):
+        """
+        Sample all devices for a few seconds without storing the samples and qualify the delivered
+        rate, the jitter between sample blocks and the latency of the first block, see preflight.qualify()
+        Args:
+            seconds (float): Duration of the pre-flight capture, default: 3
+        Returns:
+            List with the qualification result of every device
+        """
+        self.errors = {}
+        self.preflight_results = {}
+        self._preflight_seconds = seconds
+        self._run_task(self._preflight)
+        if self.errors:
+            raise RuntimeError(f"Vernier pre-flight failed: {self.errors}")
+
+        results = [self.preflight_results[device.suffix] for device in self.devices]
+        for result in results:
+            print_qualification(result)
+        return results
+
+    def start_capture_vernier(self, keep_open=False):
+        """
+        Start capturing from all Vernier Go Direct Sensors
+        Args:
+            keep_open (bool): Keep the devices connected for the next session (set_subject(),
+                set_start_time() and start_capture_vernier() again), default: False
+        Returns:
+            Stats of the session (number of samples per device)
+        """
+        if self.record_start_time is None:
+            raise ValueError("No start time. Use set_start_time() first.")
+
+        self.errors = {}
+        self.stats = {}
+
+        self.timebase.save(
+            self.save_path + "/" + self.subject_name + "/vernier",
+            self.record_start_time,
+            self.record_end_time,
+        )
+        print(f"[VERNIER] -> Waiting for the start time at {self.record_start_time}...")
+        print(f"Time Remaining: {self.record_start_time - dt.datetime.now()}")
+        sleep_until(self.record_start_time - dt.timedelta(seconds=self.read_lead), stop_event=self.stop_event)
+
+        # release all device threads at the same instant
+        self._run_task(self._record)
+        if not keep_open:
+            self.close()
+
+        if self.errors:
+            raise RuntimeError(f"Vernier capture failed: {self.errors}")
+
+        stats = dict(self.stats)
+        stats["stopped_early"] = self.stop_event.is_set()
+        return stats
 
 
 if __name__ == "__main__":
@@ -142,50 +406,32 @@ if __name__ == "__main__":
         default=60,
     )
     parser.add_argument(
-        "--fps",
-        type=int,
-        help="Frames per second",
-        default=20,
+        "--devices",
+        type=str,
+        nargs="+",
+        choices=list(DEVICE_PRESETS),
+        help="Devices to record",
+        default=list(DEVICE_PRESETS),
+    )
+    parser.add_argument(
+        "--preroll",
+        type=float,
+        help="Seconds of samples before the start time to keep",
+        default=0,
     )
     parser.add_argument(
-        "--conn",
+        "--format",
         type=str,
-        help="Connection mode",
-        default="usb",
+        choices=["bin", "csv"],
+        help="Output format: binary columns with a JSON header (bin) or legacy CSV (csv)",
+        default="bin",
     )
     args = parser.parse_args()
-    gdx = gdx.gdx()
     VernierCapture(
         subject_name=args.name,
         record_start_time=args.stime,
+        devices=[DEVICE_PRESETS[d] for d in args.devices],
         duration=args.duration,
-        fps=args.fps,
-        connection_mode=args.conn,
+        preroll=args.preroll,
+        output_format=args.format,
     ).start_capture_vernier()
-
-    # gdx = gdx.gdx()
-    # subject_name = "bob"
-    # # record_start_time = "11:11:00"
-
-    # # for development purpose
-    # record_start_time = dt.datetime.now() + dt.timedelta(seconds=8)
-    # record_start_time = record_start_time.strftime("%H:%M:%S")
-
-    # save_path = "./dataset"
-    # duration = 10
-    # fps = 20 # bluetooth max 20
-
-    # vc = VernierCapture(
-    #     subject_name,
-    #     record_start_time,
-    #     save_path,
-    #     duration,
-    #     fps,
-    #     connection_mode="usb",
-    # )
-
-    # vc.start_capture_vernier()
-
-    # VernierCapture.integrity_check(
-    #     "dataset/alice/vernier/alice_vernier.csv"
-    # )